@@ -7,10 +7,19 @@ import os
 import re
 from collections import Counter, defaultdict
 
-try:
-    import matplotlib.pyplot as plt
-except ImportError:
-    plt = None
+# matplotlib is imported by load_pyplot() when the first plot is drawn.
+plt = None
+
+
+def load_pyplot():
+    """Return matplotlib.pyplot, or None when matplotlib is not installed."""
+    global plt
+    if plt is None:
+        try:
+            import matplotlib.pyplot as plt
+        except ImportError:
+            return None
+    return plt
 
 
 def reverse_complement_seq(seq):
@@ -127,7 +136,7 @@ def final_barcode_distribution(bc_type_list, output_path):
         for label, size in zip(labels, sizes):
             handle.write("{0}\t{1}\n".format(label, size))
 
-    if plt is None or not sizes:
+    if load_pyplot() is None or not sizes:
         return
 
     plt.figure(figsize=(10, 6))
@@ -141,7 +150,7 @@ def final_barcode_distribution(bc_type_list, output_path):
 def umi_distribution_pie(umi_list, output_path):
     umi_list = [value for value in umi_list if value is not None]
 
-    if plt is None or not umi_list:
+    if load_pyplot() is None or not umi_list:
         return
 
     min_umi = min(umi_list)
@@ -316,7 +325,7 @@ def main(args):
     print("Analysis complete")
 
 
-if __name__ == "__main__":
+def build_parser():
     parser = argparse.ArgumentParser(description="Process barcode and UMI data.")
     parser.add_argument("--input", required=True)
     parser.add_argument("--bc14", required=True)
@@ -339,5 +348,9 @@ if __name__ == "__main__":
         default=3,
         help="Minimum top barcode UMI count required for a final assignment.",
     )
-    args = parser.parse_args()
+    return parser
+
+
+if __name__ == "__main__":
+    args = build_parser().parse_args()
     main(args)
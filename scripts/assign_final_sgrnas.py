@@ -3,14 +3,41 @@
 
 import argparse
 import csv
+import gzip
 import os
 import re
 from collections import Counter, defaultdict
 
-try:
-    import matplotlib.pyplot as plt
-except ImportError:
-    plt = None
+# matplotlib is imported by load_pyplot() when the first plot is drawn.
+plt = None
+
+# numpy and scipy are only needed for --guide_calling sparse; see load_sparse_modules().
+np = None
+scipy_io = None
+sparse = None
+
+
+def load_pyplot():
+    """Return matplotlib.pyplot, or None when matplotlib is not installed."""
+    global plt
+    if plt is None:
+        try:
+            import matplotlib.pyplot as plt
+        except ImportError:
+            return None
+    return plt
+
+
+def load_sparse_modules():
+    global np, scipy_io, sparse
+    if sparse is not None:
+        return
+    try:
+        import numpy as np
+        from scipy import io as scipy_io
+        from scipy import sparse
+    except ImportError as exc:
+        raise ModuleNotFoundError("Sparse guide calling requires numpy and scipy.") from exc
 
 
 def reverse_complement_seq(seq):
@@ -103,7 +130,7 @@ def final_sgrna_distribution(sgrna_type_list, output_path):
         for label, size in zip(labels, sizes):
             handle.write("{0}\t{1}\n".format(label, size))
 
-    if plt is None or not sizes:
+    if load_pyplot() is None or not sizes:
         return
 
     plt.figure(figsize=(10, 6))
@@ -117,7 +144,7 @@ def final_sgrna_distribution(sgrna_type_list, output_path):
 def umi_distribution_pie(umi_list, output_path):
     umi_list = [value for value in umi_list if value is not None]
 
-    if plt is None or not umi_list:
+    if load_pyplot() is None or not umi_list:
         return
 
     min_umi = min(umi_list) if umi_list else 0
@@ -258,18 +285,219 @@ def write_cell_sgrna_table(rows, output_path):
             ])
 
 
+def load_hit_matrix(input_path, sgrna_dict):
+    """
+    Build a cell x guide UMI matrix from the sgRNA hit table.
+    Returns (csr_matrix, cells, guides) with cells and guides sorted.
+    """
+    cell_codes = {}
+    guide_codes = {}
+    row_codes = []
+    col_codes = []
+    umis = []
+
+    with open(input_path, "r") as handle:
+        reader = csv.DictReader(handle, delimiter="\t")
+        required_cols = ["cell", "umi", "sgrna"]
+        missing_cols = [column for column in required_cols if column not in (reader.fieldnames or [])]
+        if missing_cols:
+            raise ValueError("Missing columns: {0}".format(missing_cols))
+
+        for row in reader:
+            cell = str(row["cell"]).strip()
+            sgrna_seq = str(row["sgrna"]).strip()
+            if not cell or is_missing(sgrna_seq):
+                continue
+            sgrna_id = sgrna_dict.get(sgrna_seq, sgrna_seq)
+            row_codes.append(cell_codes.setdefault(cell, len(cell_codes)))
+            col_codes.append(guide_codes.setdefault(sgrna_id, len(guide_codes)))
+            umis.append(int(row["umi"]))
+
+    cells = sorted(cell_codes)
+    guides = sorted(guide_codes)
+    cell_order = np.empty(len(cells), dtype=np.int64)
+    cell_order[[cell_codes[cell] for cell in cells]] = np.arange(len(cells))
+    guide_order = np.empty(len(guides), dtype=np.int64)
+    guide_order[[guide_codes[guide] for guide in guides]] = np.arange(len(guides))
+
+    # Several R2 sequences can hit the same guide in a cell; COO -> CSR sums them.
+    matrix = sparse.coo_matrix(
+        (
+            np.asarray(umis, dtype=np.int64),
+            (cell_order[np.asarray(row_codes, dtype=np.int64)], guide_order[np.asarray(col_codes, dtype=np.int64)]),
+        ),
+        shape=(len(cells), len(guides)),
+    ).tocsr()
+    matrix.sum_duplicates()
+    return matrix, cells, guides
+
+
+def otsu_split(values, bins=64):
+    """
+    Return the Otsu split of log1p(values) back on the UMI scale, with the
+    median UMI count of the cells below and above it.
+    """
+    logged = np.log1p(values)
+    counts, edges = np.histogram(logged, bins=bins)
+    centers = (edges[:-1] + edges[1:]) / 2.0
+    weight_low = np.cumsum(counts)
+    weight_high = weight_low[-1] - weight_low
+    mass_low = np.cumsum(counts * centers)
+    mean_low = mass_low / np.maximum(weight_low, 1)
+    mean_high = (mass_low[-1] - mass_low) / np.maximum(weight_high, 1)
+    between = weight_low * weight_high * (mean_low - mean_high) ** 2
+    threshold = float(np.expm1(edges[int(np.argmax(between)) + 1]))
+    below = values[values <= threshold]
+    above = values[values > threshold]
+    if not len(below) or not len(above):
+        return threshold, 0.0, 0.0
+    return threshold, float(np.median(below)), float(np.median(above))
+
+
+def per_guide_thresholds(matrix, min_umi, min_cells_for_fit=20, min_fold=8.0, background_fold=3.0):
+    """
+    Compute one UMI threshold per guide: the Otsu split between background and
+    expressing cells when a guide is seen in enough cells, never below min_umi.
+
+    Otsu splits any distribution in two, so the split is only used when the
+    classes look like background and signal: the upper class is min_fold times
+    the lower one, or background_fold times a lower class at or below min_umi.
+    Unimodal guides keep min_umi.
+    """
+    thresholds = np.full(matrix.shape[1], float(min_umi))
+    by_guide = matrix.tocsc()
+    nonzero_cells = np.diff(by_guide.indptr)
+    for guide in np.flatnonzero(nonzero_cells >= min_cells_for_fit):
+        values = by_guide.data[by_guide.indptr[guide]:by_guide.indptr[guide + 1]]
+        if values.max() <= values.min():
+            continue
+        threshold, low, high = otsu_split(values)
+        fold = high / max(low, 1.0)
+        if fold >= min_fold or (low <= min_umi and fold >= background_fold):
+            thresholds[guide] = max(float(min_umi), np.ceil(threshold))
+    return thresholds
+
+
+def call_guides(matrix, thresholds, min_total_umi, min_fraction):
+    """
+    Call every guide in each cell whose UMI count reaches its guide threshold
+    and the given fraction of the cell's guide UMIs. Cells with fewer than
+    min_total_umi guide UMIs get no calls. Returns a boolean CSR mask.
+    """
+    cell_totals = np.asarray(matrix.sum(axis=1)).ravel()
+    entry_totals = np.repeat(cell_totals, np.diff(matrix.indptr))
+    passed = (
+        (matrix.data >= thresholds[matrix.indices])
+        & (matrix.data >= min_fraction * entry_totals)
+        & (entry_totals >= min_total_umi)
+    )
+    called = sparse.csr_matrix(
+        (passed, matrix.indices.copy(), matrix.indptr.copy()),
+        shape=matrix.shape,
+    )
+    called.eliminate_zeros()
+    return called
+
+
+def summarize_sparse_calls(matrix, called, cells, guides):
+    """Convert sparse guide calls into the per-cell rows used by the writers."""
+    rows = []
+    guide_names = np.asarray(guides, dtype=object)
+    for index, cell in enumerate(cells):
+        start, end = matrix.indptr[index], matrix.indptr[index + 1]
+        order = np.lexsort((guide_names[matrix.indices[start:end]], -matrix.data[start:end]))
+        umi_values = matrix.data[start:end][order].tolist()
+        sgrna_values = guide_names[matrix.indices[start:end]][order].tolist()
+
+        call_start, call_end = called.indptr[index], called.indptr[index + 1]
+        called_guides = set(guide_names[called.indices[call_start:call_end]])
+        calls = [guide for guide in sgrna_values if guide in called_guides]
+        call_umis = [umi for guide, umi in zip(sgrna_values, umi_values) if guide in called_guides]
+
+        if not calls:
+            final_sgrna = "NA"
+        elif len(calls) == 1:
+            final_sgrna = calls[0]
+        else:
+            final_sgrna = "multi_sgrna"
+
+        rows.append(
+            {
+                "cell": cell,
+                "sgrna": sgrna_values,
+                "umi": umi_values,
+                "calls": calls,
+                "call_umis": call_umis,
+                "final_assigned_sgrna": final_sgrna,
+                "umi_count": call_umis[0] if call_umis else (umi_values[0] if umi_values else 0),
+                "sgrna_type": final_assigned_type(final_sgrna),
+            }
+        )
+    return rows
+
+
+def write_feature_bc_matrix(matrix, cells, guides, output_dir):
+    """Write a 10x-compatible feature-barcode matrix (features x barcodes)."""
+    os.makedirs(output_dir, exist_ok=True)
+    with gzip.open(os.path.join(output_dir, "barcodes.tsv.gz"), "wt") as handle:
+        for cell in cells:
+            handle.write("{0}-1\n".format(cell))
+    with gzip.open(os.path.join(output_dir, "features.tsv.gz"), "wt") as handle:
+        for guide in guides:
+            handle.write("{0}\t{0}\tCRISPR Guide Capture\n".format(guide))
+    with gzip.open(os.path.join(output_dir, "matrix.mtx.gz"), "wb") as handle:
+        scipy_io.mmwrite(handle, matrix.T.tocoo(), field="integer")
+
+
+def write_guide_calls(rows, output_path):
+    with open(output_path, "w", newline="") as handle:
+        writer = csv.writer(handle, delimiter="\t")
+        writer.writerow(["cell_barcode", "num_features", "feature_call", "num_umis"])
+        for row in rows:
+            if not row["calls"]:
+                continue
+            writer.writerow([
+                "{0}-1".format(row["cell"]),
+                len(row["calls"]),
+                "|".join(row["calls"]),
+                "|".join(str(umi) for umi in row["call_umis"]),
+            ])
+
+
+def sparse_guide_calling(args, sgrna_dict):
+    load_sparse_modules()
+
+    matrix, cells, guides = load_hit_matrix(args.input, sgrna_dict)
+    thresholds = per_guide_thresholds(matrix, args.assignment_min_top_umi)
+    called = call_guides(
+        matrix,
+        thresholds,
+        args.assignment_min_total_umi,
+        args.min_guide_fraction,
+    )
+
+    if args.feature_matrix_dir:
+        write_feature_bc_matrix(matrix, cells, guides, args.feature_matrix_dir)
+    return summarize_sparse_calls(matrix, called, cells, guides)
+
+
 def main(args):
     if not os.path.exists(args.input):
         raise FileNotFoundError(args.input)
 
     sgrna_dict = load_sgrna_file(args.sgrna_file, reverse_complement=args.rc)
 
-    grouped = load_assignments(args.input, sgrna_dict)
-    rows = summarize_cells(
-        grouped,
-        min_total_umi=args.assignment_min_total_umi,
-        min_top_umi=args.assignment_min_top_umi,
-    )
+    if args.guide_calling == "sparse":
+        rows = sparse_guide_calling(args, sgrna_dict)
+        if args.guide_calls:
+            write_guide_calls(rows, args.guide_calls)
+    else:
+        grouped = load_assignments(args.input, sgrna_dict)
+        rows = summarize_cells(
+            grouped,
+            min_total_umi=args.assignment_min_total_umi,
+            min_top_umi=args.assignment_min_top_umi,
+        )
 
     if args.debug_csv:
         write_debug_csv(rows, args.debug_csv)
@@ -289,7 +517,7 @@ def main(args):
     print("Analysis complete")
 
 
-if __name__ == "__main__":
+def build_parser():
     parser = argparse.ArgumentParser(description="Process sgRNA and UMI data.")
     parser.add_argument("--input", required=True)
     parser.add_argument("--sgrna_file", required=True)
@@ -311,5 +539,23 @@ if __name__ == "__main__":
         default=3,
         help="Minimum top sgRNA UMI count required for a final assignment.",
     )
-    args = parser.parse_args()
+    parser.add_argument(
+        "--guide_calling",
+        default="dominant",
+        choices=["dominant", "sparse"],
+        help="'dominant' keeps one guide per cell; 'sparse' calls every guide above its per-guide threshold (high-MOI screens).",
+    )
+    parser.add_argument(
+        "--min_guide_fraction",
+        type=float,
+        default=0.0,
+        help="Sparse calling: minimum fraction of a cell's guide UMIs a called guide must carry.",
+    )
+    parser.add_argument("--feature_matrix_dir", default=None, help="Sparse calling: write a 10x-style feature-barcode matrix here.")
+    parser.add_argument("--guide_calls", default=None, help="Sparse calling: per-cell table of all called guides.")
+    return parser
+
+
+if __name__ == "__main__":
+    args = build_parser().parse_args()
     main(args)
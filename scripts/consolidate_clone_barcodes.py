@@ -0,0 +1,337 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+import argparse
+import csv
+import os
+import re
+from collections import Counter, defaultdict
+
+
+BC14_ID_PATTERN = re.compile(r"bc14-\d+", re.IGNORECASE)
+BC30_ID_PATTERN = re.compile(r"bc30-\d+", re.IGNORECASE)
+REFERENCE_NAME_PATTERN = re.compile(r"bc14-\d+_bc30-\d+", re.IGNORECASE)
+
+
+def reverse_complement_seq(seq):
+    complement = str.maketrans("ACGTacgt", "TGCAtgca")
+    return str(seq).translate(complement)[::-1]
+
+
+def load_barcode_file(filename, reverse_complement=False):
+    seq_candidates = ["BC14 sequence", "BC30 sequence", "BC sequence"]
+    id_candidates = ["#BC14 ID", "#BC30 ID", "BC14 ID", "BC30 ID", "BC ID"]
+
+    with open(filename, "r") as handle:
+        reader = csv.DictReader(handle, delimiter="\t")
+        fieldnames = reader.fieldnames or []
+
+        seq_col = next((column for column in seq_candidates if column in fieldnames), None)
+        id_col = next((column for column in id_candidates if column in fieldnames), None)
+
+        if seq_col is None:
+            raise ValueError("Cannot find barcode sequence column in {0}".format(filename))
+
+        if id_col is None:
+            raise ValueError("Cannot find barcode ID column in {0}".format(filename))
+
+        result = {}
+        for row in reader:
+            sequence = str(row.get(seq_col, "")).strip()
+            barcode_id = str(row.get(id_col, "")).strip()
+            if not sequence:
+                continue
+            if reverse_complement:
+                sequence = reverse_complement_seq(sequence)
+            result[barcode_id] = sequence
+    return result
+
+
+def bounded_edit_distance(first, second, max_distance):
+    """
+    Return the Levenshtein distance between two sequences, or max_distance + 1
+    as soon as the distance is known to exceed max_distance. Only a diagonal
+    band of width 2 * max_distance + 1 is evaluated.
+    """
+    if abs(len(first) - len(second)) > max_distance:
+        return max_distance + 1
+    if first == second:
+        return 0
+
+    over = max_distance + 1
+    previous = [column if column <= max_distance else over for column in range(len(second) + 1)]
+    for row in range(1, len(first) + 1):
+        low = max(1, row - max_distance)
+        high = min(len(second), row + max_distance)
+        current = [over] * (len(second) + 1)
+        if row <= max_distance:
+            current[0] = row
+        char = first[row - 1]
+        for column in range(low, high + 1):
+            cost = 0 if second[column - 1] == char else 1
+            current[column] = min(
+                previous[column] + 1,
+                current[column - 1] + 1,
+                previous[column - 1] + cost,
+                over,
+            )
+        if min(current[low - 1:high + 1]) > max_distance:
+            return over
+        previous = current
+    return previous[len(second)]
+
+
+def deletion_variants(sequence, max_deletions):
+    """Return every string reachable from sequence by deleting up to max_deletions bases."""
+    variants = {sequence}
+    frontier = {sequence}
+    for _ in range(max_deletions):
+        frontier = {
+            variant[:index] + variant[index + 1:]
+            for variant in frontier
+            for index in range(len(variant))
+        }
+        variants.update(frontier)
+    return variants
+
+
+class DeletionNeighborhoodIndex:
+    """
+    Symmetric deletion-neighborhood index over reference barcode sequences.
+
+    Two sequences within edit distance k always share a string obtained by
+    deleting at most k bases from each, so a query only has to verify the
+    references found under its own deletion variants instead of comparing
+    against every reference.
+    """
+
+    def __init__(self, reference, max_distance):
+        self.max_distance = max_distance
+        self.reference = dict(reference)
+        self.variants = defaultdict(set)
+        for barcode_id, sequence in self.reference.items():
+            for variant in deletion_variants(sequence, max_distance):
+                self.variants[variant].add(barcode_id)
+        self.cache = {}
+
+    def nearest(self, query):
+        """
+        Return (barcode_id, distance) for the unique closest reference within
+        max_distance, or ("", distance) when nothing is close enough or the
+        closest references are tied.
+        """
+        if query in self.cache:
+            return self.cache[query]
+
+        candidates = set()
+        for variant in deletion_variants(query, self.max_distance):
+            candidates.update(self.variants.get(variant, ()))
+
+        best_ids = []
+        best_distance = self.max_distance + 1
+        for barcode_id in candidates:
+            distance = bounded_edit_distance(query, self.reference[barcode_id], self.max_distance)
+            # Shared deletion variants only bound the distance by 2 * max_distance.
+            if distance > self.max_distance:
+                continue
+            if distance < best_distance:
+                best_ids = [barcode_id]
+                best_distance = distance
+            elif distance == best_distance:
+                best_ids.append(barcode_id)
+
+        result = (best_ids[0], best_distance) if len(best_ids) == 1 else ("", best_distance)
+        self.cache[query] = result
+        return result
+
+
+def load_summary(summary_path):
+    with open(summary_path, "r") as handle:
+        reader = csv.DictReader(handle, delimiter="\t")
+        required = ["cell", "final_assigned_barcode", "umi_count", "barcode_type"]
+        missing = [column for column in required if column not in (reader.fieldnames or [])]
+        if missing:
+            raise ValueError("Missing columns in {0}: {1}".format(summary_path, missing))
+        return list(reader)
+
+
+def split_barcode_name(name):
+    """Split a final assignment name into its BC14 and BC30 components."""
+    left, separator, right = str(name).partition("_")
+    if not separator:
+        return None
+    return left, right
+
+
+def observed_reference_ids(rows):
+    """Collect the BC14 and BC30 IDs present in exact (non-mutant) assignments."""
+    bc14_ids = set()
+    bc30_ids = set()
+    for row in rows:
+        name = row["final_assigned_barcode"]
+        if not REFERENCE_NAME_PATTERN.fullmatch(name):
+            continue
+        left, right = split_barcode_name(name)
+        bc14_ids.add(left)
+        bc30_ids.add(right)
+    return bc14_ids, bc30_ids
+
+
+def snap_component(component, id_pattern, index):
+    """Return (reference_id, distance) for one name component, or ("", -1) when unresolved."""
+    if id_pattern.fullmatch(component):
+        return component, 0
+    if index is None:
+        return "", -1
+    barcode_id, distance = index.nearest(component.upper())
+    if not barcode_id:
+        return "", -1
+    return barcode_id, distance
+
+
+def consolidate_names(rows, bc14_index, bc30_index):
+    """
+    Map every distinct mutant assignment name onto a reference BC14-BC30 name.
+    Returns {original_name: (consolidated_name, bc14_distance, bc30_distance)}.
+    """
+    mapping = {}
+    for row in rows:
+        name = row["final_assigned_barcode"]
+        if name in mapping or row["barcode_type"] != "One Barcode with mutant":
+            continue
+
+        parts = split_barcode_name(name)
+        if parts is None:
+            mapping[name] = (name, -1, -1)
+            continue
+
+        bc14_id, bc14_distance = snap_component(parts[0], BC14_ID_PATTERN, bc14_index)
+        bc30_id, bc30_distance = snap_component(parts[1], BC30_ID_PATTERN, bc30_index)
+        if bc14_id and bc30_id:
+            mapping[name] = ("{0}_{1}".format(bc14_id, bc30_id), bc14_distance, bc30_distance)
+        else:
+            mapping[name] = (name, bc14_distance, bc30_distance)
+    return mapping
+
+
+def consolidated_type(name, original_type):
+    if original_type == "One Barcode with mutant" and REFERENCE_NAME_PATTERN.fullmatch(name):
+        return "One Barcode"
+    return original_type
+
+
+def write_mapping(mapping, cell_counts, output_path):
+    with open(output_path, "w", newline="") as handle:
+        writer = csv.writer(handle, delimiter="\t")
+        writer.writerow([
+            "original_barcode",
+            "consolidated_barcode",
+            "bc14_distance",
+            "bc30_distance",
+            "cells",
+            "status",
+        ])
+        for name in sorted(mapping, key=lambda item: (-cell_counts[item], item)):
+            consolidated, bc14_distance, bc30_distance = mapping[name]
+            writer.writerow([
+                name,
+                consolidated,
+                bc14_distance,
+                bc30_distance,
+                cell_counts[name],
+                "snapped" if consolidated != name else "unresolved",
+            ])
+
+
+def write_consolidated_summary(rows, mapping, output_path):
+    with open(output_path, "w", newline="") as handle:
+        writer = csv.writer(handle, delimiter="\t")
+        writer.writerow(["cell", "final_assigned_barcode", "umi_count", "barcode_type"])
+        for row in rows:
+            name = row["final_assigned_barcode"]
+            consolidated = mapping.get(name, (name,))[0]
+            writer.writerow([
+                row["cell"],
+                consolidated,
+                row["umi_count"],
+                consolidated_type(consolidated, row["barcode_type"]),
+            ])
+
+
+def write_clone_sizes(rows, mapping, output_path):
+    clone_sizes = Counter()
+    for row in rows:
+        if row["barcode_type"] not in ("One Barcode", "One Barcode with mutant"):
+            continue
+        name = row["final_assigned_barcode"]
+        clone_sizes[mapping.get(name, (name,))[0]] += 1
+
+    with open(output_path, "w", newline="") as handle:
+        writer = csv.writer(handle, delimiter="\t")
+        writer.writerow(["clone_barcode", "cell_count"])
+        for name, count in sorted(clone_sizes.items(), key=lambda item: (-item[1], item[0])):
+            writer.writerow([name, count])
+
+
+def main(args):
+    for file_path in [args.summary, args.bc14, args.bc30]:
+        if not os.path.isfile(file_path):
+            raise FileNotFoundError("File not found: {0}".format(file_path))
+    if args.max_distance < 0:
+        raise ValueError("--max_distance must be >= 0")
+
+    rows = load_summary(args.summary)
+    bc14_reference = load_barcode_file(args.bc14, reverse_complement=args.rc)
+    bc30_reference = load_barcode_file(args.bc30, reverse_complement=args.rc)
+
+    if not args.index_full_library:
+        # Snapping onto clones already seen in the sample keeps the index small
+        # and avoids inventing clones that were never observed without errors.
+        bc14_ids, bc30_ids = observed_reference_ids(rows)
+        bc14_reference = {key: value for key, value in bc14_reference.items() if key in bc14_ids}
+        bc30_reference = {key: value for key, value in bc30_reference.items() if key in bc30_ids}
+
+    bc14_index = None
+    bc30_index = None
+    if args.max_distance > 0:
+        bc14_index = DeletionNeighborhoodIndex(bc14_reference, args.max_distance)
+        bc30_index = DeletionNeighborhoodIndex(bc30_reference, args.max_distance)
+
+    mapping = consolidate_names(rows, bc14_index, bc30_index)
+    cell_counts = Counter(row["final_assigned_barcode"] for row in rows)
+
+    write_mapping(mapping, cell_counts, args.mapping)
+    write_consolidated_summary(rows, mapping, args.output)
+    write_clone_sizes(rows, mapping, args.clone_sizes)
+
+    snapped = sum(1 for name, value in mapping.items() if value[0] != name)
+    print("Snapped {0} of {1} mutant barcode names".format(snapped, len(mapping)))
+    print("Output written to {0}".format(args.output))
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Consolidate mutant CloneTracker barcode names onto reference clones.")
+    parser.add_argument("--summary", required=True, help="Barcode assignment summary from assign_final_barcodes.py.")
+    parser.add_argument("--bc14", required=True, help="BC14 reference file.")
+    parser.add_argument("--bc30", required=True, help="BC30 reference file.")
+    parser.add_argument("--rc", action="store_true", help="Apply reverse and complementary transformation to barcodes.")
+    parser.add_argument("--output", required=True, help="Consolidated assignment summary.")
+    parser.add_argument("--mapping", default="clone_consolidation_map.tsv", help="Mutant-to-reference mapping table.")
+    parser.add_argument("--clone_sizes", default="consolidated_clone_sizes.tsv", help="Consolidated clone size table.")
+    parser.add_argument(
+        "--max_distance",
+        type=int,
+        default=2,
+        help="Maximum edit distance between a mutant component and its reference barcode. Use 0 to disable snapping.",
+    )
+    parser.add_argument(
+        "--index_full_library",
+        action="store_true",
+        help="Index every reference barcode instead of only those observed in exact assignments.",
+    )
+    return parser
+
+
+if __name__ == "__main__":
+    args = build_parser().parse_args()
+    main(args)
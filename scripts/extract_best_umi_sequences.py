@@ -13,9 +13,16 @@ def extract_umi_from_header(header_str):
     return parts[1] + parts[2].split(" ", 1)[0]
 
 
+def open_fastq(input_file):
+    """Open gzipped FASTQ by extension, anything else (including a named pipe) as plain text."""
+    if str(input_file).endswith(".gz"):
+        return gzip.open(input_file, "rt")
+    return open(input_file, "r")
+
+
 def iter_fastq_sequences(input_file):
     """Yield FASTQ header and sequence using a lightweight 4-line parser."""
-    with gzip.open(input_file, "rt") as handle:
+    with open_fastq(input_file) as handle:
         while True:
             header = handle.readline()
             if not header:
@@ -50,9 +57,17 @@ def process_fastq(input_file, output_file):
     print("Processing complete. Results saved to {0}".format(output_file))
 
 
-if __name__ == "__main__":
+def main(args):
+    process_fastq(args.input, args.output)
+
+
+def build_parser():
     parser = argparse.ArgumentParser(description="Process an NGS FASTQ file to extract UMI sequences.")
-    parser.add_argument("-i", "--input", required=True, help="Input FASTQ file (gzipped).")
+    parser.add_argument("-i", "--input", required=True, help="Input FASTQ file, gzipped if it ends in .gz, otherwise plain text or a named pipe.")
     parser.add_argument("-o", "--output", required=True, help="Output file for UMI sequences.")
-    args = parser.parse_args()
-    process_fastq(args.input, args.output)
+    return parser
+
+
+if __name__ == "__main__":
+    args = build_parser().parse_args()
+    main(args)
@@ -3,7 +3,17 @@
 import argparse
 import csv
 import os
+import sys
 from collections import defaultdict
+from pathlib import Path
+
+
+# Run from a source checkout without installing the package.
+SRC = Path(__file__).resolve().parents[1] / "src"
+if SRC.is_dir() and str(SRC) not in sys.path:
+    sys.path.insert(0, str(SRC))
+
+from cellecta_sc_pipeline.shared.checkpoints import input_fingerprint, positive_int, write_hits, write_hits_checkpointed
 
 
 def reverse_complement_seq(seq):
@@ -61,6 +71,21 @@ def load_barcodes(filename, reverse_complement=False):
     return barcode_set
 
 
+REFERENCE_CACHE = {}
+
+
+def load_reference_cached(loader, filename, reverse_complement=False):
+    """
+    Memoize a reference loader on the file's path, size and mtime, so that
+    references are parsed once when this script runs in-process for many samples.
+    """
+    stat = os.stat(filename)
+    key = (loader.__name__, os.path.abspath(filename), stat.st_size, stat.st_mtime_ns, reverse_complement)
+    if key not in REFERENCE_CACHE:
+        REFERENCE_CACHE[key] = loader(filename, reverse_complement=reverse_complement)
+    return REFERENCE_CACHE[key]
+
+
 def load_whitelist(whitelist_path):
     whitelist = set()
     with open(whitelist_path, "r") as handle:
@@ -101,8 +126,8 @@ def load_cell_sequence_counts(cell_umi_path, whitelist_set):
     return cell_sequence_counts
 
 
-def iter_barcode_hits(cell_sequence_counts, bc14_patterns, bc30_patterns, umi_cutoff):
-    for cell in sorted(cell_sequence_counts):
+def iter_barcode_hits(cell_sequence_counts, bc14_patterns, bc30_patterns, umi_cutoff, cells=None):
+    for cell in sorted(cell_sequence_counts) if cells is None else cells:
         sequence_counts = cell_sequence_counts[cell]
         ranked_pairs = sorted(
             sequence_counts.items(),
@@ -123,31 +148,37 @@ def main(args):
     whitelist_set = load_whitelist(args.whitelist)
     cell_sequence_counts = load_cell_sequence_counts(args.cell_umi, whitelist_set)
 
-    bc14_patterns = load_barcodes(args.bc14_file, reverse_complement=args.rc)
-    bc30_patterns = load_barcodes(args.bc30_file, reverse_complement=args.rc)
+    bc14_patterns = load_reference_cached(load_barcodes, args.bc14_file, reverse_complement=args.rc)
+    bc30_patterns = load_reference_cached(load_barcodes, args.bc30_file, reverse_complement=args.rc)
+
+    header = "cell\tR2_sequence\tbc14\tbc30\tumi\n"
 
-    with open(args.output, "w") as output:
-        output.write("cell\tR2_sequence\tbc14\tbc30\tumi\n")
-        for cell, sequence, bc14_match, bc30_match, umi in iter_barcode_hits(
-            cell_sequence_counts,
-            bc14_patterns,
-            bc30_patterns,
+    def hits_for_cells(cells):
+        return iter_barcode_hits(cell_sequence_counts, bc14_patterns, bc30_patterns, args.umi_cutoff, cells)
+
+    if args.checkpoint_dir:
+        fingerprint = input_fingerprint(
+            [args.cell_umi, args.whitelist, args.bc14_file, args.bc30_file],
             args.umi_cutoff,
-        ):
-            output.write(
-                "{0}\t{1}\t{2}\t{3}\t{4}\n".format(
-                    cell,
-                    sequence,
-                    bc14_match,
-                    bc30_match,
-                    umi,
-                )
-            )
+            args.rc,
+            args.checkpoint_cells,
+        )
+        write_hits_checkpointed(
+            args.output,
+            header,
+            sorted(cell_sequence_counts),
+            hits_for_cells,
+            args.checkpoint_dir,
+            args.checkpoint_cells,
+            fingerprint,
+        )
+    else:
+        write_hits(args.output, header, hits_for_cells(None))
 
     print("Output written to {0}".format(args.output))
 
 
-if __name__ == "__main__":
+def build_parser():
     parser = argparse.ArgumentParser(description="Process cell-UMI data and assign barcodes.")
     parser.add_argument("--cell_umi", required=True, help="Path to the cell_umi file.")
     parser.add_argument("--bc14_file", required=True, help="Path to the BC14 barcode file.")
@@ -161,5 +192,15 @@ if __name__ == "__main__":
         help="Minimum per-cell UMI count to keep barcode candidates in the exported table. Use 0 to keep all candidates.",
     )
     parser.add_argument("--rc", action="store_true", help="Apply reverse and complementary transformation to barcodes.")
-    args = parser.parse_args()
+    parser.add_argument(
+        "--checkpoint_dir",
+        default=None,
+        help="Write output in chunks of cells committed under this directory so an interrupted run resumes.",
+    )
+    parser.add_argument("--checkpoint_cells", type=positive_int, default=20000, help="Cells per checkpointed chunk.")
+    return parser
+
+
+if __name__ == "__main__":
+    args = build_parser().parse_args()
     main(args)
@@ -3,7 +3,29 @@
 import argparse
 import csv
 import os
-from collections import defaultdict
+import re
+import sys
+from collections import defaultdict, namedtuple
+from pathlib import Path
+
+
+# Run from a source checkout without installing the package.
+SRC = Path(__file__).resolve().parents[1] / "src"
+if SRC.is_dir() and str(SRC) not in sys.path:
+    sys.path.insert(0, str(SRC))
+
+from cellecta_sc_pipeline.shared.checkpoints import input_fingerprint, positive_int, write_hits, write_hits_checkpointed
+
+
+FEATURE_PATTERN = re.compile(
+    r"^(?P<start>\^|5P)?(?P<left>[ACGTN]*)\(BC\)(?P<right>[ACGTN]*)(?P<end>\$|3P)?$",
+    re.IGNORECASE,
+)
+MIN_ANCHOR_LENGTH = 6
+
+# kind is "left"/"right" for a constant flank found by substring search, or
+# "start"/"end" for a guide at a fixed distance from a read end.
+FeatureAnchor = namedtuple("FeatureAnchor", ["kind", "constant", "gap"])
 
 
 def reverse_complement_seq(seq):
@@ -22,21 +44,52 @@ def filter_sequences_by_umi(sequence_umi_pairs, umi_cutoff):
     ]
 
 
-def find_sgrna_match(sequence, sgrna_set, sgrna_lengths):
+def build_prefix_index(sgrna_set, sgrna_lengths):
     """
-    Return the first exact sgRNA match found in a sliding window search.
-    Checks for multiple possible lengths if the reference has them.
+    Index sgRNAs by their prefix of the shortest guide length.
+    Returns (prefix_length, longest_length, {prefix: lengths}) with lengths
+    sorted descending.
     """
-    for barcode_length in sgrna_lengths:
-        if len(sequence) < barcode_length:
-            continue
+    if not sgrna_lengths:
+        return 0, 0, {}
+
+    prefix_length = min(sgrna_lengths)
+    prefix_lengths = defaultdict(set)
+    for sequence in sgrna_set:
+        prefix_lengths[sequence[:prefix_length]].add(len(sequence))
+
+    return prefix_length, max(sgrna_lengths), {
+        prefix: tuple(sorted(lengths, reverse=True))
+        for prefix, lengths in prefix_lengths.items()
+    }
 
-        max_index = len(sequence) - barcode_length + 1
-        for index in range(max_index):
+
+def find_sgrna_match(sequence, sgrna_set, prefix_index):
+    """
+    Return the exact sgRNA match found in a single sliding window pass.
+    Each offset costs one prefix probe; full-length candidates are only built
+    on a prefix hit. Longer guides win over shorter ones, and among guides of
+    the same length the leftmost match wins.
+    """
+    prefix_length, longest, prefix_lengths = prefix_index
+    if not prefix_length or len(sequence) < prefix_length:
+        return ""
+
+    best = ""
+    for index in range(len(sequence) - prefix_length + 1):
+        lengths = prefix_lengths.get(sequence[index:index + prefix_length])
+        if lengths is None:
+            continue
+        for barcode_length in lengths:
+            if barcode_length <= len(best):
+                break
             candidate = sequence[index:index + barcode_length]
-            if candidate in sgrna_set:
-                return candidate
-    return ""
+            if len(candidate) == barcode_length and candidate in sgrna_set:
+                best = candidate
+                break
+        if len(best) == longest:
+            break
+    return best
 
 
 def load_sgrnas(filename, reverse_complement=False):
@@ -75,6 +128,160 @@ def load_sgrnas(filename, reverse_complement=False):
     return sgrna_set, sorted(list(sgrna_lengths), reverse=True)
 
 
+def reverse_complement_pattern(pattern):
+    """Reverse-complement a feature pattern so it applies to the opposite strand."""
+    match = FEATURE_PATTERN.match(pattern)
+    start = "5P" if match.group("end") else ""
+    end = "3P" if match.group("start") else ""
+    left = reverse_complement_seq(match.group("right").upper())
+    right = reverse_complement_seq(match.group("left").upper())
+    return "{0}{1}(BC){2}{3}".format(start, left, right, end)
+
+
+def compile_feature_pattern(pattern, reverse_complement=False):
+    """
+    Compile a 10x feature reference pattern such as `(BC)`,
+    `5PNNNN(BC)` or `TTGGAAAGGACGAAACACCG(BC)GTTTAAGAGC` into a FeatureAnchor.
+    Returns None when the pattern carries nothing to anchor on.
+    """
+    pattern = str(pattern).strip()
+    if not FEATURE_PATTERN.match(pattern):
+        raise ValueError("Unsupported feature pattern: {0}".format(pattern))
+    if reverse_complement:
+        pattern = reverse_complement_pattern(pattern)
+
+    match = FEATURE_PATTERN.match(pattern)
+    left = match.group("left").upper()
+    right = match.group("right").upper()
+
+    left_runs = [run for run in re.finditer(r"[ACGT]+", left) if len(run.group()) >= MIN_ANCHOR_LENGTH]
+    if left_runs:
+        run = left_runs[-1]
+        return FeatureAnchor("left", run.group(), len(left) - run.end())
+
+    right_runs = [run for run in re.finditer(r"[ACGT]+", right) if len(run.group()) >= MIN_ANCHOR_LENGTH]
+    if right_runs:
+        run = right_runs[0]
+        return FeatureAnchor("right", run.group(), run.start())
+
+    if match.group("start"):
+        return FeatureAnchor("start", "", len(left))
+    if match.group("end"):
+        return FeatureAnchor("end", "", len(right))
+    return None
+
+
+def load_feature_anchors(filename, reverse_complement=False):
+    """
+    Group R2 guides of a feature reference by their compiled pattern.
+    Returns (anchors, has_unanchored) where anchors is a list of
+    (FeatureAnchor, guide set, lengths descending) and has_unanchored tells
+    whether some guides can only be found by the sliding window scan.
+    """
+    guides_by_anchor = defaultdict(set)
+    has_unanchored = False
+
+    with open(filename, "r") as handle:
+        sample_line = handle.readline()
+        delimiter = "\t" if "\t" in sample_line else ","
+        handle.seek(0)
+
+        reader = csv.DictReader(handle, delimiter=delimiter)
+        fieldnames = reader.fieldnames or []
+        if "pattern" not in fieldnames or "sequence" not in fieldnames:
+            raise ValueError("Feature reference {0} needs 'pattern' and 'sequence' columns".format(filename))
+
+        for row in reader:
+            sequence = str(row.get("sequence", "")).strip()
+            if not sequence:
+                continue
+            if reverse_complement:
+                sequence = reverse_complement_seq(sequence)
+
+            read = str(row.get("read", "R2")).strip().upper()
+            anchor = None
+            if read == "R2":
+                try:
+                    anchor = compile_feature_pattern(row.get("pattern", ""), reverse_complement)
+                except ValueError as exc:
+                    # Such guides are still found by the sliding window scan.
+                    print("Warning: {0} for {1}; matching it without an anchor".format(exc, row.get("id", sequence)))
+            if anchor is None:
+                has_unanchored = True
+                continue
+            guides_by_anchor[anchor].add(sequence)
+
+    anchors = [
+        (anchor, guides, sorted({len(guide) for guide in guides}, reverse=True))
+        for anchor, guides in sorted(guides_by_anchor.items(), key=lambda item: -len(item[1]))
+    ]
+    return anchors, has_unanchored
+
+
+def find_anchored_sgrna_match(sequence, anchors):
+    """
+    Locate a guide from its pattern anchor. Returns the matched guide, "" when
+    an anchor was found but the guide at that position is unknown, or None
+    when no anchor occurs in the sequence.
+    """
+    anchor_found = False
+    for anchor, guides, lengths in anchors:
+        if anchor.kind == "left":
+            position = sequence.find(anchor.constant)
+            if position < 0:
+                continue
+            begin = position + len(anchor.constant) + anchor.gap
+            candidates = (sequence[begin:begin + length] for length in lengths)
+        elif anchor.kind == "right":
+            position = sequence.find(anchor.constant)
+            if position < 0:
+                continue
+            finish = position - anchor.gap
+            candidates = (sequence[max(finish - length, 0):finish] for length in lengths)
+        elif anchor.kind == "start":
+            candidates = (sequence[anchor.gap:anchor.gap + length] for length in lengths)
+        else:
+            finish = len(sequence) - anchor.gap
+            candidates = (sequence[max(finish - length, 0):finish] for length in lengths)
+
+        anchor_found = True
+        for candidate in candidates:
+            if candidate in guides:
+                return candidate
+    return "" if anchor_found else None
+
+
+def match_sgrna(sequence, sgrna_set, prefix_index, feature_anchors=None):
+    """Try pattern anchors first and fall back to the sliding window scan."""
+    if feature_anchors:
+        anchors, has_unanchored = feature_anchors
+        match = find_anchored_sgrna_match(sequence, anchors)
+        if match or (match == "" and not has_unanchored):
+            return match
+    return find_sgrna_match(sequence, sgrna_set, prefix_index)
+
+
+def load_sgrna_reference(filename, reverse_complement=False):
+    """Return (sgrna_set, sgrna_lengths, prefix_index) for a reference file."""
+    sgrna_patterns, sgrna_lengths = load_sgrnas(filename, reverse_complement=reverse_complement)
+    return sgrna_patterns, sgrna_lengths, build_prefix_index(sgrna_patterns, sgrna_lengths)
+
+
+REFERENCE_CACHE = {}
+
+
+def load_reference_cached(loader, filename, reverse_complement=False):
+    """
+    Memoize a reference loader on the file's path, size and mtime, so that
+    references are parsed once when this script runs in-process for many samples.
+    """
+    stat = os.stat(filename)
+    key = (loader.__name__, os.path.abspath(filename), stat.st_size, stat.st_mtime_ns, reverse_complement)
+    if key not in REFERENCE_CACHE:
+        REFERENCE_CACHE[key] = loader(filename, reverse_complement=reverse_complement)
+    return REFERENCE_CACHE[key]
+
+
 def load_whitelist(whitelist_path):
     whitelist = set()
     with open(whitelist_path, "r") as handle:
@@ -115,53 +322,76 @@ def load_cell_sequence_counts(cell_umi_path, whitelist_set):
     return cell_sequence_counts
 
 
-def iter_sgrna_hits(cell_sequence_counts, sgrna_patterns, sgrna_lengths, umi_cutoff):
-    for cell in sorted(cell_sequence_counts):
+def iter_sgrna_hits(cell_sequence_counts, sgrna_patterns, prefix_index, umi_cutoff, feature_anchors=None, cells=None):
+    for cell in sorted(cell_sequence_counts) if cells is None else cells:
         sequence_counts = cell_sequence_counts[cell]
         ranked_pairs = sorted(
             sequence_counts.items(),
             key=lambda item: (-item[1], item[0]),
         )
         for sequence, umi in filter_sequences_by_umi(ranked_pairs, umi_cutoff):
-            sgrna_match = find_sgrna_match(sequence, sgrna_patterns, sgrna_lengths)
+            sgrna_match = match_sgrna(sequence, sgrna_patterns, prefix_index, feature_anchors)
             if sgrna_match:
                 yield cell, sequence, sgrna_match, umi
 
 
 def main(args):
-    for file_path in [args.cell_umi, args.sgrna_file, args.whitelist]:
+    sgrna_file = args.sgrna_file or args.feature_reference
+    if not sgrna_file:
+        raise ValueError("Provide --sgrna_file, --feature_reference, or both.")
+
+    for file_path in [args.cell_umi, sgrna_file, args.whitelist]:
         if not os.path.isfile(file_path):
             raise FileNotFoundError("File not found: {0}".format(file_path))
 
     whitelist_set = load_whitelist(args.whitelist)
     cell_sequence_counts = load_cell_sequence_counts(args.cell_umi, whitelist_set)
 
-    sgrna_patterns, sgrna_lengths = load_sgrnas(args.sgrna_file, reverse_complement=args.rc)
+    sgrna_patterns, _, prefix_index = load_reference_cached(load_sgrna_reference, sgrna_file, reverse_complement=args.rc)
+
+    feature_anchors = None
+    if args.feature_reference:
+        if not os.path.isfile(args.feature_reference):
+            raise FileNotFoundError("File not found: {0}".format(args.feature_reference))
+        feature_anchors = load_reference_cached(load_feature_anchors, args.feature_reference, reverse_complement=args.rc)
+        print("Loaded {0} anchored feature pattern(s) from {1}".format(len(feature_anchors[0]), args.feature_reference))
 
-    with open(args.output, "w") as output:
-        output.write("cell\tR2_sequence\tsgrna\tumi\n")
-        for cell, sequence, sgrna_match, umi in iter_sgrna_hits(
-            cell_sequence_counts,
-            sgrna_patterns,
-            sgrna_lengths,
+    header = "cell\tR2_sequence\tsgrna\tumi\n"
+
+    def hits_for_cells(cells):
+        return iter_sgrna_hits(cell_sequence_counts, sgrna_patterns, prefix_index, args.umi_cutoff, feature_anchors, cells)
+
+    if args.checkpoint_dir:
+        references = [path for path in (args.sgrna_file, args.feature_reference) if path]
+        fingerprint = input_fingerprint(
+            [args.cell_umi, args.whitelist] + references,
             args.umi_cutoff,
-        ):
-            output.write(
-                "{0}\t{1}\t{2}\t{3}\n".format(
-                    cell,
-                    sequence,
-                    sgrna_match,
-                    umi,
-                )
-            )
+            args.rc,
+            args.checkpoint_cells,
+        )
+        write_hits_checkpointed(
+            args.output,
+            header,
+            sorted(cell_sequence_counts),
+            hits_for_cells,
+            args.checkpoint_dir,
+            args.checkpoint_cells,
+            fingerprint,
+        )
+    else:
+        write_hits(args.output, header, hits_for_cells(None))
 
     print("Output written to {0}".format(args.output))
 
 
-if __name__ == "__main__":
+def build_parser():
     parser = argparse.ArgumentParser(description="Process cell-UMI data and assign sgRNAs.")
     parser.add_argument("--cell_umi", required=True, help="Path to the cell_umi file.")
-    parser.add_argument("--sgrna_file", required=True, help="Path to the sgRNA reference file.")
+    parser.add_argument("--sgrna_file", help="Path to the sgRNA reference file. Defaults to --feature_reference.")
+    parser.add_argument(
+        "--feature_reference",
+        help="10x-style feature reference CSV. Its 'pattern' column is used to locate guides by their constant anchors.",
+    )
     parser.add_argument("--whitelist", required=True, help="Path to the whitelist file.")
     parser.add_argument("--output", required=True, help="Path to the output file.")
     parser.add_argument(
@@ -171,5 +401,15 @@ if __name__ == "__main__":
         help="Minimum per-cell UMI count to keep sgRNA candidates in the exported table. Use 0 to keep all candidates.",
     )
     parser.add_argument("--rc", action="store_true", help="Apply reverse and complementary transformation to sgRNAs.")
-    args = parser.parse_args()
+    parser.add_argument(
+        "--checkpoint_dir",
+        default=None,
+        help="Write output in chunks of cells committed under this directory so an interrupted run resumes.",
+    )
+    parser.add_argument("--checkpoint_cells", type=positive_int, default=20000, help="Cells per checkpointed chunk.")
+    return parser
+
+
+if __name__ == "__main__":
+    args = build_parser().parse_args()
     main(args)
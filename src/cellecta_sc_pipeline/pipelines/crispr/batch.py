@@ -2,12 +2,29 @@
 import argparse
 import csv
 import gzip
+import os
 import shutil
 import subprocess
 import sys
+from functools import partial
 from pathlib import Path
 from typing import List, Optional
 
+from cellecta_sc_pipeline.shared.checkpoints import ChunkCheckpoints, atomic_output
+from cellecta_sc_pipeline.shared.fastq_chunks import lane_chunks, run_parallel, split_fastq_pair
+from cellecta_sc_pipeline.shared.in_process import absolute_path_args, is_helper_command, run_in_process
+from cellecta_sc_pipeline.shared.profiling import RunProfiler, new_run_id, profile_stage, write_profile_summary
+from cellecta_sc_pipeline.shared.scheduler import (
+    ResourceBudget,
+    add_scheduler_arguments,
+    parse_stage_resources,
+    run_sample_jobs,
+    stage_slot,
+)
+from cellecta_sc_pipeline.shared.stage_cache import StageManifest
+from cellecta_sc_pipeline.shared.streaming import run_through_fifo
+from cellecta_sc_pipeline.shared.work_queue import SampleQueue, drain_queue, run_claimed
+
 
 SOURCE_REPO_ROOT = Path(__file__).resolve().parents[4]
 
@@ -34,6 +51,20 @@ BEST_SEQUENCE_DEFAULT = resolve_local_helper("extract_best_umi_sequences.py")
 SGRNA_PROCESS_DEFAULT = resolve_local_helper("process_sgrna_umis.py")
 FINAL_ASSIGNMENT_DEFAULT = resolve_local_helper("assign_final_sgrnas.py")
 
+# Path options made absolute at startup; see absolute_path_args.
+PATH_ARGS = (
+    "samples_csv",
+    "out_root",
+    "sgrna_file",
+    "feature_reference",
+    "best_sequence_umi_py",
+    "sgrna_process_py",
+    "final_assignment_py",
+    "inclusion_list",
+    "scratch_dir",
+    "profile_jsonl",
+)
+
 
 def local_tool_arg(parser: argparse.ArgumentParser, flag: str, default_path: Path, help_text: str) -> None:
     kwargs = {"help": help_text}
@@ -45,9 +76,65 @@ def local_tool_arg(parser: argparse.ArgumentParser, flag: str, default_path: Pat
     parser.add_argument(flag, **kwargs)
 
 
-def run(cmd: List[str], *, cwd: Optional[Path] = None) -> None:
-    print("\n[CMD] " + " ".join(cmd), flush=True)
-    subprocess.run(cmd, cwd=str(cwd) if cwd else None, check=True)
+def run(
+    cmd: List[str],
+    *,
+    cwd: Optional[Path] = None,
+    budget: Optional[ResourceBudget] = None,
+    stage: str = "",
+    in_process: bool = False,
+    profiler: Optional[RunProfiler] = None,
+) -> None:
+    with stage_slot(budget, stage):
+        print("\n[CMD] " + " ".join(cmd), flush=True)
+        if in_process and is_helper_command(cmd):
+            with profile_stage(profiler, stage, cmd):
+                run_in_process(cmd)
+        elif profiler is not None:
+            profiler.run(cmd, stage=stage, cwd=cwd)
+        else:
+            subprocess.run(cmd, cwd=str(cwd) if cwd else None, check=True)
+
+
+def umi_tools_extract_cmd(
+    bc_pattern: str,
+    compresslevel: int,
+    whitelist: Optional[Path],
+    r1_in: Path,
+    r2_in: Path,
+    r1_out: Path,
+    r2_out: Path,
+) -> List[str]:
+    cmd = [
+        "umi_tools", "extract",
+        f"--bc-pattern={bc_pattern}",
+        "--stdin", str(r1_in),
+        "--stdout", str(r1_out),
+        "--read2-in", str(r2_in),
+        "--read2-out", str(r2_out),
+    ]
+    if whitelist is not None:
+        cmd.extend(["--whitelist", str(whitelist)])
+    if compresslevel > 0:
+        cmd.append(f"--compresslevel={compresslevel}")
+    return cmd
+
+
+def release_intermediates(paths: List[Path], sample_out: Path, keep: bool) -> None:
+    """Delete intermediates, or move scratch copies into the sample folder when kept."""
+    for path in paths:
+        if not path.exists():
+            continue
+        if not keep:
+            path.unlink()
+        elif path.parent != sample_out:
+            shutil.move(str(path), str(sample_out / path.name))
+
+
+def matching_checkpoint_args(checkpoint_dir: Path, checkpoint_cells: int) -> List[str]:
+    if checkpoint_cells <= 0:
+        return []
+    return ["--checkpoint_dir", str(checkpoint_dir), "--checkpoint_cells", str(checkpoint_cells)]
 
 
 def read_samples_csv(path: Path) -> List[dict]:
@@ -73,8 +160,7 @@ def read_samples_csv(path: Path) -> List[dict]:
 
 
 def make_whitelist(barcodes_gz: Path, whitelist_out: Path) -> None:
-    whitelist_out.parent.mkdir(parents=True, exist_ok=True)
-    with gzip.open(barcodes_gz, "rt") as fin, whitelist_out.open("w") as fout:
+    with atomic_output(whitelist_out) as tmp_path, gzip.open(barcodes_gz, "rt") as fin, tmp_path.open("w") as fout:
         for line in fin:
             barcode = line.strip()
             if not barcode:
@@ -83,8 +169,7 @@ def make_whitelist(barcodes_gz: Path, whitelist_out: Path) -> None:
 
 
 def merge_gz_members(inputs: List[Path], out_gz: Path) -> None:
-    out_gz.parent.mkdir(parents=True, exist_ok=True)
-    with out_gz.open("wb") as writer:
+    with atomic_output(out_gz) as tmp_path, tmp_path.open("wb") as writer:
         for file_path in inputs:
             with file_path.open("rb") as reader:
                 shutil.copyfileobj(reader, writer)
@@ -101,6 +186,10 @@ def build_parser() -> argparse.ArgumentParser:
     parser.add_argument("--samples_csv", required=True, help="CSV with sample,fastq_dir,cellranger_barcodes_gz")
     parser.add_argument("--out_root", required=True, help="Output root folder (per-sample subfolders created)")
     parser.add_argument("--sgrna_file", required=True, help="sgRNA reference file")
+    parser.add_argument(
+        "--feature_reference",
+        help="10x-style feature reference CSV whose 'pattern' column anchors guide extraction",
+    )
     local_tool_arg(parser, "--best_sequence_umi_py", BEST_SEQUENCE_DEFAULT, "Path to extract_best_umi_sequences.py")
     local_tool_arg(parser, "--sgrna_process_py", SGRNA_PROCESS_DEFAULT, "Path to process_sgrna_umis.py")
     local_tool_arg(parser, "--final_assignment_py", FINAL_ASSIGNMENT_DEFAULT, "Path to assign_final_sgrnas.py")
@@ -126,32 +215,143 @@ def build_parser() -> argparse.ArgumentParser:
         default=3,
         help="Minimum top sgRNA UMI count required for a final assignment.",
     )
-    parser.add_argument("--force", action="store_true", help="Overwrite existing outputs")
+    parser.add_argument(
+        "--guide_calling",
+        default="dominant",
+        choices=["dominant", "sparse"],
+        help="'dominant' keeps one guide per cell; 'sparse' calls all guides per cell for high-MOI screens.",
+    )
+    parser.add_argument("--force", action="store_true", help="Rerun every stage even when its manifest entry is current")
+    parser.add_argument(
+        "--stream_extract",
+        action="store_true",
+        help="Pipe umi_tools extract R2 output straight into best-sequence selection instead of writing extracted FASTQs",
+    )
+    parser.add_argument(
+        "--extract_jobs",
+        type=int,
+        default=1,
+        help="Run umi_tools extract on this many chunks of a sample in parallel",
+    )
+    parser.add_argument(
+        "--extract_chunk_reads",
+        type=int,
+        default=0,
+        help="With --extract_jobs > 1, split the merged FASTQs into chunks of this many reads (default 0: one chunk per lane)",
+    )
+    parser.add_argument(
+        "--sample",
+        action="append",
+        default=None,
+        help="Process only this sample from the sheet; repeat for several (default: all samples)",
+    )
+    parser.add_argument(
+        "--prepare_only",
+        action="store_true",
+        help="Only run the stages that do not need the CellRanger barcodes "
+        "(lane merging, plus extraction with --defer_whitelist)",
+    )
+    parser.add_argument(
+        "--queue",
+        default=None,
+        help="Claim samples from the shared queue <out_root>/queue/<name>, so batch runs on several "
+        "nodes started with the same --out_root and name split the sample sheet between them",
+    )
+    parser.add_argument(
+        "--lease_seconds",
+        type=float,
+        default=600,
+        help="With --queue, reclaim a sample whose worker has not renewed its lease for this long (default: 600)",
+    )
+    parser.add_argument(
+        "--defer_whitelist",
+        action="store_true",
+        help="Extract without the CellRanger whitelist so extraction can run before cell calling; "
+        "matching applies the whitelist instead",
+    )
+    parser.add_argument(
+        "--inclusion_list",
+        default=None,
+        help="With --defer_whitelist, keep only reads whose barcode is on this 10x inclusion list "
+        "(e.g. 3M-february-2018.txt.gz; default: keep every barcode)",
+    )
+    parser.add_argument(
+        "--scratch_dir",
+        default=None,
+        help="Fast local folder for merged/extracted FASTQs and checkpoints (default: the sample output folder)",
+    )
+    parser.add_argument(
+        "--keep_intermediates",
+        action="store_true",
+        help="Keep merged and extracted FASTQs, moving them from --scratch_dir into the sample folder",
+    )
+    parser.add_argument(
+        "--intermediate_compresslevel",
+        type=int,
+        default=1,
+        choices=range(0, 10),
+        metavar="{0-9}",
+        help="gzip level for extracted FASTQs; 0 writes them uncompressed (default: 1)",
+    )
+    parser.add_argument(
+        "--checkpoint_cells",
+        type=int,
+        default=20000,
+        help="Commit matching output every this many cells so an interrupted stage resumes (0 disables)",
+    )
+    parser.add_argument(
+        "--in_process",
+        action="store_true",
+        help="Run the Python helper stages inside this interpreter instead of a fresh one per stage",
+    )
+    parser.add_argument(
+        "--profile_jsonl",
+        default=None,
+        help="Append per-stage wall time, CPU, peak RSS and I/O records here (default: <out_root>/run_profile.jsonl)",
+    )
+    parser.add_argument("--run_id", default=None, help="Identifier grouping this run's profile records (default: timestamp-pid)")
+    parser.add_argument(
+        "--hash_inputs",
+        action="store_true",
+        help="Fingerprint stage inputs by content hash instead of size and mtime",
+    )
+    add_scheduler_arguments(parser)
     return parser
 
 
-def process_sample(sample: str, fastq_dir: Path, barcodes_gz: Path, out_root: Path, args: argparse.Namespace) -> None:
+def process_sample(
+    sample: str,
+    fastq_dir: Path,
+    barcodes_gz: Path,
+    out_root: Path,
+    args: argparse.Namespace,
+    budget: Optional[ResourceBudget] = None,
+) -> None:
     sample_out = out_root / sample
     sample_out.mkdir(parents=True, exist_ok=True)
 
     whitelist = sample_out / f"{sample}_barcode_whitelist.tsv"
-    merged_r1 = sample_out / f"{sample}_merged_R1.fastq.gz"
-    merged_r2 = sample_out / f"{sample}_merged_R2.fastq.gz"
-    extracted_r1 = sample_out / f"{sample}_extracted_R1.fastq.gz"
-    extracted_r2 = sample_out / f"{sample}_extracted_R2.fastq.gz"
+    # Heavy intermediates live in the scratch folder when one is given.
+    work_dir = Path(args.scratch_dir) / sample if args.scratch_dir else sample_out
+    work_dir.mkdir(parents=True, exist_ok=True)
+    fastq_suffix = ".fastq.gz" if args.intermediate_compresslevel > 0 else ".fastq"
+    merged_r1 = work_dir / f"{sample}_merged_R1.fastq.gz"
+    merged_r2 = work_dir / f"{sample}_merged_R2.fastq.gz"
+    extracted_r1 = work_dir / f"{sample}_extracted_R1{fastq_suffix}"
+    extracted_r2 = work_dir / f"{sample}_extracted_R2{fastq_suffix}"
     cell_umi_tsv = sample_out / f"{sample}_cell_umi.tsv"
     assign_umi_tsv = sample_out / f"{sample}_sgrna_assignment_umi.tsv"
     summary_tsv = sample_out / f"{sample}_sgrna_assignment_summary.tsv"
     cell_sgrna_table_tsv = sample_out / f"{sample}_cell_sgrna_table.tsv"
     sgrna_stat_tsv = sample_out / f"{sample}_sgrna_stat.tsv"
     umi_pie_png = sample_out / f"{sample}_umi_distribution.png"
+    feature_matrix_dir = sample_out / f"{sample}_sgrna_feature_bc_matrix"
+    guide_calls_tsv = sample_out / f"{sample}_sgrna_calls_per_cell.tsv"
 
     print(f"\n========== Processing sample: {sample} ==========")
 
     if not fastq_dir.exists():
         raise FileNotFoundError(f"[{sample}] fastq_dir not found: {fastq_dir}")
-    if not barcodes_gz.exists():
-        raise FileNotFoundError(f"[{sample}] cellranger_barcodes_gz not found: {barcodes_gz}")
 
     r1_files = find_fastqs(fastq_dir, "R1")
     r2_files = find_fastqs(fastq_dir, "R2")
@@ -160,45 +360,217 @@ def process_sample(sample: str, fastq_dir: Path, barcodes_gz: Path, out_root: Pa
     if not r2_files:
         raise FileNotFoundError(f"[{sample}] No R2 fastqs found in {fastq_dir}")
 
-    if whitelist.exists() and not args.force:
-        print(f"[SKIP] whitelist exists: {whitelist}")
-    else:
-        print(f"[MAKE] whitelist: {whitelist}")
-        make_whitelist(barcodes_gz, whitelist)
+    manifest = StageManifest(sample_out / f"{sample}_stage_manifest.json", hash_inputs=args.hash_inputs)
+    profiler = RunProfiler(Path(args.profile_jsonl), args.run_id, sample=sample)
 
-    if merged_r1.exists() and merged_r2.exists() and not args.force:
-        print(f"[SKIP] merged fastqs exist: {merged_r1}, {merged_r2}")
+    whitelist_stage = manifest.stage("whitelist", inputs=[barcodes_gz], outputs=[whitelist], force=args.force)
+    if args.defer_whitelist:
+        # Extraction keeps every barcode on the 10x inclusion list (or every
+        # barcode at all); matching applies the CellRanger whitelist later.
+        extract_whitelist = Path(args.inclusion_list) if args.inclusion_list else None
     else:
-        print(f"[MERGE] R1 files: {len(r1_files)} -> {merged_r1}")
-        merge_gz_members(r1_files, merged_r1)
-        print(f"[MERGE] R2 files: {len(r2_files)} -> {merged_r2}")
-        merge_gz_members(r2_files, merged_r2)
-
-    if extracted_r1.exists() and extracted_r2.exists() and not args.force:
-        print(f"[SKIP] extracted fastqs exist: {extracted_r1}, {extracted_r2}")
+        extract_whitelist = whitelist
+    # One extract chunk per lane reads the lane files directly, so nothing is merged.
+    by_lane = not args.stream_extract and args.extract_jobs > 1 and args.extract_chunk_reads <= 0
+    extract_fastqs = r1_files + r2_files if by_lane else [merged_r1, merged_r2]
+    extract_inputs = extract_fastqs + ([extract_whitelist] if extract_whitelist else [])
+
+    # Look past the intermediates first: when every stage up to cell_umi.tsv is
+    # current, merged or extracted FASTQs deleted after the last run are not rebuilt.
+    chain = []
+    if not by_lane:
+        chain.append(manifest.stage("merge", inputs=r1_files + r2_files, outputs=[merged_r1, merged_r2], ephemeral=True))
+    if args.stream_extract:
+        chain.append(manifest.stage(
+            "stream_extract",
+            inputs=extract_inputs,
+            outputs=[cell_umi_tsv],
+            params={"bc_pattern": args.bc_pattern},
+            tools=[args.best_sequence_umi_py],
+        ))
     else:
-        run([
-            "umi_tools", "extract",
-            f"--bc-pattern={args.bc_pattern}",
-            "--stdin", str(merged_r1),
-            "--stdout", str(extracted_r1),
-            "--read2-in", str(merged_r2),
-            "--read2-out", str(extracted_r2),
-            "--whitelist", str(whitelist),
-        ], cwd=sample_out)
-
-    if cell_umi_tsv.exists() and not args.force:
-        print(f"[SKIP] cell_umi exists: {cell_umi_tsv}")
+        chain.append(manifest.stage(
+            "extract",
+            inputs=extract_inputs,
+            outputs=[extracted_r1, extracted_r2],
+            params={"bc_pattern": args.bc_pattern},
+            ephemeral=True,
+        ))
+        chain.append(manifest.stage(
+            "best_sequence",
+            inputs=[extracted_r2],
+            outputs=[cell_umi_tsv],
+            tools=[args.best_sequence_umi_py],
+        ))
+    chain_current = not args.force and (args.defer_whitelist or whitelist_stage.up_to_date) and all(
+        plan.up_to_date or plan.released for plan in chain
+    )
+    if not chain_current and not by_lane:
+        stage = manifest.stage(
+            "merge",
+            inputs=r1_files + r2_files,
+            outputs=[merged_r1, merged_r2],
+            force=args.force,
+            ephemeral=True,
+        )
+        if stage.up_to_date:
+            print(f"[SKIP] merged fastqs up to date: {merged_r1}, {merged_r2}")
+        else:
+            with stage_slot(budget, "merge"), profiler.measure("merge"):
+                print(f"[MERGE] R1 files: {len(r1_files)} -> {merged_r1} ({stage.reason})")
+                merge_gz_members(r1_files, merged_r1)
+                print(f"[MERGE] R2 files: {len(r2_files)} -> {merged_r2}")
+                merge_gz_members(r2_files, merged_r2)
+            stage.commit()
+
+    def build_whitelist() -> bool:
+        """Make the whitelist from the CellRanger barcodes; False ends a --prepare_only run here."""
+        if args.prepare_only:
+            print(f"[PREPARED] {sample}")
+            return False
+        if not barcodes_gz.exists():
+            raise FileNotFoundError(f"[{sample}] cellranger_barcodes_gz not found: {barcodes_gz}")
+        if whitelist_stage.up_to_date:
+            print(f"[SKIP] whitelist up to date: {whitelist}")
+        else:
+            print(f"[MAKE] whitelist: {whitelist} ({whitelist_stage.reason})")
+            with stage_slot(budget, "whitelist"), profiler.measure("whitelist"):
+                make_whitelist(barcodes_gz, whitelist)
+            whitelist_stage.commit()
+        return True
+
+    # Without --defer_whitelist umi_tools extract filters on the whitelist, so
+    # only merging can run before CellRanger has called cells.
+    if not args.defer_whitelist and not build_whitelist():
+        return
+
+    if chain_current:
+        print(f"[SKIP] cell_umi up to date: {cell_umi_tsv}")
     else:
-        run([
-            sys.executable,
-            str(args.best_sequence_umi_py),
-            "-i", str(extracted_r2),
-            "-o", str(cell_umi_tsv),
-        ], cwd=sample_out)
-
-    if assign_umi_tsv.exists() and not args.force:
-        print(f"[SKIP] sgRNA assignment exists: {assign_umi_tsv}")
+        if args.stream_extract:
+            stage = manifest.stage(
+                "stream_extract",
+                inputs=extract_inputs,
+                outputs=[cell_umi_tsv],
+                params={"bc_pattern": args.bc_pattern},
+                tools=[args.best_sequence_umi_py],
+                force=args.force,
+            )
+            if stage.up_to_date:
+                print(f"[SKIP] cell_umi up to date: {cell_umi_tsv}")
+            else:
+                # R2 goes through an uncompressed FIFO and R1 is never needed downstream.
+                extract_fifo = sample_out / f"{sample}_extracted_R2.fifo"
+                with stage_slot(budget, "stream_extract"), profiler.measure("stream_extract"):
+                    run_through_fifo(
+                        umi_tools_extract_cmd(
+                            args.bc_pattern, 0, extract_whitelist, merged_r1, merged_r2, Path(os.devnull), extract_fifo
+                        ),
+                        [
+                            sys.executable,
+                            str(args.best_sequence_umi_py),
+                            "-i", str(extract_fifo),
+                            "-o", str(cell_umi_tsv),
+                        ],
+                        extract_fifo,
+                        cwd=sample_out,
+                    )
+                stage.commit()
+        else:
+            stage = manifest.stage(
+                "extract",
+                inputs=extract_inputs,
+                outputs=[extracted_r1, extracted_r2],
+                params={"bc_pattern": args.bc_pattern},
+                force=args.force,
+                ephemeral=True,
+            )
+            if stage.up_to_date:
+                print(f"[SKIP] extracted fastqs up to date: {extracted_r1}, {extracted_r2}")
+            elif args.extract_jobs > 1 or args.extract_chunk_reads > 0:
+                # Chunks completed by an interrupted run are kept and skipped on rerun.
+                checkpoints = ChunkCheckpoints(
+                    work_dir / f"{sample}_extract_chunks",
+                    f"{stage.fingerprint}:{args.extract_chunk_reads}",
+                )
+                chunk_dir = checkpoints.directory
+                if args.extract_chunk_reads > 0:
+                    with profiler.measure("extract_split"):
+                        chunks = split_fastq_pair(merged_r1, merged_r2, chunk_dir, args.extract_chunk_reads, checkpoints)
+                else:
+                    chunks = lane_chunks(r1_files, r2_files)
+                chunk_outputs = [
+                    (chunk_dir / f"extracted{index:04d}_R1{fastq_suffix}", chunk_dir / f"extracted{index:04d}_R2{fastq_suffix}")
+                    for index in range(len(chunks))
+                ]
+
+                def extract_chunk(index: int) -> None:
+                    name = f"extract{index:04d}"
+                    if checkpoints.is_done(name):
+                        print(f"[SKIP] extract chunk {index} already complete", flush=True)
+                        return
+                    (chunk_r1, chunk_r2), (out_r1, out_r2) = chunks[index], chunk_outputs[index]
+                    with atomic_output(out_r1) as tmp_r1, atomic_output(out_r2) as tmp_r2:
+                        run(
+                            umi_tools_extract_cmd(args.bc_pattern, args.intermediate_compresslevel, extract_whitelist, chunk_r1, chunk_r2, tmp_r1, tmp_r2),
+                            cwd=sample_out,
+                            budget=budget,
+                            stage="extract",
+                            profiler=profiler,
+                        )
+                    checkpoints.mark_done(name)
+
+                print(f"[EXTRACT] {len(chunks)} chunk(s) on up to {args.extract_jobs} workers ({stage.reason})")
+                run_parallel(range(len(chunks)), extract_chunk, args.extract_jobs)
+                # Concatenating gzip members in chunk order equals one extract over the whole input.
+                with profiler.measure("extract_concat"):
+                    merge_gz_members([out_r1 for out_r1, _ in chunk_outputs], extracted_r1)
+                    merge_gz_members([out_r2 for _, out_r2 in chunk_outputs], extracted_r2)
+                checkpoints.clear()
+                stage.commit()
+            else:
+                run(
+                    umi_tools_extract_cmd(args.bc_pattern, args.intermediate_compresslevel, extract_whitelist, merged_r1, merged_r2, extracted_r1, extracted_r2),
+                    cwd=sample_out,
+                    budget=budget,
+                    stage="extract",
+                    in_process=args.in_process,
+                    profiler=profiler,
+                )
+                stage.commit()
+
+            stage = manifest.stage(
+                "best_sequence",
+                inputs=[extracted_r2],
+                outputs=[cell_umi_tsv],
+                tools=[args.best_sequence_umi_py],
+                force=args.force,
+            )
+            if stage.up_to_date:
+                print(f"[SKIP] cell_umi up to date: {cell_umi_tsv}")
+            else:
+                run([
+                    sys.executable,
+                    str(args.best_sequence_umi_py),
+                    "-i", str(extracted_r2),
+                    "-o", str(cell_umi_tsv),
+                ], cwd=sample_out, budget=budget, stage="best_sequence", in_process=args.in_process, profiler=profiler)
+                stage.commit()
+
+    if args.defer_whitelist and not build_whitelist():
+        return
+
+    reference_files = [args.sgrna_file] + ([args.feature_reference] if args.feature_reference else [])
+    stage = manifest.stage(
+        "matching",
+        inputs=[cell_umi_tsv, whitelist] + reference_files,
+        outputs=[assign_umi_tsv],
+        params={"umi_cutoff": args.sgrna_search_umi_cutoff, "rc": args.rc},
+        tools=[args.sgrna_process_py],
+        force=args.force,
+    )
+    if stage.up_to_date:
+        print(f"[SKIP] sgRNA assignment up to date: {assign_umi_tsv}")
     else:
         cmd = [
             sys.executable,
@@ -209,12 +581,32 @@ def process_sample(sample: str, fastq_dir: Path, barcodes_gz: Path, out_root: Pa
             "--output", str(assign_umi_tsv),
             "--umi_cutoff", str(args.sgrna_search_umi_cutoff),
         ]
+        if args.feature_reference:
+            cmd.extend(["--feature_reference", str(args.feature_reference)])
         if args.rc:
             cmd.append("--rc")
-        run(cmd, cwd=sample_out)
-
-    if summary_tsv.exists() and cell_sgrna_table_tsv.exists() and not args.force:
-        print(f"[SKIP] summary exists: {summary_tsv}")
+        cmd.extend(matching_checkpoint_args(work_dir / f"{sample}_matching_checkpoints", args.checkpoint_cells))
+        run(cmd, cwd=sample_out, budget=budget, stage="matching", in_process=args.in_process, profiler=profiler)
+        stage.commit()
+
+    final_outputs = [summary_tsv, cell_sgrna_table_tsv]
+    if args.guide_calling == "sparse":
+        final_outputs.append(guide_calls_tsv)
+    stage = manifest.stage(
+        "final_assignment",
+        inputs=[assign_umi_tsv, args.sgrna_file],
+        outputs=final_outputs,
+        params={
+            "min_total_umi": args.assignment_min_total_umi,
+            "min_top_umi": args.assignment_min_top_umi,
+            "guide_calling": args.guide_calling,
+            "rc": args.rc,
+        },
+        tools=[args.final_assignment_py],
+        force=args.force,
+    )
+    if stage.up_to_date:
+        print(f"[SKIP] summary up to date: {summary_tsv}")
     else:
         cmd = [
             sys.executable,
@@ -227,28 +619,86 @@ def process_sample(sample: str, fastq_dir: Path, barcodes_gz: Path, out_root: Pa
             "--umi_pie", str(umi_pie_png),
             "--assignment_min_total_umi", str(args.assignment_min_total_umi),
             "--assignment_min_top_umi", str(args.assignment_min_top_umi),
+            "--guide_calling", args.guide_calling,
         ]
+        if args.guide_calling == "sparse":
+            cmd.extend([
+                "--feature_matrix_dir", str(feature_matrix_dir),
+                "--guide_calls", str(guide_calls_tsv),
+            ])
         if args.rc:
             cmd.append("--rc")
-        run(cmd, cwd=sample_out)
+        run(cmd, cwd=sample_out, budget=budget, stage="final_assignment", in_process=args.in_process, profiler=profiler)
+        stage.commit()
+
+    release_intermediates([merged_r1, merged_r2, extracted_r1, extracted_r2], sample_out, args.keep_intermediates)
+    if work_dir != sample_out:
+        shutil.rmtree(work_dir, ignore_errors=True)
 
     print(f"[DONE] {sample} -> {summary_tsv}")
 
 
-def main() -> None:
-    args = build_parser().parse_args()
+def main(argv: Optional[List[str]] = None) -> None:
+    args = build_parser().parse_args(argv)
+    # Resolved once, so in-process stages never depend on the working directory.
+    absolute_path_args(args, PATH_ARGS)
+    if args.inclusion_list and not args.defer_whitelist:
+        raise ValueError("--inclusion_list only applies with --defer_whitelist")
     rows = read_samples_csv(Path(args.samples_csv))
+    if args.sample:
+        known = {row["sample"].strip() for row in rows}
+        unknown = sorted(set(args.sample) - known)
+        if unknown:
+            raise ValueError(f"--sample not in {args.samples_csv}: {', '.join(unknown)}")
+        rows = [row for row in rows if row["sample"].strip() in args.sample]
     out_root = Path(args.out_root)
     out_root.mkdir(parents=True, exist_ok=True)
+    args.profile_jsonl = str(Path(args.profile_jsonl or out_root / "run_profile.jsonl").resolve())
+    # When a caller passes --run_id it owns the run and writes the profile summary.
+    owns_run = args.run_id is None
+    args.run_id = args.run_id or new_run_id()
+
+    samples = [
+        (
+            row["sample"].strip(),
+            (
+                row["sample"].strip(),
+                Path(row["fastq_dir"].strip()).resolve(),
+                Path(row["cellranger_barcodes_gz"].strip()).resolve(),
+                out_root,
+                args,
+            ),
+        )
+        for row in rows
+    ]
+
+    def run_pass(todo, worker=process_sample):
+        return run_sample_jobs(
+            todo,
+            worker,
+            jobs=args.jobs,
+            log_dir=out_root / "logs",
+            keep_going=args.keep_going,
+            max_cpus=args.max_cpus,
+            max_mem_gb=args.max_mem_gb,
+            stage_resources=parse_stage_resources(args.stage_resources),
+        )
 
-    for row in rows:
-        process_sample(
-            sample=row["sample"].strip(),
-            fastq_dir=Path(row["fastq_dir"].strip()),
-            barcodes_gz=Path(row["cellranger_barcodes_gz"].strip()),
-            out_root=out_root,
-            args=args,
+    if args.queue:
+        # Every process pointed at the same out_root and queue name shares the samples.
+        queue = SampleQueue(out_root / "queue" / args.queue, lease_seconds=args.lease_seconds)
+        failed = drain_queue(
+            queue,
+            samples,
+            partial(run_pass, worker=partial(run_claimed, queue, process_sample)),
+            args.keep_going,
         )
+    else:
+        failed = run_pass(samples)
+    if owns_run:
+        write_profile_summary(Path(args.profile_jsonl), args.run_id)
+    if failed:
+        raise SystemExit(f"\n{len(failed)} sample(s) failed: {', '.join(failed)}")
 
     print("\nAll samples completed.")
 
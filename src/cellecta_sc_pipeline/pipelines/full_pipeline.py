@@ -2,14 +2,45 @@
 import argparse
 import csv
 import os
-import subprocess
 import sys
+import threading
+from functools import partial
 from pathlib import Path
 from typing import Dict, Iterable, List, Optional
+
+from cellecta_sc_pipeline.shared.dag import TaskGraph
+from cellecta_sc_pipeline.shared.estimate import project_stages, sample_fastq_pair, write_estimate
+from cellecta_sc_pipeline.shared.executors import HEADER_TEMPLATES, LocalExecutor, build_executor
+from cellecta_sc_pipeline.shared.in_process import absolute_path_args, is_module_command, run_in_process
+from cellecta_sc_pipeline.shared.profiling import RunProfiler, new_run_id, profile_stage, write_profile_summary
 
 
 SOURCE_REPO_ROOT = Path(__file__).resolve().parents[3]
 REQUIRED_SAMPLE_COLUMNS = {"sample", "gex_fastq_dir", "clonetracker_fastq_dir"}
+# Stages run inside this interpreter share its matplotlib and module state, so
+# they take turns; subprocess stages of other samples keep running meanwhile.
+IN_PROCESS_LOCK = threading.Lock()
+# Path options made absolute at startup, so no task depends on the working directory.
+PATH_ARGS = (
+    "samples_csv",
+    "pipeline_root",
+    "transcriptome",
+    "bc14_file",
+    "bc30_file",
+    "sgrna_file",
+    "feature_reference",
+    "best_sequence_umi_py",
+    "barcode_process_py",
+    "final_assignment_py",
+    "sgrna_process_py",
+    "final_sgrna_py",
+    "consolidation_py",
+    "inclusion_list",
+    "scratch_dir",
+    "profile_jsonl",
+    "job_dir",
+)
+FASTQ_DIR_COLUMNS = ("gex_fastq_dir", "clonetracker_fastq_dir")
 
 
 def resolve_local_helper(filename: str) -> Path:
@@ -35,6 +66,7 @@ BARCODE_PROCESS_DEFAULT = resolve_local_helper("process_barcode_umis.py")
 FINAL_ASSIGNMENT_DEFAULT = resolve_local_helper("assign_final_barcodes.py")
 SGRNA_PROCESS_DEFAULT = resolve_local_helper("process_sgrna_umis.py")
 FINAL_SGRNA_DEFAULT = resolve_local_helper("assign_final_sgrnas.py")
+CONSOLIDATION_DEFAULT = resolve_local_helper("consolidate_clone_barcodes.py")
 
 
 def local_tool_arg(parser: argparse.ArgumentParser, flag: str, default_path: Path, help_text: str) -> None:
@@ -64,12 +96,14 @@ def build_parser() -> argparse.ArgumentParser:
     parser.add_argument("--bc14-file", help="BC14 reference file (required for clonetracker mode)")
     parser.add_argument("--bc30-file", help="BC30 reference file (required for clonetracker mode)")
     parser.add_argument("--sgrna-file", help="sgRNA reference file (required for sgrna mode)")
+    parser.add_argument("--feature-reference", help="10x-style feature reference CSV used to anchor guide extraction (sgrna mode)")
     parser.add_argument("--rc", action="store_true", help="Apply reverse and complementary transformation (required for sgRNA mode, default for clonetracker mode)")
     local_tool_arg(parser, "--best-sequence-umi-py", BEST_SEQUENCE_DEFAULT, "Path to extract_best_umi_sequences.py")
     local_tool_arg(parser, "--barcode-process-py", BARCODE_PROCESS_DEFAULT, "Path to process_barcode_umis.py")
     local_tool_arg(parser, "--final-assignment-py", FINAL_ASSIGNMENT_DEFAULT, "Path to assign_final_barcodes.py")
     local_tool_arg(parser, "--sgrna-process-py", SGRNA_PROCESS_DEFAULT, "Path to process_sgrna_umis.py")
     local_tool_arg(parser, "--final-sgrna-py", FINAL_SGRNA_DEFAULT, "Path to assign_final_sgrnas.py")
+    local_tool_arg(parser, "--consolidation-py", CONSOLIDATION_DEFAULT, "Path to consolidate_clone_barcodes.py")
     parser.add_argument("--bc-pattern", default="CCCCCCCCCCCCCCCCNNNNNNNNNNNN", help="umi_tools extract barcode pattern")
     parser.add_argument(
         "--barcode-search-umi-cutoff",
@@ -81,17 +115,118 @@ def build_parser() -> argparse.ArgumentParser:
     )
     parser.add_argument("--assignment-min-total-umi", type=int, default=3, help="Minimum total barcode-supporting UMIs required for a final assignment")
     parser.add_argument("--assignment-min-top-umi", type=int, default=3, help="Minimum top barcode UMI count required for a final assignment")
+    parser.add_argument(
+        "--guide-calling",
+        default="dominant",
+        choices=["dominant", "sparse"],
+        help="sgrna mode: 'sparse' calls every guide per cell from a sparse cell x guide matrix (high-MOI screens)",
+    )
+    parser.add_argument(
+        "--consolidate-max-distance",
+        type=int,
+        default=2,
+        help="Maximum edit distance for snapping mutant CloneTracker barcodes onto observed reference clones. Use 0 to skip consolidation.",
+    )
     parser.add_argument("--min-genes", type=int, default=200)
     parser.add_argument("--max-genes", type=int, default=8000)
     parser.add_argument("--min-counts", type=int, default=500)
     parser.add_argument("--max-mt-pct", type=float, default=15)
+    parser.add_argument("--qc-low-memory", action="store_true", help="Run QC with --low-memory: chunked metrics and in-place filtering")
+    parser.add_argument("--qc-figure-dpi", type=int, default=150, help="Resolution of the QC report figures")
+    parser.add_argument("--qc-link-images", action="store_true", help="Link QC report figures instead of embedding them in the HTML")
     parser.add_argument("--skip-cellranger", action="store_true", help="Skip cellranger count and reuse existing outputs")
     parser.add_argument("--skip-clonetracker", action="store_true", help="Skip CloneTracker barcode assignment and reuse existing outputs")
     parser.add_argument("--skip-qc", action="store_true", help="Skip final QC/report generation")
     parser.add_argument("--force", action="store_true", help="Force rerun of steps where supported")
+    parser.add_argument("--extract-jobs", type=int, default=1, help="Parallel umi_tools extract chunks per sample")
+    parser.add_argument("--extract-chunk-reads", type=int, default=0, help="Reads per extract chunk (default 0: one chunk per lane)")
+    parser.add_argument("--stream-extract", action="store_true", help="Pipe umi_tools extract output into best-sequence selection without writing extracted FASTQs")
+    parser.add_argument(
+        "--defer-whitelist",
+        action="store_true",
+        help="Run extraction and best-sequence selection before CellRanger finishes; matching applies the cell whitelist",
+    )
+    parser.add_argument("--inclusion-list", help="With --defer-whitelist, keep only barcodes on this 10x inclusion list")
+    parser.add_argument("--scratch-dir", help="Fast local folder for merged/extracted FASTQs and checkpoints of the assignment batch")
+    parser.add_argument("--keep-intermediates", action="store_true", help="Keep merged and extracted FASTQs instead of deleting them after each sample")
+    parser.add_argument(
+        "--intermediate-compresslevel",
+        type=int,
+        default=1,
+        choices=range(0, 10),
+        metavar="{0-9}",
+        help="gzip level for extracted FASTQs; 0 writes them uncompressed (default: 1)",
+    )
+    parser.add_argument(
+        "--in-process",
+        action="store_true",
+        help="Run the assignment batch, its helper scripts and QC inside this interpreter instead of fresh subprocesses",
+    )
+    parser.add_argument(
+        "--profile-jsonl",
+        help="Append per-stage wall time, CPU, peak RSS and I/O records here (default: <pipeline-root>/run_profile.jsonl)",
+    )
+    parser.add_argument("--hash-inputs", action="store_true", help="Detect changed assignment inputs by content hash instead of size and mtime")
     parser.add_argument("--dry-run", action="store_true", help="Print commands without executing them")
+    parser.add_argument(
+        "--estimate-reads",
+        type=int,
+        default=200000,
+        help="With --dry-run, sample this many reads per sample to project assignment runtime, memory and disk (0 disables)",
+    )
+    parser.add_argument(
+        "--executor",
+        choices=["local"] + sorted(HEADER_TEMPLATES),
+        default="local",
+        help="Run commands locally, or submit each CellRanger, assignment and QC task as a slurm/pbs batch job",
+    )
+    parser.add_argument(
+        "--submit-cmd",
+        help="Command that submits a job script (default: sbatch for slurm, qsub for pbs; `bash` runs jobs locally)",
+    )
+    parser.add_argument("--job-dir", help="Folder for job scripts, logs and exit-code files (default: <pipeline-root>/jobs)")
+    parser.add_argument("--job-poll-seconds", type=float, default=30, help="How often to check for finished batch jobs")
+    parser.add_argument(
+        "--job-status-cmd",
+        help="Command that fails or prints nothing once job {job_id} has left the queue "
+             "(default: 'squeue -h -j {job_id}' / 'qstat {job_id}' unless --submit-cmd is set)",
+    )
+    parser.add_argument(
+        "--job-max-wait-seconds",
+        type=float,
+        help="Fail a batch job that has not written its exit code after this long (default: no limit)",
+    )
+    parser.add_argument(
+        "--job-header",
+        action="append",
+        default=[],
+        help="Extra scheduler header line for every job script, e.g. '#SBATCH --partition=long'; repeatable",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of pipeline tasks run concurrently, so CellRanger, assignment and QC of different samples overlap",
+    )
+    parser.add_argument("--keep-going", action="store_true", help="Continue with other samples after a sample fails")
+    parser.add_argument(
+        "--max-cpus",
+        type=int,
+        help="CPU budget for assignment (default: all cores); split between the --jobs concurrent local assignment tasks",
+    )
+    parser.add_argument(
+        "--max-mem-gb",
+        type=float,
+        help="Memory budget in GB for assignment; split between the --jobs concurrent local assignment tasks",
+    )
     parser.add_argument("--localcores", type=int, help="Number of cores for cellranger (e.g. 64)")
     parser.add_argument("--localmem", type=int, help="Memory for cellranger in GB (e.g. 128)")
+    parser.add_argument(
+        "--cellranger-jobs",
+        type=int,
+        default=1,
+        help="Concurrent cellranger count runs; --localcores/--localmem (default: the whole node) are split evenly between them",
+    )
     return parser
 
 
@@ -136,6 +271,13 @@ def validate_pipeline_inputs(rows, args):
         if not args.sgrna_file:
             raise ValueError("sgrna mode requires --sgrna-file")
         require_existing_path(Path(args.sgrna_file), "sgRNA reference file")
+        if args.feature_reference:
+            require_existing_path(Path(args.feature_reference), "Feature reference file")
+
+    if args.inclusion_list:
+        if not args.defer_whitelist:
+            raise ValueError("--inclusion-list only applies with --defer-whitelist")
+        require_existing_path(Path(args.inclusion_list), "10x barcode inclusion list")
 
     if not args.skip_cellranger:
         cellranger_bin = Path(args.cellranger_bin)
@@ -207,12 +349,34 @@ def command_to_text(cmd: Iterable[str]) -> str:
     return " ".join(str(part) for part in cmd)
 
 
-def run_command(cmd, cwd=None, dry_run=False):
-    """Log and optionally execute a subprocess command."""
+def stage_profiler(args, sample):
+    """Profile recorder for one sample's stages in this pipeline run."""
+    return RunProfiler(Path(args.profile_jsonl), args.run_id, sample=sample)
+
+
+def run_command(
+    cmd,
+    cwd=None,
+    dry_run=False,
+    in_process=False,
+    profiler=None,
+    stage="command",
+    executor=None,
+    job_name=None,
+    resources=(None, None),
+):
+    """Log and optionally execute a command through the selected executor."""
     print("\n[CMD] " + command_to_text(cmd), flush=True)
     if dry_run:
         return
 
+    executor = executor or LocalExecutor()
+    if in_process and is_module_command(cmd) and isinstance(executor, LocalExecutor):
+        # Pipeline modules are importable here, so reuse this interpreter.
+        with IN_PROCESS_LOCK, profile_stage(profiler, stage, cmd):
+            run_in_process(cmd)
+        return
+
     # Ensure the src directory is in PYTHONPATH so internal modules can be found
     env = os.environ.copy()
     src_path = str(SOURCE_REPO_ROOT / "src")
@@ -221,7 +385,15 @@ def run_command(cmd, cwd=None, dry_run=False):
     else:
         env["PYTHONPATH"] = src_path
 
-    subprocess.run(cmd, cwd=str(cwd) if cwd else None, check=True, env=env)
+    executor.run(
+        cmd,
+        name=job_name or stage,
+        cwd=cwd,
+        env=env,
+        resources=resources,
+        profiler=profiler,
+        stage=stage,
+    )
 
 
 def write_clonetracker_samples_csv(rows, output_path, cellranger_root):
@@ -242,7 +414,54 @@ def write_clonetracker_samples_csv(rows, output_path, cellranger_root):
             })
 
 
-def run_cellranger_for_sample(row, args, cellranger_root):
+def fastq_bytes(fastq_dir):
+    """Total size of the FASTQs in a directory, used to start the largest samples first."""
+    return sum(path.stat().st_size for path in Path(fastq_dir).glob("*.fastq*") if path.is_file())
+
+
+def physical_memory_gb():
+    """Installed memory in GB, or None where the platform does not report it."""
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") / 1024 ** 3
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def cellranger_allocation(args):
+    """
+    Return the (localcores, localmem) each `cellranger count` run gets. With
+    --cellranger-jobs N the node totals are divided evenly between the N runs;
+    None leaves the choice to cellranger.
+    """
+    if args.cellranger_jobs <= 1:
+        return args.localcores, args.localmem
+
+    cores = args.localcores or os.cpu_count() or 1
+    # cellranger itself defaults to 90% of the installed memory.
+    mem_gb = args.localmem or (physical_memory_gb() or 0) * 0.9
+    localcores = max(1, cores // args.cellranger_jobs)
+    localmem = max(1, int(mem_gb // args.cellranger_jobs)) if mem_gb else None
+    return localcores, localmem
+
+
+def assignment_allocation(args, n_samples):
+    """
+    Return (concurrent, max_cpus, max_mem_gb) for the assignment tasks. Up to
+    `concurrent` of them run at once; locally they split --max-cpus (default:
+    all cores) and --max-mem-gb evenly, while each cluster job gets the whole
+    budget in its own allocation.
+    """
+    concurrent = max(1, min(args.jobs, n_samples))
+    if concurrent <= 1 or not isinstance(args.executor, LocalExecutor):
+        return concurrent, args.max_cpus, args.max_mem_gb
+
+    cpus = args.max_cpus or os.cpu_count() or 1
+    max_cpus = max(1, cpus // concurrent)
+    max_mem_gb = round(args.max_mem_gb / concurrent, 2) if args.max_mem_gb else None
+    return concurrent, max_cpus, max_mem_gb
+
+
+def run_cellranger_for_sample(row, args, cellranger_root, localcores=None, localmem=None):
     """Run `cellranger count` for one sample and verify the expected barcode output exists."""
     sample = row["sample"].strip()
     sample_id = f"{sample}_GEX"
@@ -257,12 +476,21 @@ def run_cellranger_for_sample(row, args, cellranger_root):
         f"--create-bam={args.create_bam}",
         f"--include-introns={args.include_introns}",
     ]
-    if args.localcores:
-        cmd.append(f"--localcores={args.localcores}")
-    if args.localmem:
-        cmd.append(f"--localmem={args.localmem}")
-
-    run_command(cmd, cwd=cellranger_root, dry_run=args.dry_run)
+    if localcores:
+        cmd.append(f"--localcores={localcores}")
+    if localmem:
+        cmd.append(f"--localmem={localmem}")
+
+    run_command(
+        cmd,
+        cwd=cellranger_root,
+        dry_run=args.dry_run,
+        profiler=stage_profiler(args, sample),
+        stage="cellranger",
+        executor=args.executor,
+        job_name=f"{sample}_cellranger",
+        resources=(localcores, localmem),
+    )
 
     if not args.dry_run:
         expected = sample_out / "outs" / "filtered_feature_bc_matrix" / "barcodes.tsv.gz"
@@ -270,14 +498,20 @@ def run_cellranger_for_sample(row, args, cellranger_root):
             raise FileNotFoundError(f"Expected CellRanger output not found: {expected}")
 
 
-def run_assignment_batch(rows, args, pipeline_root):
-    """Run the batch assignment stage for all samples."""
-    if args.mode == "clonetracker":
-        generated_csv = pipeline_root / "configs" / "generated_clonetracker_samples.csv"
-        cellranger_root = pipeline_root / "cellranger"
-        write_clonetracker_samples_csv(rows, generated_csv, cellranger_root)
+def write_assignment_samples_csv(rows, args, pipeline_root):
+    """Write the batch sample sheet for all samples once, before any sample starts."""
+    generated_csv = pipeline_root / "configs" / f"generated_{args.mode}_samples.csv"
+    write_clonetracker_samples_csv(rows, generated_csv, pipeline_root / "cellranger")
+    return generated_csv
+
 
-        target_out = pipeline_root / "clonetracker"
+def run_assignment_batch(sample, generated_csv, args, pipeline_root, prepare_only=False):
+    """
+    Run the batch assignment stage for one sample. With prepare_only only the
+    stages that do not need the CellRanger barcodes run.
+    """
+    target_out = pipeline_root / args.mode
+    if args.mode == "clonetracker":
         cmd = [
             sys.executable,
             "-m",
@@ -289,17 +523,14 @@ def run_assignment_batch(rows, args, pipeline_root):
             "--best_sequence_umi_py", str(args.best_sequence_umi_py),
             "--barcode_process_py", str(args.barcode_process_py),
             "--final_assignment_py", str(args.final_assignment_py),
+            "--consolidation_py", str(args.consolidation_py),
             "--bc_pattern", str(args.bc_pattern),
             "--barcode_search_umi_cutoff", str(args.barcode_search_umi_cutoff),
             "--assignment_min_total_umi", str(args.assignment_min_total_umi),
             "--assignment_min_top_umi", str(args.assignment_min_top_umi),
+            "--consolidate_max_distance", str(args.consolidate_max_distance),
         ]
     elif args.mode == "sgrna":
-        generated_csv = pipeline_root / "configs" / "generated_sgrna_samples.csv"
-        cellranger_root = pipeline_root / "cellranger"
-        write_clonetracker_samples_csv(rows, generated_csv, cellranger_root)
-
-        target_out = pipeline_root / "sgrna"
         cmd = [
             sys.executable,
             "-m",
@@ -314,13 +545,52 @@ def run_assignment_batch(rows, args, pipeline_root):
             "--sgrna_search_umi_cutoff", str(args.barcode_search_umi_cutoff),
             "--assignment_min_total_umi", str(args.assignment_min_total_umi),
             "--assignment_min_top_umi", str(args.assignment_min_top_umi),
+            "--guide_calling", args.guide_calling,
         ]
+        if args.feature_reference:
+            cmd.extend(["--feature_reference", str(args.feature_reference)])
         if args.rc:
             cmd.append("--rc")
 
+    # The task graph already runs samples concurrently; each batch call has one.
+    cmd.extend(["--sample", sample, "--jobs", "1"])
+    if prepare_only:
+        cmd.append("--prepare_only")
+    if args.assignment_cpus:
+        cmd.extend(["--max_cpus", str(args.assignment_cpus)])
+    if args.assignment_mem_gb:
+        cmd.extend(["--max_mem_gb", str(args.assignment_mem_gb)])
     if args.force:
         cmd.append("--force")
-    run_command(cmd, cwd=Path.cwd(), dry_run=args.dry_run)
+    if args.extract_jobs > 1:
+        cmd.extend(["--extract_jobs", str(args.extract_jobs), "--extract_chunk_reads", str(args.extract_chunk_reads)])
+    if args.stream_extract:
+        cmd.append("--stream_extract")
+    if args.defer_whitelist:
+        cmd.append("--defer_whitelist")
+        if args.inclusion_list:
+            cmd.extend(["--inclusion_list", str(args.inclusion_list)])
+    if args.scratch_dir:
+        cmd.extend(["--scratch_dir", str(args.scratch_dir)])
+    if args.keep_intermediates:
+        cmd.append("--keep_intermediates")
+    cmd.extend(["--intermediate_compresslevel", str(args.intermediate_compresslevel)])
+    if args.hash_inputs:
+        cmd.append("--hash_inputs")
+    if args.in_process:
+        cmd.append("--in_process")
+    cmd.extend(["--profile_jsonl", str(args.profile_jsonl), "--run_id", args.run_id])
+    run_command(
+        cmd,
+        cwd=args.launch_dir,
+        dry_run=args.dry_run,
+        in_process=args.in_process,
+        profiler=stage_profiler(args, sample),
+        stage="assignment_prepare" if prepare_only else "assignment_batch",
+        executor=args.executor,
+        job_name=f"{sample}_{'prepare' if prepare_only else 'assignment'}",
+        resources=(args.assignment_cpus or args.extract_jobs, args.assignment_mem_gb),
+    )
     return target_out
 
 
@@ -331,6 +601,10 @@ def run_qc_for_sample(sample, args, pipeline_root, assignment_root):
     
     if args.mode == "clonetracker":
         summary_path = assignment_root / sample / f"{sample}_barcode_assignment_summary.tsv"
+        consolidated_path = assignment_root / sample / f"{sample}_barcode_assignment_consolidated_summary.tsv"
+        if args.consolidate_max_distance > 0 and (args.dry_run or consolidated_path.exists()):
+            # Consolidated names merge mutant reads back into their reference clones.
+            summary_path = consolidated_path
         cell_barcode_table_path = assignment_root / sample / f"{sample}_cell_clonetracker_barcode_table.tsv"
     elif args.mode == "sgrna":
         summary_path = assignment_root / sample / f"{sample}_sgrna_assignment_summary.tsv"
@@ -358,25 +632,97 @@ def run_qc_for_sample(sample, args, pipeline_root, assignment_root):
         "--clonetracker-summary", str(summary_path),
         "--clonetracker-umi", str(cell_barcode_table_path),
         "--mode", args.mode,
+        "--figure-dpi", str(args.qc_figure_dpi),
     ]
-    run_command(cmd, cwd=Path.cwd(), dry_run=args.dry_run)
+    if args.qc_low_memory:
+        cmd.append("--low-memory")
+    if args.qc_link_images:
+        cmd.append("--link-images")
+    run_command(
+        cmd,
+        cwd=args.launch_dir,
+        dry_run=args.dry_run,
+        in_process=args.in_process,
+        profiler=stage_profiler(args, sample),
+        stage="qc",
+        executor=args.executor,
+        job_name=f"{sample}_qc",
+        resources=(1, None),
+    )
+
+
+def write_combined_qc_summary(rows, pipeline_root):
+    """Stack the per-sample qc_summary.tsv files into analysis/qc_summary.tsv."""
+    records = []
+    columns = []
+    for row in rows:
+        path = pipeline_root / "analysis" / row["sample"].strip() / "qc_summary.tsv"
+        if not path.exists():
+            continue
+        with path.open("r", newline="") as handle:
+            reader = csv.DictReader(handle, delimiter="\t")
+            columns.extend(column for column in reader.fieldnames or [] if column not in columns)
+            records.extend(reader)
+    if not records:
+        return
+
+    combined_path = pipeline_root / "analysis" / "qc_summary.tsv"
+    with combined_path.open("w", newline="") as handle:
+        writer = csv.DictWriter(handle, fieldnames=columns, delimiter="\t", lineterminator="\n")
+        writer.writeheader()
+        writer.writerows(records)
+    print(f"Combined QC summary: {combined_path}")
 
 
-def main():
+def estimate_assignment_costs(rows, args, pipeline_root):
+    """Project assignment-stage costs from the first reads of each sample's FASTQs."""
+    estimates = []
+    for row in rows:
+        sample = row["sample"].strip()
+        fastq_dir = Path(row["clonetracker_fastq_dir"].strip())
+        r1_files = sorted(fastq_dir.glob("*R1*.fastq.gz"))
+        r2_files = sorted(fastq_dir.glob("*R2*.fastq.gz"))
+        if not r1_files or not r2_files:
+            print(f"[ESTIMATE] {sample}: no R1/R2 fastq.gz files in {fastq_dir}; skipped")
+            continue
+        stats = sample_fastq_pair(r1_files, r2_files, args.bc_pattern, args.estimate_reads)
+        estimates.extend(project_stages(
+            sample,
+            stats,
+            stream_extract=args.stream_extract,
+            compresslevel=args.intermediate_compresslevel,
+        ))
+    write_estimate(estimates, pipeline_root / "dry_run_estimate.tsv")
+
+
+def main(argv=None):
     """Coordinate CellRanger, CloneTracker, and QC stages for all requested samples."""
-    args = build_parser().parse_args()
+    args = build_parser().parse_args(argv)
+    absolute_path_args(args, PATH_ARGS)
+    # Commands run from the launch directory, fixed here rather than read per task.
+    args.launch_dir = Path.cwd()
     pipeline_root = Path(args.pipeline_root)
     pipeline_root.mkdir(parents=True, exist_ok=True)
+    args.profile_jsonl = str(Path(args.profile_jsonl or pipeline_root / "run_profile.jsonl").resolve())
+    args.run_id = new_run_id()
+    args.executor = build_executor(
+        args.executor,
+        Path(args.job_dir or pipeline_root / "jobs").resolve(),
+        args.submit_cmd,
+        args.job_poll_seconds,
+        args.job_header,
+        args.job_max_wait_seconds,
+        args.job_status_cmd,
+    )
 
     rows = read_samples_csv(Path(args.samples_csv))
+    for row in rows:
+        for column in FASTQ_DIR_COLUMNS:
+            row[column] = str(Path(row[column].strip()).resolve())
     validate_pipeline_inputs(rows, args)
 
     cellranger_root = pipeline_root / "cellranger"
-    if not args.skip_cellranger:
-        # First stage: generate filtered feature-barcode matrices for each GEX library.
-        for row in rows:
-            run_cellranger_for_sample(row, args, cellranger_root)
-    elif not args.dry_run:
+    if args.skip_cellranger and not args.dry_run:
         validate_reused_cellranger_outputs(rows, pipeline_root)
 
     if args.skip_clonetracker:
@@ -386,13 +732,70 @@ def main():
             else validate_reused_clonetracker_outputs(rows, pipeline_root, args.mode)
         )
     else:
-        # Second stage: assign CloneTracker or sgRNA barcodes using the CellRanger barcode whitelist.
-        assignment_root = run_assignment_batch(rows, args, pipeline_root)
+        assignment_root = pipeline_root / args.mode
+        generated_csv = write_assignment_samples_csv(rows, args, pipeline_root)
+
+    # Each sample is its own chain: CellRanger -> assignment -> QC. Lane merging
+    # (and extraction with --defer-whitelist) only needs the FASTQs, so it runs
+    # alongside CellRanger, and one sample's QC does not wait for the others.
+    localcores, localmem = cellranger_allocation(args)
+    if not args.skip_cellranger and args.cellranger_jobs > 1:
+        print(f"[CELLRANGER] up to {args.cellranger_jobs} concurrent runs, each with "
+              f"--localcores={localcores} --localmem={localmem or 'default'}")
+    assignment_jobs, args.assignment_cpus, args.assignment_mem_gb = assignment_allocation(args, len(rows))
+    if not args.skip_clonetracker and assignment_jobs > 1:
+        print(f"[ASSIGNMENT] up to {assignment_jobs} concurrent samples, each with "
+              f"--max_cpus={args.assignment_cpus or 'default'} --max_mem_gb={args.assignment_mem_gb or 'default'}")
+
+    graph = TaskGraph()
+    for row in rows:
+        sample = row["sample"].strip()
+        deps = []
+        if not args.skip_cellranger:
+            deps.append(graph.add(
+                f"cellranger:{sample}",
+                partial(run_cellranger_for_sample, row, args, cellranger_root, localcores, localmem),
+                group="cellranger",
+                # The largest samples run longest, so start them first.
+                priority=fastq_bytes(row["gex_fastq_dir"].strip()),
+            ))
+        if not args.skip_clonetracker:
+            if not args.skip_cellranger:
+                deps.append(graph.add(
+                    f"prepare:{sample}",
+                    partial(run_assignment_batch, sample, generated_csv, args, pipeline_root, prepare_only=True),
+                    group="assignment",
+                ))
+            deps = [graph.add(
+                f"assignment:{sample}",
+                partial(run_assignment_batch, sample, generated_csv, args, pipeline_root),
+                deps=deps,
+                group="assignment",
+            )]
+        if not args.skip_qc:
+            graph.add(
+                f"qc:{sample}",
+                partial(run_qc_for_sample, sample, args, pipeline_root, assignment_root),
+                deps=deps,
+            )
 
-    if not args.skip_qc:
-        # Final stage: combine expression outputs and barcode assignments into QC summaries.
-        for row in rows:
-            run_qc_for_sample(row["sample"].strip(), args, pipeline_root, assignment_root)
+    # Every concurrent cellranger run also needs a task slot.
+    failed = graph.run(
+        max(args.jobs, args.cellranger_jobs),
+        keep_going=args.keep_going,
+        # Assignment tasks share the budget split above, so cap them to match.
+        group_limits={"cellranger": args.cellranger_jobs, "assignment": assignment_jobs},
+    )
+
+    if not args.dry_run:
+        write_profile_summary(Path(args.profile_jsonl), args.run_id)
+        if not args.skip_qc:
+            write_combined_qc_summary(rows, pipeline_root)
+    elif not args.skip_clonetracker and args.estimate_reads > 0:
+        estimate_assignment_costs(rows, args, pipeline_root)
+
+    if failed:
+        raise SystemExit(f"\n{len(failed)} task(s) failed: {', '.join(failed)}")
 
     print("\nPipeline finished.")
     print(f"Pipeline root: {pipeline_root}")
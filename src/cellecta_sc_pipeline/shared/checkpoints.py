@@ -0,0 +1,153 @@
+"""
+Atomic output writes and per-chunk checkpoints for resumable stages.
+
+The helper scripts in scripts/ import the hit-table writers below, so they
+use only the standard library.
+"""
+
+import argparse
+import contextlib
+import os
+import shutil
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, Optional, Sequence, Union
+
+
+PARTIAL_PREFIX = ".partial-"
+PathLike = Union[str, Path]
+
+
+def partial_path(path: Path) -> Path:
+    # The prefix keeps the suffix intact, so tools still pick gzip from ".gz".
+    return path.with_name(PARTIAL_PREFIX + path.name)
+
+
+@contextlib.contextmanager
+def atomic_output(path: Path) -> Iterator[Path]:
+    """
+    Yield a temporary sibling of `path` to write to. It replaces `path` only
+    if the block succeeds, so an interrupted write never looks complete.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = partial_path(path)
+    try:
+        yield tmp_path
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+    os.replace(tmp_path, path)
+
+
+def write_text_atomic(path: Path, text: str) -> None:
+    with atomic_output(path) as tmp_path:
+        tmp_path.write_text(text)
+
+
+class ChunkCheckpoints:
+    """
+    Directory of `<name>.done` markers for the completed chunks of one stage.
+
+    The directory is stamped with the stage fingerprint; when the inputs or
+    parameters change the old chunks are discarded instead of resumed.
+    """
+
+    def __init__(self, directory: Path, fingerprint: str):
+        self.directory = Path(directory)
+        stamp = self.directory / "FINGERPRINT"
+        if self.directory.exists() and (not stamp.exists() or stamp.read_text() != fingerprint):
+            shutil.rmtree(self.directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        if not stamp.exists():
+            write_text_atomic(stamp, fingerprint)
+
+    def marker(self, name: str) -> Path:
+        return self.directory / f"{name}.done"
+
+    def is_done(self, name: str) -> bool:
+        return self.marker(name).exists()
+
+    def read(self, name: str) -> Optional[str]:
+        """Return the content recorded with a completed chunk, or None."""
+        marker = self.marker(name)
+        return marker.read_text() if marker.exists() else None
+
+    def mark_done(self, name: str, content: str = "") -> None:
+        write_text_atomic(self.marker(name), content)
+
+    def clear(self) -> None:
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def positive_int(value: str) -> int:
+    """argparse type for chunk sizes such as --checkpoint_cells."""
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {value}")
+    return number
+
+
+def input_fingerprint(paths: Sequence[PathLike], *params) -> str:
+    """Identify the inputs and parameters a set of checkpoints was written for."""
+    parts = []
+    for path in paths:
+        stat = os.stat(path)
+        parts.append(f"{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}")
+    parts.extend(str(value) for value in params)
+    return "|".join(parts)
+
+
+def format_hit(hit: Sequence) -> str:
+    return "\t".join(str(value) for value in hit) + "\n"
+
+
+def write_hits(output_path: PathLike, header: str, hits: Iterable[Sequence]) -> None:
+    """Write a hit table of a helper script atomically."""
+    with atomic_output(Path(output_path)) as tmp_path:
+        with open(tmp_path, "w") as output:
+            output.write(header)
+            for hit in hits:
+                output.write(format_hit(hit))
+
+
+def write_hits_checkpointed(
+    output_path: PathLike,
+    header: str,
+    cells: Sequence[str],
+    hits_for_cells: Callable[[Sequence[str]], Iterable[Sequence]],
+    checkpoint_dir: PathLike,
+    chunk_cells: int,
+    fingerprint: str,
+) -> None:
+    """
+    Write the hits of consecutive chunks of cells to part files under
+    checkpoint_dir, each committed with a rename and a .done marker, then join
+    the parts into output_path. A rerun with the same fingerprint resumes
+    after the last completed chunk; a different fingerprint starts over.
+    """
+    checkpoints = ChunkCheckpoints(Path(checkpoint_dir), fingerprint)
+    parts = []
+    resumed = 0
+    for index, start in enumerate(range(0, len(cells), chunk_cells)):
+        name = f"part{index:05d}.tsv"
+        part_path = checkpoints.directory / name
+        parts.append(part_path)
+        if checkpoints.is_done(name):
+            resumed += 1
+            continue
+        with atomic_output(part_path) as tmp_path:
+            with open(tmp_path, "w") as output:
+                for hit in hits_for_cells(cells[start:start + chunk_cells]):
+                    output.write(format_hit(hit))
+        checkpoints.mark_done(name)
+
+    if resumed:
+        print(f"Resumed {resumed} of {len(parts)} completed chunk(s) from {checkpoints.directory}")
+
+    with atomic_output(Path(output_path)) as tmp_path:
+        with open(tmp_path, "w") as output:
+            output.write(header)
+            for part_path in parts:
+                with open(part_path, "r") as part:
+                    shutil.copyfileobj(part, output)
+    checkpoints.clear()
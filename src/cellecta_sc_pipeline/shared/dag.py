@@ -0,0 +1,119 @@
+"""Run pipeline tasks as a dependency graph on a thread pool."""
+
+import traceback
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Callable, Dict, List, Mapping, Optional, Sequence
+
+
+class Task:
+    def __init__(self, name: str, func: Callable[[], None], deps: Sequence[str], group: Optional[str], priority: float):
+        self.name = name
+        self.func = func
+        self.deps = list(deps)
+        self.group = group
+        self.priority = priority
+
+
+class TaskGraph:
+    """
+    Tasks with dependencies, started as soon as everything they depend on has
+    finished. Ready tasks start by descending priority and then in the order
+    they were added, so with one worker and equal priorities the graph runs in
+    insertion order. Dependencies must be added
+    before the tasks that need them, which also rules out cycles.
+    """
+
+    def __init__(self):
+        self.tasks: Dict[str, Task] = {}
+
+    def add(
+        self,
+        name: str,
+        func: Callable[[], None],
+        deps: Sequence[str] = (),
+        group: Optional[str] = None,
+        priority: float = 0,
+    ) -> str:
+        if name in self.tasks:
+            raise ValueError(f"Duplicate task: {name}")
+        missing = [dep for dep in deps if dep not in self.tasks]
+        if missing:
+            raise ValueError(f"Task {name} depends on unknown task(s): {', '.join(missing)}")
+        self.tasks[name] = Task(name, func, deps, group, priority)
+        return name
+
+    def run(
+        self,
+        jobs: int = 1,
+        *,
+        keep_going: bool = False,
+        group_limits: Optional[Mapping[str, int]] = None,
+    ) -> List[str]:
+        """
+        Run every task with up to `jobs` at a time and at most
+        `group_limits[group]` at a time per group. Returns the failed tasks;
+        tasks downstream of a failure are reported as blocked and never run.
+        Without keep_going the first failure stops new tasks from starting
+        and is re-raised once the running ones finish.
+        """
+        group_limits = dict(group_limits or {})
+        state = {name: "pending" for name in self.tasks}
+        running: Dict[Future, Task] = {}
+        failed: List[str] = []
+        first_error: Optional[BaseException] = None
+
+        def running_in(group: Optional[str]) -> int:
+            return sum(1 for task in running.values() if group is not None and task.group == group)
+
+        def ready() -> List[Task]:
+            tasks = []
+            for task in self.tasks.values():
+                if state[task.name] != "pending":
+                    continue
+                if any(state[dep] != "done" for dep in task.deps):
+                    continue
+                tasks.append(task)
+            return sorted(tasks, key=lambda task: -task.priority)
+
+        def block_downstream(name: str) -> None:
+            for task in self.tasks.values():
+                if state[task.name] == "pending" and name in task.deps:
+                    state[task.name] = "blocked"
+                    print(f"[BLOCKED] {task.name}: depends on {name}", flush=True)
+                    block_downstream(task.name)
+
+        with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+            while True:
+                if first_error is None or keep_going:
+                    for task in ready():
+                        if len(running) >= max(1, jobs):
+                            break
+                        limit = group_limits.get(task.group)
+                        if limit is not None and running_in(task.group) >= limit:
+                            continue
+                        state[task.name] = "running"
+                        print(f"[START] {task.name}", flush=True)
+                        running[pool.submit(task.func)] = task
+
+                if not running:
+                    break
+                done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+                for future in done:
+                    task = running.pop(future)
+                    error = future.exception()
+                    if error is None:
+                        state[task.name] = "done"
+                        print(f"[FINISH] {task.name}", flush=True)
+                        continue
+                    state[task.name] = "failed"
+                    failed.append(task.name)
+                    if keep_going:
+                        traceback.print_exception(type(error), error, error.__traceback__)
+                    print(f"[FAIL] {task.name}: {error}", flush=True)
+                    block_downstream(task.name)
+                    if first_error is None:
+                        first_error = error
+
+        if first_error is not None and not keep_going:
+            raise first_error
+        return failed
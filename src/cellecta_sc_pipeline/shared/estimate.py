@@ -0,0 +1,238 @@
+"""Dry-run projections of per-stage runtime, memory and disk from sampled FASTQs."""
+
+import csv
+import gzip
+import hashlib
+import math
+import shutil
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+
+# Rough single-core planning rates for the assignment stages. They size nodes
+# to within a small factor; run_profile.jsonl from a real run is the better guide.
+MERGE_BYTES_PER_SECOND = 300e6
+EXTRACT_READS_PER_SECOND = 60_000
+BEST_SEQUENCE_READS_PER_SECOND = 400_000
+MATCHING_ROWS_PER_SECOND = 200_000
+# Python object overhead of the in-memory tables, in bytes per entry.
+BEST_SEQUENCE_BYTES_PER_CELL_UMI = 350
+BEST_SEQUENCE_BYTES_PER_SEQUENCE = 120
+MATCHING_BYTES_PER_ROW = 250
+# Extracted FASTQs at gzip level 1 are somewhat larger than the level-6 input.
+FAST_GZIP_SIZE_FACTOR = 1.15
+
+ESTIMATE_COLUMNS = [
+    "sample",
+    "stage",
+    "reads",
+    "cells",
+    "cell_umis",
+    "sequences",
+    "wall_s",
+    "peak_mem_gb",
+    "disk_gb",
+]
+
+
+class HyperLogLog:
+    """Fixed-memory distinct-count sketch (about 1.6% error with 4096 registers)."""
+
+    def __init__(self, precision: int = 12):
+        self.precision = precision
+        self.size = 1 << precision
+        self.registers = bytearray(self.size)
+
+    def add(self, value: str) -> None:
+        hashed = int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), "big")
+        index = hashed >> (64 - self.precision)
+        rest = hashed & ((1 << (64 - self.precision)) - 1)
+        rank = (64 - self.precision) - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def copy(self) -> "HyperLogLog":
+        other = HyperLogLog(self.precision)
+        other.registers[:] = self.registers
+        return other
+
+    def count(self) -> float:
+        alpha = 0.7213 / (1 + 1.079 / self.size)
+        estimate = alpha * self.size ** 2 / sum(2.0 ** -register for register in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * self.size and zeros:
+            # Linear counting is more accurate while many registers are empty.
+            return self.size * math.log(self.size / zeros)
+        return estimate
+
+
+def pattern_positions(bc_pattern: str) -> Tuple[List[int], List[int]]:
+    """Cell (C) and UMI (N) positions of a umi_tools string barcode pattern."""
+    cells = [index for index, char in enumerate(bc_pattern) if char == "C"]
+    umis = [index for index, char in enumerate(bc_pattern) if char == "N"]
+    return cells, umis
+
+
+def read_record(handle) -> Optional[str]:
+    header = handle.readline()
+    if not header:
+        return None
+    sequence = handle.readline()
+    handle.readline()
+    handle.readline()
+    return sequence.rstrip("\n")
+
+
+def project_count(
+    full: float,
+    partial: float,
+    partial_reads: int,
+    sampled_reads: int,
+    total_reads: float,
+) -> float:
+    """
+    Extrapolate a distinct count from an early part and all of a sample with a
+    power law, which follows the saturation of barcodes in deeper data.
+    """
+    if total_reads <= sampled_reads or partial <= 0 or partial_reads >= sampled_reads:
+        return full
+    exponent = math.log(max(full, partial) / partial) / math.log(sampled_reads / partial_reads)
+    exponent = min(1.0, max(0.0, exponent))
+    return min(total_reads, full * (total_reads / sampled_reads) ** exponent)
+
+
+def sample_fastq_pair(
+    r1_files: Sequence[Path],
+    r2_files: Sequence[Path],
+    bc_pattern: str,
+    max_reads: int,
+) -> Dict[str, float]:
+    """
+    Read up to max_reads records from the first lane and project read count and
+    distinct cells, cell-UMIs and barcode sequences over all lanes.
+    """
+    cell_positions, umi_positions = pattern_positions(bc_pattern)
+    sketches = {name: HyperLogLog() for name in ("cells", "cell_umis", "sequences", "cell_umi_sequences")}
+    # Snapshots at every power of two, so a short first lane still has an early point.
+    snapshots = {}
+    reads = 0
+    text_bytes = 0
+    with open(r1_files[0], "rb") as raw1, open(r2_files[0], "rb") as raw2, \
+            gzip.open(raw1, "rt") as fastq1, gzip.open(raw2, "rt") as fastq2:
+        while reads < max_reads:
+            read1, read2 = read_record(fastq1), read_record(fastq2)
+            if read1 is None or read2 is None:
+                break
+            cell = "".join(read1[index] for index in cell_positions if index < len(read1))
+            cell_umi = cell + "".join(read1[index] for index in umi_positions if index < len(read1))
+            sketches["cells"].add(cell)
+            sketches["cell_umis"].add(cell_umi)
+            sketches["sequences"].add(read2)
+            sketches["cell_umi_sequences"].add(cell_umi + read2)
+            reads += 1
+            text_bytes += 2 * (len(read1) + len(read2)) + 8
+            if reads >= 64 and reads & (reads - 1) == 0:
+                snapshots[reads] = {name: sketch.copy() for name, sketch in sketches.items()}
+        # Compressed bytes consumed so far, give or take the read-ahead buffer.
+        sampled_bytes = raw1.tell() + raw2.tell()
+
+    compressed_bytes = sum(path.stat().st_size for path in list(r1_files) + list(r2_files))
+    if reads < max_reads:
+        # The first lane was read to the end, so its record count is exact.
+        sampled_bytes = r1_files[0].stat().st_size + r2_files[0].stat().st_size
+    total_reads = reads * compressed_bytes / max(sampled_bytes, 1)
+
+    stats = {
+        "reads": total_reads,
+        "compressed_bytes": float(compressed_bytes),
+        "text_bytes_per_read": text_bytes / reads if reads else 0.0,
+    }
+    early_reads = max((count for count in snapshots if count <= reads // 2), default=0)
+    for name, sketch in sketches.items():
+        early = snapshots[early_reads][name].count() if early_reads else 0.0
+        stats[name] = project_count(sketch.count(), early, early_reads, reads, total_reads)
+    return stats
+
+
+def project_stages(
+    sample: str,
+    stats: Dict[str, float],
+    *,
+    stream_extract: bool = False,
+    compresslevel: int = 1,
+) -> List[dict]:
+    """Projected wall time, peak memory and disk use of each assignment stage."""
+    reads = stats["reads"]
+    cell_umis = stats["cell_umis"]
+    best_sequence_mem = (
+        cell_umis * BEST_SEQUENCE_BYTES_PER_CELL_UMI
+        + stats["cell_umi_sequences"] * BEST_SEQUENCE_BYTES_PER_SEQUENCE
+    )
+    cell_umi_tsv_bytes = cell_umis * 80
+
+    if compresslevel > 0:
+        extracted_bytes = stats["compressed_bytes"] * FAST_GZIP_SIZE_FACTOR
+    else:
+        extracted_bytes = reads * stats["text_bytes_per_read"]
+
+    stages = [("merge", stats["compressed_bytes"] / MERGE_BYTES_PER_SECOND, 0.05e9, stats["compressed_bytes"])]
+    if stream_extract:
+        stages.append((
+            "stream_extract",
+            reads / EXTRACT_READS_PER_SECOND,
+            best_sequence_mem,
+            cell_umi_tsv_bytes,
+        ))
+    else:
+        stages.append(("extract", reads / EXTRACT_READS_PER_SECOND, 0.3e9, extracted_bytes))
+        stages.append((
+            "best_sequence",
+            reads / BEST_SEQUENCE_READS_PER_SECOND,
+            best_sequence_mem,
+            cell_umi_tsv_bytes,
+        ))
+    stages.append(("matching", cell_umis / MATCHING_ROWS_PER_SECOND, cell_umis * MATCHING_BYTES_PER_ROW, 0.0))
+
+    rows = []
+    for stage, wall_s, mem_bytes, disk_bytes in stages:
+        rows.append({
+            "sample": sample,
+            "stage": stage,
+            "reads": int(reads),
+            "cells": int(stats["cells"]),
+            "cell_umis": int(cell_umis),
+            "sequences": int(stats["sequences"]),
+            "wall_s": round(wall_s, 1),
+            "peak_mem_gb": round(mem_bytes / 1e9, 2),
+            "disk_gb": round(disk_bytes / 1e9, 2),
+        })
+    return rows
+
+
+def write_estimate(rows: Iterable[dict], path: Path) -> List[dict]:
+    """Write the projections as TSV, print them with totals and warn when disk looks short."""
+    rows = list(rows)
+    if not rows:
+        return rows
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w", newline="") as handle:
+        writer = csv.DictWriter(handle, fieldnames=ESTIMATE_COLUMNS, delimiter="\t")
+        writer.writeheader()
+        writer.writerows(rows)
+
+    widths = {column: max(len(column), *(len(str(row[column])) for row in rows)) for column in ESTIMATE_COLUMNS}
+    print(f"\n[ESTIMATE] projected assignment stages -> {path}")
+    print("  ".join(column.ljust(widths[column]) for column in ESTIMATE_COLUMNS))
+    for row in rows:
+        print("  ".join(str(row[column]).ljust(widths[column]) for column in ESTIMATE_COLUMNS))
+
+    wall_s = sum(row["wall_s"] for row in rows)
+    peak_gb = max(row["peak_mem_gb"] for row in rows)
+    disk_gb = sum(row["disk_gb"] for row in rows)
+    free_gb = shutil.disk_usage(path.parent).free / 1e9
+    print(f"Total: {wall_s / 3600:.2f} CPU-hours, peak {peak_gb} GB per stage, "
+          f"{disk_gb:.2f} GB written ({free_gb:.1f} GB free)")
+    if disk_gb > free_gb:
+        print("[WARN] projected output exceeds free disk; consider --stream-extract or --scratch-dir")
+    return rows
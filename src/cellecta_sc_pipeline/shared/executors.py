@@ -0,0 +1,215 @@
+"""Backends that run pipeline commands locally or as batch scheduler jobs."""
+
+import re
+import shlex
+import subprocess
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from cellecta_sc_pipeline.shared.checkpoints import write_text_atomic
+from cellecta_sc_pipeline.shared.profiling import RunProfiler
+
+
+# (cpus, memory in GB) requested for a job; None leaves it to the scheduler.
+JobResources = Tuple[Optional[int], Optional[float]]
+
+HEADER_TEMPLATES: Dict[str, Dict[str, str]] = {
+    "slurm": {
+        "name": "#SBATCH --job-name={name}",
+        "log": "#SBATCH --output={log}",
+        "cpus": "#SBATCH --cpus-per-task={cpus}",
+        "mem_gb": "#SBATCH --mem={mem_gb}G",
+    },
+    "pbs": {
+        "name": "#PBS -N {name}",
+        "log": "#PBS -j oe\n#PBS -o {log}",
+        "cpus": "#PBS -l ncpus={cpus}",
+        "mem_gb": "#PBS -l mem={mem_gb}gb",
+    },
+}
+DEFAULT_SUBMIT_COMMANDS = {"slurm": "sbatch", "pbs": "qsub"}
+# Used with the default submit command; they fail or print nothing once the job has left the queue.
+DEFAULT_STATUS_COMMANDS = {"slurm": "squeue -h -j {job_id}", "pbs": "qstat {job_id}"}
+# Passed on to jobs so they find the same tools and package sources.
+EXPORTED_ENV = ("PATH", "PYTHONPATH")
+
+
+class LocalExecutor:
+    """Run each command as a subprocess of this process."""
+
+    def run(
+        self,
+        cmd: List[str],
+        *,
+        name: str,
+        cwd: Optional[Path] = None,
+        env: Optional[Dict[str, str]] = None,
+        resources: JobResources = (None, None),
+        profiler: Optional[RunProfiler] = None,
+        stage: str = "command",
+    ) -> None:
+        if profiler is not None:
+            profiler.run(cmd, stage=stage, cwd=cwd, env=env)
+        else:
+            subprocess.run(cmd, cwd=str(cwd) if cwd else None, check=True, env=env)
+
+
+class BatchScriptExecutor:
+    """
+    Write one job script per command with the scheduler's resource headers,
+    submit it, and wait for the exit-code sentinel the script writes when it
+    finishes. Any submit command that eventually runs the script works, e.g.
+    `bash` for a local dry run.
+
+    A job killed with SIGKILL (out of memory, a node failure) never writes the
+    sentinel. While waiting, the status command (`{job_id}` is the last word
+    the submit command printed) is run every poll; once it fails or prints
+    nothing and there is still no sentinel, the task fails. max_wait bounds
+    the wait when no status command is set.
+
+    Jobs must see the same filesystem paths as this process. They are not
+    profiled here; the assignment batch still records its own stages.
+    """
+
+    def __init__(
+        self,
+        script_dir: Path,
+        style: str = "slurm",
+        submit_cmd: Optional[str] = None,
+        poll_interval: float = 30,
+        extra_headers: Sequence[str] = (),
+        max_wait: Optional[float] = None,
+        status_cmd: Optional[str] = None,
+    ):
+        if style not in HEADER_TEMPLATES:
+            raise ValueError(f"Unknown scheduler style '{style}', expected one of {sorted(HEADER_TEMPLATES)}")
+        self.script_dir = Path(script_dir)
+        self.style = style
+        self.submit_cmd = shlex.split(submit_cmd or DEFAULT_SUBMIT_COMMANDS[style])
+        self.poll_interval = poll_interval
+        self.extra_headers = list(extra_headers)
+        self.max_wait = max_wait
+        if status_cmd is None and submit_cmd is None:
+            status_cmd = DEFAULT_STATUS_COMMANDS[style]
+        self.status_cmd = shlex.split(status_cmd) if status_cmd else []
+
+    def sentinel_path(self, name: str) -> Path:
+        return self.script_dir / f"{name}.exitcode"
+
+    def job_running(self, job_id: str) -> bool:
+        """Ask the scheduler whether the job is still queued or running."""
+        if not self.status_cmd or not job_id:
+            return True
+        status_cmd = [part.replace("{job_id}", job_id) for part in self.status_cmd]
+        try:
+            status = subprocess.run(status_cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+        except OSError as exc:
+            print(f"[WARN] job status command failed: {exc}", flush=True)
+            return True
+        return status.returncode == 0 and bool(status.stdout.strip())
+
+    def wait_for_sentinel(self, name: str, job_id: str) -> Path:
+        sentinel = self.sentinel_path(name)
+        started = time.monotonic()
+        gone_polls = 0
+        while not sentinel.exists():
+            if self.max_wait is not None and time.monotonic() - started > self.max_wait:
+                raise TimeoutError(f"{name}: no exit code after {self.max_wait:g}s (job {job_id or 'unknown'})")
+            if self.job_running(job_id):
+                gone_polls = 0
+            else:
+                # Allow one more poll for the sentinel to show up on a shared filesystem.
+                gone_polls += 1
+                if gone_polls > 1:
+                    raise RuntimeError(
+                        f"{name}: job {job_id} is no longer queued but wrote no exit code; "
+                        f"it was probably killed (see {self.script_dir / (name + '.log')})"
+                    )
+            time.sleep(self.poll_interval)
+        return sentinel
+
+    def write_script(
+        self,
+        cmd: List[str],
+        name: str,
+        cwd: Optional[Path],
+        env: Optional[Dict[str, str]],
+        resources: JobResources,
+    ) -> Path:
+        templates = HEADER_TEMPLATES[self.style]
+        cpus, mem_gb = resources
+        script = self.script_dir / f"{name}.sh"
+        sentinel = self.sentinel_path(name)
+
+        lines = ["#!/bin/bash", templates["name"].format(name=name)]
+        lines.append(templates["log"].format(log=self.script_dir / f"{name}.log"))
+        if cpus:
+            lines.append(templates["cpus"].format(cpus=cpus))
+        if mem_gb:
+            lines.append(templates["mem_gb"].format(mem_gb=int(mem_gb)))
+        lines.extend(self.extra_headers)
+        lines.append("")
+        for key in EXPORTED_ENV:
+            if env and key in env:
+                lines.append(f"export {key}={shlex.quote(env[key])}")
+        if cwd:
+            lines.append(f"cd {shlex.quote(str(cwd))}")
+        # Schedulers send TERM before killing a job at its time limit.
+        lines.append(f"trap 'echo 143 > {shlex.quote(str(sentinel))}.tmp && "
+                     f"mv {shlex.quote(str(sentinel))}.tmp {shlex.quote(str(sentinel))}; exit 143' TERM")
+        lines.append(shlex.join(str(part) for part in cmd))
+        lines.append("status=$?")
+        lines.append(f"echo $status > {shlex.quote(str(sentinel))}.tmp")
+        lines.append(f"mv {shlex.quote(str(sentinel))}.tmp {shlex.quote(str(sentinel))}")
+        lines.append("exit $status")
+        write_text_atomic(script, "\n".join(lines) + "\n")
+        script.chmod(0o755)
+        return script
+
+    def run(
+        self,
+        cmd: List[str],
+        *,
+        name: str,
+        cwd: Optional[Path] = None,
+        env: Optional[Dict[str, str]] = None,
+        resources: JobResources = (None, None),
+        profiler: Optional[RunProfiler] = None,
+        stage: str = "command",
+    ) -> None:
+        name = re.sub(r"[^A-Za-z0-9_.-]", "_", name)
+        self.script_dir.mkdir(parents=True, exist_ok=True)
+        sentinel = self.sentinel_path(name)
+        sentinel.unlink(missing_ok=True)
+        script = self.write_script(cmd, name, cwd, env, resources)
+
+        submit = self.submit_cmd + [str(script)]
+        submitted = subprocess.run(submit, stdout=subprocess.PIPE, text=True)
+        # A submit command that runs the job itself (bash) has already written the sentinel.
+        if submitted.returncode != 0 and not sentinel.exists():
+            raise subprocess.CalledProcessError(submitted.returncode, submit, submitted.stdout)
+        print(f"[SUBMIT] {name}: {submitted.stdout.strip() or script}", flush=True)
+        # sbatch prints "Submitted batch job 123" (or "123;cluster" with --parsable), qsub "123.server".
+        words = submitted.stdout.split()
+        job_id = words[-1].split(";")[0] if words else ""
+        self.wait_for_sentinel(name, job_id)
+
+        returncode = int(sentinel.read_text().strip() or 1)
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, cmd)
+
+
+def build_executor(
+    name: str,
+    script_dir: Path,
+    submit_cmd: Optional[str] = None,
+    poll_interval: float = 30,
+    extra_headers: Sequence[str] = (),
+    max_wait: Optional[float] = None,
+    status_cmd: Optional[str] = None,
+):
+    """Create the executor selected on the command line."""
+    if name == "local":
+        return LocalExecutor()
+    return BatchScriptExecutor(script_dir, name, submit_cmd, poll_interval, extra_headers, max_wait, status_cmd)
@@ -0,0 +1,107 @@
+"""Split paired FASTQ input into record-aligned chunks and run per-chunk commands in parallel."""
+
+import gzip
+import re
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from pathlib import Path
+from typing import Callable, List, Optional, Sequence, Tuple
+
+from cellecta_sc_pipeline.shared.checkpoints import ChunkCheckpoints, atomic_output
+
+
+FastqPair = Tuple[Path, Path]
+
+# Chunks are temporary, so favour speed over size when recompressing them.
+CHUNK_COMPRESSLEVEL = 1
+# The read token of an Illumina file name, e.g. "_R1_" in S1_S1_L001_R1_001.fastq.gz.
+READ1_TOKEN = re.compile(r"_R1(_\d+\.f(ast)?q)")
+
+
+def lane_chunks(r1_files: Sequence[Path], r2_files: Sequence[Path]) -> List[FastqPair]:
+    """Pair lane files by name; each lane pair is one chunk."""
+    if len(r1_files) != len(r2_files):
+        raise ValueError(f"Found {len(r1_files)} R1 but {len(r2_files)} R2 fastqs; cannot pair lanes")
+    pairs = []
+    for r1, r2 in zip(r1_files, r2_files):
+        if READ1_TOKEN.sub(r"_R2\1", r1.name) != r2.name:
+            raise ValueError(f"Lane files do not pair up: {r1.name} / {r2.name}")
+        pairs.append((Path(r1), Path(r2)))
+    return pairs
+
+
+def split_fastq_pair(
+    r1: Path,
+    r2: Path,
+    out_dir: Path,
+    reads_per_chunk: int,
+    checkpoints: Optional[ChunkCheckpoints] = None,
+) -> List[FastqPair]:
+    """
+    Split a paired FASTQ into consecutive chunks of reads_per_chunk records.
+    Chunks keep input order, so concatenating per-chunk outputs in chunk order
+    reproduces a single run over the whole input. With checkpoints, chunks
+    written by an interrupted run are skipped rather than rewritten.
+    """
+    if checkpoints is not None and checkpoints.is_done("split"):
+        count = int(checkpoints.read("split"))
+        return [
+            (out_dir / f"chunk{index:04d}_R1.fastq.gz", out_dir / f"chunk{index:04d}_R2.fastq.gz")
+            for index in range(count)
+        ]
+
+    if reads_per_chunk <= 0:
+        raise ValueError("reads_per_chunk must be > 0")
+    out_dir.mkdir(parents=True, exist_ok=True)
+    lines_per_chunk = reads_per_chunk * 4
+
+    chunks = []
+    with gzip.open(r1, "rb") as reader1, gzip.open(r2, "rb") as reader2:
+        while True:
+            index = len(chunks)
+            chunk_r1 = out_dir / f"chunk{index:04d}_R1.fastq.gz"
+            chunk_r2 = out_dir / f"chunk{index:04d}_R2.fastq.gz"
+            chunk_name = f"split{index:04d}"
+            if checkpoints is not None and checkpoints.is_done(chunk_name):
+                # Still read past the chunk so the next one starts at the right record.
+                for reader in (reader1, reader2):
+                    for _ in islice(reader, lines_per_chunk):
+                        pass
+                chunks.append((chunk_r1, chunk_r2))
+                continue
+
+            counts = []
+            for reader, path in ((reader1, chunk_r1), (reader2, chunk_r2)):
+                with atomic_output(path) as tmp_path:
+                    with gzip.open(tmp_path, "wb", compresslevel=CHUNK_COMPRESSLEVEL) as writer:
+                        written = 0
+                        for line in islice(reader, lines_per_chunk):
+                            writer.write(line)
+                            written += 1
+                counts.append(written)
+
+            if counts[0] != counts[1]:
+                raise ValueError(f"{r1} and {r2} do not contain the same number of records")
+            if counts[0] == 0:
+                chunk_r1.unlink()
+                chunk_r2.unlink()
+                break
+            chunks.append((chunk_r1, chunk_r2))
+            if checkpoints is not None:
+                checkpoints.mark_done(chunk_name)
+
+    if checkpoints is not None:
+        checkpoints.mark_done("split", str(len(chunks)))
+    return chunks
+
+
+def run_parallel(tasks: Sequence, runner: Callable[[object], None], jobs: int) -> None:
+    """
+    Call runner(task) for every task using up to `jobs` threads. Every task
+    runs to completion; the first failure is re-raised afterwards.
+    """
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+        futures = [pool.submit(runner, task) for task in tasks]
+    errors = [future.exception() for future in futures if future.exception() is not None]
+    if errors:
+        raise errors[0]
@@ -0,0 +1,90 @@
+"""
+Run helper scripts and pipeline entry points inside the current interpreter.
+
+In-process commands run in this process's working directory; os.chdir would
+move every thread of a threaded pipeline. Callers therefore resolve their
+paths once at startup (absolute_path_args) and pass every output explicitly.
+"""
+
+import argparse
+import hashlib
+import importlib
+import importlib.util
+import subprocess
+import sys
+from functools import lru_cache
+from pathlib import Path
+from types import ModuleType
+from typing import Callable, List, Sequence
+
+
+@lru_cache(maxsize=None)
+def load_helper(path: str) -> ModuleType:
+    """
+    Import a helper script by path once per process. Later samples reuse the
+    module, its imports (pandas, matplotlib) and any module-level reference cache.
+    """
+    resolved = Path(path).resolve()
+    digest = hashlib.sha1(str(resolved).encode()).hexdigest()[:8]
+    name = f"cellecta_helper_{resolved.stem}_{digest}"
+    spec = importlib.util.spec_from_file_location(name, resolved)
+    if spec is None or spec.loader is None:
+        raise ImportError(f"Cannot load helper script: {resolved}")
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    if not hasattr(module, "build_parser") or not hasattr(module, "main"):
+        raise ImportError(f"Helper script {resolved} does not define build_parser() and main(args)")
+    return module
+
+
+def absolute_path_args(args: argparse.Namespace, names: Sequence[str]) -> None:
+    """Replace the given path options with absolute paths, keeping unset ones."""
+    for name in names:
+        value = getattr(args, name, None)
+        if value:
+            resolved = Path(value).resolve()
+            setattr(args, name, resolved if isinstance(value, Path) else str(resolved))
+
+
+def call_main(main: Callable, argv: Sequence[str], cmd: List[str]) -> None:
+    """
+    Call an entry point the way its process would run, raising
+    CalledProcessError for a non-zero exit so callers handle both paths alike.
+    """
+    sys.stdout.flush()
+    try:
+        main(list(argv))
+    except SystemExit as exc:
+        if exc.code not in (None, 0):
+            if not isinstance(exc.code, int):
+                print(exc.code, file=sys.stderr)
+            raise subprocess.CalledProcessError(exc.code if isinstance(exc.code, int) else 1, cmd) from exc
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+
+
+def is_helper_command(cmd: Sequence[str]) -> bool:
+    """True for `python <script>.py ...` commands that can run in-process."""
+    return len(cmd) >= 2 and cmd[0] == sys.executable and str(cmd[1]).endswith(".py")
+
+
+def is_module_command(cmd: Sequence[str]) -> bool:
+    """True for `python -m <module> ...` commands that can run in-process."""
+    return len(cmd) >= 3 and cmd[0] == sys.executable and cmd[1] == "-m"
+
+
+def run_in_process(cmd: List[str]) -> None:
+    """
+    Run a `python script.py` or `python -m module` command without a new
+    interpreter. Relative paths in cmd resolve against this process's cwd.
+    """
+    if is_helper_command(cmd):
+        module = load_helper(str(cmd[1]))
+        call_main(lambda argv: module.main(module.build_parser().parse_args(argv)), cmd[2:], cmd)
+    elif is_module_command(cmd):
+        module = importlib.import_module(cmd[2])
+        call_main(module.main, cmd[3:], cmd)
+    else:
+        raise ValueError(f"Not a Python command that can run in-process: {cmd}")
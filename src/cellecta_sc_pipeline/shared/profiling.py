@@ -0,0 +1,285 @@
+"""Per-stage resource profiling: wall time, CPU, peak RSS and I/O bytes."""
+
+import contextlib
+import csv
+import json
+import os
+import resource
+import subprocess
+import sys
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Sequence
+
+
+IO_FIELDS = ("rchar", "wchar", "read_bytes", "write_bytes")
+SUMMARY_COLUMNS = [
+    "sample",
+    "stage",
+    "runs",
+    "wall_s",
+    "user_s",
+    "sys_s",
+    "max_rss_mb",
+    "read_mb",
+    "write_mb",
+    "storage_read_mb",
+    "storage_write_mb",
+    "approximate_runs",
+]
+
+
+def new_run_id() -> str:
+    return f"{datetime.now().strftime('%Y%m%dT%H%M%S')}-{os.getpid()}"
+
+
+def read_proc_io(pid: str = "self") -> Dict[str, int]:
+    """Read the I/O counters of /proc/<pid>/io, or {} where they are unavailable."""
+    counters = {}
+    try:
+        with open(f"/proc/{pid}/io") as handle:
+            for line in handle:
+                key, _, value = line.partition(":")
+                if key in IO_FIELDS:
+                    counters[key] = int(value)
+    except OSError:
+        return {}
+    return counters
+
+
+def max_rss_mb(maxrss: int) -> float:
+    # ru_maxrss is reported in bytes on macOS and in kilobytes elsewhere.
+    divisor = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return round(maxrss / divisor, 1)
+
+
+class _OpenStages:
+    """
+    Track the stages running in this process, per thread.
+
+    An in-process measurement is a delta of process-wide counters, so it also
+    picks up whatever another thread ran meanwhile. A measurement is overlapped
+    when a stage in another thread was running when it started or started
+    before it finished.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.running: Dict[int, int] = {}
+        self.measuring: Dict[int, List[bool]] = {}
+
+    def enter(self) -> None:
+        thread = threading.get_ident()
+        with self.lock:
+            for owner, flags in self.measuring.items():
+                if owner != thread:
+                    for flag in flags:
+                        flag[0] = True
+            self.running[thread] = self.running.get(thread, 0) + 1
+
+    def exit(self) -> None:
+        thread = threading.get_ident()
+        with self.lock:
+            self.running[thread] -= 1
+            if not self.running[thread]:
+                del self.running[thread]
+
+    def open_measurement(self) -> List[bool]:
+        thread = threading.get_ident()
+        with self.lock:
+            flag = [any(owner != thread for owner in self.running)]
+            self.measuring.setdefault(thread, []).append(flag)
+        self.enter()
+        return flag
+
+    def close_measurement(self, flag: List[bool]) -> bool:
+        thread = threading.get_ident()
+        self.exit()
+        with self.lock:
+            flags = self.measuring[thread]
+            flags.remove(flag)
+            if not flags:
+                del self.measuring[thread]
+        return flag[0]
+
+
+OPEN_STAGES = _OpenStages()
+
+
+class RunProfiler:
+    """
+    Append one JSON record per executed stage to a shared `run_profile.jsonl`.
+
+    Subprocess stages are measured exactly: the child is reaped with wait4() for
+    its rusage after /proc/<pid>/io is read while it is still a zombie. Stages
+    run inside this interpreter are measured from self and children deltas, so
+    their peak RSS is the process peak so far rather than the stage's own, and
+    they are marked approximate when a stage in another thread overlapped them.
+    """
+
+    def __init__(self, path: Path, run_id: str, sample: str = ""):
+        self.path = Path(path)
+        self.run_id = run_id
+        self.sample = sample
+
+    def write(self, stage: str, cmd: Optional[Sequence[str]], mode: str, started: float, **measurements) -> None:
+        record = OrderedDict(
+            run_id=self.run_id,
+            sample=self.sample,
+            stage=stage,
+            mode=mode,
+            start=datetime.fromtimestamp(started).isoformat(timespec="seconds"),
+            cmd=" ".join(str(part) for part in cmd) if cmd else None,
+        )
+        record.update(measurements)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # One short O_APPEND write per record keeps lines from concurrent samples intact.
+        with open(self.path, "a") as handle:
+            handle.write(json.dumps(record) + "\n")
+
+    def run(self, cmd: List[str], *, stage: str, cwd: Optional[Path] = None, env: Optional[Dict[str, str]] = None) -> None:
+        """Run a subprocess like subprocess.run(check=True) and record its resource use."""
+        started = time.time()
+        wall_start = time.perf_counter()
+        OPEN_STAGES.enter()
+        try:
+            process = subprocess.Popen(cmd, cwd=str(cwd) if cwd else None, env=env)
+            try:
+                # Wait without reaping so /proc/<pid>/io still describes the child.
+                os.waitid(os.P_PID, process.pid, os.WEXITED | os.WNOWAIT)
+                io_counters = read_proc_io(str(process.pid))
+                _, status, usage = os.wait4(process.pid, 0)
+            except BaseException:
+                process.kill()
+                process.wait()
+                raise
+        finally:
+            OPEN_STAGES.exit()
+        process.returncode = -os.WTERMSIG(status) if os.WIFSIGNALED(status) else os.WEXITSTATUS(status)
+
+        self.write(
+            stage,
+            cmd,
+            "subprocess",
+            started,
+            returncode=process.returncode,
+            wall_s=round(time.perf_counter() - wall_start, 3),
+            user_s=round(usage.ru_utime, 3),
+            sys_s=round(usage.ru_stime, 3),
+            max_rss_mb=max_rss_mb(usage.ru_maxrss),
+            **io_counters,
+        )
+        if process.returncode != 0:
+            raise subprocess.CalledProcessError(process.returncode, cmd)
+
+    @contextlib.contextmanager
+    def measure(self, stage: str, cmd: Optional[Sequence[str]] = None) -> Iterator[None]:
+        """Record a stage executed in this process, including any children it reaps."""
+        started = time.time()
+        wall_start = time.perf_counter()
+        self_start = resource.getrusage(resource.RUSAGE_SELF)
+        children_start = resource.getrusage(resource.RUSAGE_CHILDREN)
+        io_start = read_proc_io()
+        overlap = OPEN_STAGES.open_measurement()
+        returncode = 1
+        try:
+            yield
+            returncode = 0
+        finally:
+            approximate = OPEN_STAGES.close_measurement(overlap)
+            self_end = resource.getrusage(resource.RUSAGE_SELF)
+            children_end = resource.getrusage(resource.RUSAGE_CHILDREN)
+            io_end = read_proc_io()
+            self.write(
+                stage,
+                cmd,
+                "in_process",
+                started,
+                returncode=returncode,
+                wall_s=round(time.perf_counter() - wall_start, 3),
+                user_s=round(
+                    self_end.ru_utime - self_start.ru_utime + children_end.ru_utime - children_start.ru_utime, 3
+                ),
+                sys_s=round(
+                    self_end.ru_stime - self_start.ru_stime + children_end.ru_stime - children_start.ru_stime, 3
+                ),
+                max_rss_mb=max_rss_mb(max(self_end.ru_maxrss, children_end.ru_maxrss)),
+                approximate=approximate,
+                **{key: io_end[key] - io_start.get(key, 0) for key in io_end},
+            )
+
+
+def profile_stage(profiler: Optional[RunProfiler], stage: str, cmd: Optional[Sequence[str]] = None):
+    """Measure a stage when profiling is enabled, or do nothing."""
+    if profiler is None:
+        return contextlib.nullcontext()
+    return profiler.measure(stage, cmd)
+
+
+def load_profile(path: Path, run_id: Optional[str] = None) -> List[dict]:
+    if not Path(path).exists():
+        return []
+    records = []
+    with open(path) as handle:
+        for line in handle:
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            if run_id is None or record.get("run_id") == run_id:
+                records.append(record)
+    return records
+
+
+def summarize_profile(records: Sequence[dict]) -> List[dict]:
+    """Roll records up per (sample, stage): summed time and bytes, maximum RSS."""
+    rollup: "OrderedDict[tuple, dict]" = OrderedDict()
+    for record in records:
+        key = (record.get("sample") or "-", record["stage"])
+        row = rollup.setdefault(key, dict.fromkeys(SUMMARY_COLUMNS[2:], 0))
+        row["runs"] += 1
+        for column in ("wall_s", "user_s", "sys_s"):
+            row[column] += record.get(column) or 0
+        row["max_rss_mb"] = max(row["max_rss_mb"], record.get("max_rss_mb") or 0)
+        row["read_mb"] += (record.get("rchar") or 0) / 1e6
+        row["write_mb"] += (record.get("wchar") or 0) / 1e6
+        row["storage_read_mb"] += (record.get("read_bytes") or 0) / 1e6
+        row["storage_write_mb"] += (record.get("write_bytes") or 0) / 1e6
+        row["approximate_runs"] += 1 if record.get("approximate") else 0
+
+    rows = []
+    # Concurrent samples interleave their records; group by sample, keeping stage order.
+    for (sample, stage), values in sorted(rollup.items(), key=lambda item: item[0][0]):
+        row = {"sample": sample, "stage": stage}
+        row.update({column: round(value, 2) if isinstance(value, float) else value for column, value in values.items()})
+        rows.append(row)
+    return rows
+
+
+def write_profile_summary(path: Path, run_id: Optional[str] = None) -> List[dict]:
+    """
+    Write `<profile>.summary.tsv` next to the JSONL for one run, print the
+    table and return its rows.
+    """
+    rows = summarize_profile(load_profile(path, run_id))
+    if not rows:
+        return rows
+
+    summary_path = Path(path).with_suffix(".summary.tsv")
+    with open(summary_path, "w", newline="") as handle:
+        writer = csv.DictWriter(handle, fieldnames=SUMMARY_COLUMNS, delimiter="\t")
+        writer.writeheader()
+        writer.writerows(rows)
+
+    widths = {
+        column: max(len(column), *(len(str(row[column])) for row in rows))
+        for column in SUMMARY_COLUMNS
+    }
+    print(f"\n[PROFILE] run {run_id or 'all'} -> {summary_path}")
+    print("  ".join(column.ljust(widths[column]) for column in SUMMARY_COLUMNS))
+    for row in rows:
+        print("  ".join(str(row[column]).ljust(widths[column]) for column in SUMMARY_COLUMNS))
+    return rows
@@ -0,0 +1,199 @@
+"""Concurrent per-sample scheduling shared by the batch runners."""
+
+import argparse
+import contextlib
+import multiprocessing
+import os
+import sys
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+
+# (cpus, memory in GB) reserved while a stage runs. Every stage is single-core;
+# memory reflects the in-memory tables built by the helper scripts.
+DEFAULT_STAGE_RESOURCES: Dict[str, Tuple[int, float]] = {
+    "whitelist": (1, 0.5),
+    "merge": (1, 0.5),
+    "extract": (1, 2),
+    "best_sequence": (1, 8),
+    # umi_tools extract piped straight into best-sequence selection.
+    "stream_extract": (2, 8),
+    "matching": (1, 8),
+    "final_assignment": (1, 4),
+    "consolidation": (1, 2),
+}
+
+
+def parse_stage_resources(text: Optional[str]) -> Dict[str, Tuple[int, float]]:
+    """Parse `stage=cpus:mem_gb,...` overrides on top of the default stage budget."""
+    resources = dict(DEFAULT_STAGE_RESOURCES)
+    if not text:
+        return resources
+
+    for item in text.split(","):
+        stage, separator, value = item.strip().partition("=")
+        cpus, _, mem_gb = value.partition(":")
+        if not separator or not cpus:
+            raise ValueError(f"Invalid stage resource '{item}', expected stage=cpus:mem_gb")
+        resources[stage.strip()] = (int(cpus), float(mem_gb) if mem_gb else 0.0)
+    return resources
+
+
+def add_scheduler_arguments(parser: argparse.ArgumentParser) -> None:
+    """Register the concurrency options shared by the batch runners."""
+    parser.add_argument("--jobs", type=int, default=1, help="Number of samples processed concurrently")
+    parser.add_argument(
+        "--keep_going",
+        action="store_true",
+        help="Keep processing other samples after a sample fails (default: stop scheduling new samples)",
+    )
+    parser.add_argument("--max_cpus", type=int, default=None, help="CPU budget shared by concurrent stages (default: all cores)")
+    parser.add_argument("--max_mem_gb", type=float, default=None, help="Memory budget in GB shared by concurrent stages (default: unlimited)")
+    parser.add_argument(
+        "--stage_resources",
+        default=None,
+        help="Per-stage reservations as stage=cpus:mem_gb, e.g. 'best_sequence=1:32,matching=1:16'",
+    )
+
+
+class ResourceBudget:
+    """CPU and memory pool that concurrent sample workers reserve stages from."""
+
+    def __init__(self, manager, cpus: int, mem_gb: Optional[float], stage_resources: Dict[str, Tuple[int, float]]):
+        self.cpus = cpus
+        self.mem_gb = float("inf") if mem_gb is None else mem_gb
+        self.stage_resources = dict(stage_resources)
+        self._condition = manager.Condition()
+        self._available = manager.dict(cpus=self.cpus, mem_gb=self.mem_gb)
+
+    @contextlib.contextmanager
+    def reserve(self, stage: str) -> Iterator[None]:
+        cpus, mem_gb = self.stage_resources.get(stage, (1, 0.0))
+        # A stage larger than the whole budget would otherwise wait forever.
+        cpus = min(cpus, self.cpus)
+        mem_gb = min(mem_gb, self.mem_gb)
+
+        with self._condition:
+            while self._available["cpus"] < cpus or self._available["mem_gb"] < mem_gb:
+                self._condition.wait()
+            self._available["cpus"] -= cpus
+            self._available["mem_gb"] -= mem_gb
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._available["cpus"] += cpus
+                self._available["mem_gb"] += mem_gb
+                self._condition.notify_all()
+
+
+def stage_slot(budget: Optional[ResourceBudget], stage: str):
+    """Reserve resources for a stage, or do nothing when running serially."""
+    if budget is None:
+        return contextlib.nullcontext()
+    return budget.reserve(stage)
+
+
+def _run_logged(worker: Callable, params: tuple, log_path: Path, budget: Optional[ResourceBudget]) -> None:
+    """Run one sample with stdout/stderr (including child processes) sent to its log file."""
+    sys.stdout.flush()
+    sys.stderr.flush()
+    saved = (os.dup(1), os.dup(2))
+    with log_path.open("w") as log:
+        os.dup2(log.fileno(), 1)
+        os.dup2(log.fileno(), 2)
+        try:
+            worker(*params, budget=budget)
+        except BaseException:
+            traceback.print_exc()
+            raise
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os.dup2(saved[0], 1)
+            os.dup2(saved[1], 2)
+            os.close(saved[0])
+            os.close(saved[1])
+
+
+def _run_serially(
+    samples: Sequence[Tuple[str, tuple]],
+    worker: Callable,
+    budget: Optional[ResourceBudget],
+    keep_going: bool,
+) -> List[str]:
+    failed: List[str] = []
+    for sample, params in samples:
+        try:
+            worker(*params, budget=budget)
+        except Exception:
+            if not keep_going:
+                raise
+            traceback.print_exc()
+            print(f"[FAIL] {sample}", flush=True)
+            failed.append(sample)
+    return failed
+
+
+def run_sample_jobs(
+    samples: Sequence[Tuple[str, tuple]],
+    worker: Callable,
+    *,
+    jobs: int,
+    log_dir: Path,
+    keep_going: bool,
+    max_cpus: Optional[int] = None,
+    max_mem_gb: Optional[float] = None,
+    stage_resources: Optional[Dict[str, Tuple[int, float]]] = None,
+) -> List[str]:
+    """
+    Run `worker(*params, budget=...)` for every (sample, params) pair and return
+    the names of failed samples. With jobs > 1 samples run in worker processes,
+    each logging to `<log_dir>/<sample>.log`; otherwise they run in order here.
+    The budget is shared by all samples and also bounds the concurrent stages
+    within one sample (parallel extract chunks), so with jobs == 1 it is only
+    skipped when neither max_cpus nor max_mem_gb is set.
+    """
+    failed: List[str] = []
+
+    if jobs <= 1 and max_cpus is None and max_mem_gb is None:
+        return _run_serially(samples, worker, None, keep_going)
+
+    with multiprocessing.Manager() as manager:
+        budget = ResourceBudget(
+            manager,
+            max_cpus or os.cpu_count() or 1,
+            max_mem_gb,
+            stage_resources or DEFAULT_STAGE_RESOURCES,
+        )
+        if jobs <= 1:
+            return _run_serially(samples, worker, budget, keep_going)
+        log_dir.mkdir(parents=True, exist_ok=True)
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            futures = {}
+            for sample, params in samples:
+                log_path = log_dir / f"{sample}.log"
+                futures[pool.submit(_run_logged, worker, params, log_path, budget)] = (sample, log_path)
+                print(f"[QUEUE] {sample} -> {log_path}", flush=True)
+
+            pending = set(futures)
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    sample, log_path = futures[future]
+                    if future.cancelled():
+                        print(f"[CANCEL] {sample}", flush=True)
+                        continue
+                    error = future.exception()
+                    if error is None:
+                        print(f"[DONE] {sample}", flush=True)
+                        continue
+                    failed.append(sample)
+                    print(f"[FAIL] {sample}: {error} (see {log_path})", flush=True)
+                    if not keep_going:
+                        # Running samples finish cleanly; queued ones are dropped.
+                        for other in pending:
+                            other.cancel()
+    return failed
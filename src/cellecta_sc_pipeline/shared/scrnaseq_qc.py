@@ -1,36 +1,37 @@
 #!/usr/bin/env python3
 import argparse
 import base64
+import csv
+import hashlib
+import itertools
+import json
+import multiprocessing
+import os
 import shutil
+import threading
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 from pathlib import Path
-from typing import Union, Any
+from typing import Any, List, Optional, Union
 
-try:
-    import matplotlib.pyplot as plt
-    import numpy as np
-    import pandas as pd
+from cellecta_sc_pipeline.shared.stage_cache import file_stat
 
-    # Compatibility fix for Numpy 1.24+ and older Numba
-    if 'long' not in dir(np):
-        np.long = int
-
-    import scanpy as sc
-except ModuleNotFoundError as exc:
-    plt = None
-    np = None
-    pd = None
-    sc = None
-    IMPORT_ERROR = exc
-else:
-    IMPORT_ERROR = None
+# Imported by load_dependencies() so --help and argument errors do not pay for
+# matplotlib, scanpy and numba at startup.
+plt = None
+np = None
+pd = None
+sc = None
+sparse = None
 
 
 CELLECTA_GREEN = "#2E8B57"
 CELLECTA_GRID = "#E5E5E5"
-
-if plt is not None:
-    plt.rcParams["axes.prop_cycle"] = plt.cycler(color=[CELLECTA_GREEN])
+QC_VARS = ("mt", "ribo", "hb")
+UNDETERMINED_TYPE = "Undetermined due to low UMI"
+FIGURES = ("violin", "types", "clone_sizes")
+# Rows per chunk for --low-memory metrics; bounds the temporary slice of the matrix.
+QC_CHUNK_ROWS = 50_000
 
 
 METRIC_CONFIG = {
@@ -64,13 +65,53 @@ METRIC_CONFIG = {
 }
 
 
+def load_dependencies() -> None:
+    """Import the plotting and single-cell stack on first use."""
+    global plt, np, pd, sc, sparse
+    if sc is not None:
+        return
+    if threading.current_thread() is not threading.main_thread():
+        # numba's default TBB layer, first started off the main thread (an
+        # in-process pipeline task), hangs the interpreter at exit. Those
+        # tasks take turns, so the single-caller workqueue layer is enough.
+        os.environ.setdefault("NUMBA_THREADING_LAYER", "workqueue")
+    try:
+        import matplotlib
+
+        # Figures are only ever saved to files, possibly from worker processes.
+        matplotlib.use("Agg")
+        import matplotlib.pyplot as plt
+        import numpy as np
+        import pandas as pd
+
+        # Compatibility fix for Numpy 1.24+ and older Numba
+        if 'long' not in dir(np):
+            np.long = int
+
+        import scanpy as sc
+        from scipy import sparse
+    except ModuleNotFoundError as exc:
+        raise ModuleNotFoundError(
+            "Required dependencies for run_scrnaseq_qc.py are not installed. "
+            "Install matplotlib, numpy, pandas, and scanpy to run QC."
+        ) from exc
+
+    plt.rcParams["axes.prop_cycle"] = plt.cycler(color=[CELLECTA_GREEN])
+
+
 def build_parser() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser(
         description="Cellecta single-cell QC pipeline"
     )
-    parser.add_argument("--input", required=True)
-    parser.add_argument("--output", required=True)
+    parser.add_argument("--input", help="CellRanger outs (or filtered matrix) of a single sample")
+    parser.add_argument("--output", required=True, help="Output folder; with --samples-csv, the root of per-sample folders")
     parser.add_argument("--sample-name")
+    parser.add_argument(
+        "--samples-csv",
+        help="CSV with sample,input and optional clonetracker_summary,clonetracker_umi columns; "
+        "runs QC for every row into <output>/<sample> and writes a combined <output>/qc_summary.tsv",
+    )
+    parser.add_argument("--workers", type=int, default=1, help="Samples processed in parallel with --samples-csv")
     parser.add_argument("--mode", default="clonetracker", choices=["clonetracker", "sgrna"])
     parser.add_argument("--min-genes", type=int, default=200)
     parser.add_argument("--max-genes", type=int, default=8000)
@@ -78,14 +119,53 @@ def build_parser() -> argparse.ArgumentParser:
     parser.add_argument("--max-mt-pct", type=float, default=15)
     parser.add_argument("--clonetracker-summary")
     parser.add_argument("--clonetracker-umi")
+    parser.add_argument("--figure-dpi", type=int, default=150, help="Resolution of the PNG figures")
+    parser.add_argument(
+        "--figures",
+        nargs="+",
+        choices=FIGURES,
+        default=list(FIGURES),
+        help="Figures to render (default: all)",
+    )
+    parser.add_argument("--figure-workers", type=int, default=1, help="Processes used to render figures")
+    parser.add_argument(
+        "--link-images",
+        action="store_true",
+        help="Reference the PNGs from the HTML report instead of embedding them as base64",
+    )
+    parser.add_argument(
+        "--low-memory",
+        action="store_true",
+        help="Compute metrics from the sparse matrix in row chunks and filter it in place, "
+        "instead of a second full copy (omits the pct_counts_in_top_N_genes columns)",
+    )
+    sweep = parser.add_argument_group(
+        "threshold sweep",
+        "Report cells_final and clone statistics for every combination of the listed thresholds "
+        "from the cached per-cell metrics, instead of running QC. Thresholds not listed keep their single value.",
+    )
+    sweep.add_argument("--sweep-min-genes", type=int, nargs="+")
+    sweep.add_argument("--sweep-max-genes", type=int, nargs="+")
+    sweep.add_argument("--sweep-min-counts", type=int, nargs="+")
+    sweep.add_argument("--sweep-max-mt-pct", type=float, nargs="+")
     return parser
 
 
-def find_filtered_matrix_dir(input_dir: Path) -> Path:
+def find_filtered_matrix(input_dir: Path) -> Path:
+    """
+    Locate the filtered matrix, preferring CellRanger's HDF5 file over the
+    Matrix Market directory. The standard `outs` layout is checked directly;
+    the tree is only searched when neither is where CellRanger puts it.
+    """
     input_dir = Path(input_dir)
-    if input_dir.name == "filtered_feature_bc_matrix":
+    if input_dir.name in ("filtered_feature_bc_matrix", "filtered_feature_bc_matrix.h5"):
         return input_dir
 
+    for outs in (input_dir, input_dir / "outs"):
+        for name in ("filtered_feature_bc_matrix.h5", "filtered_feature_bc_matrix"):
+            if (outs / name).exists():
+                return outs / name
+
     matches = list(input_dir.rglob("filtered_feature_bc_matrix"))
     if not matches:
         raise FileNotFoundError("filtered_feature_bc_matrix not found")
@@ -94,6 +174,14 @@ def find_filtered_matrix_dir(input_dir: Path) -> Path:
     return matches[0]
 
 
+def read_filtered_matrix(matrix_path: Path):
+    if matrix_path.suffix == ".h5":
+        adata = sc.read_10x_h5(matrix_path)
+        adata.var_names_make_unique()
+        return adata
+    return sc.read_10x_mtx(matrix_path, var_names="gene_symbols", make_unique=True)
+
+
 def require_existing_file(path: Union[str, Path], description: str) -> Path:
     """Normalize and validate a required file path."""
     resolved = Path(path)
@@ -102,6 +190,140 @@ def require_existing_file(path: Union[str, Path], description: str) -> Path:
     return resolved
 
 
+def matrix_fingerprint(matrix_path: Path) -> str:
+    """Size and mtime of the matrix file(s), hashed; changes whenever CellRanger rewrites them."""
+    files = [matrix_path] if matrix_path.is_file() else sorted(path for path in matrix_path.iterdir() if path.is_file())
+    payload = {str(path.resolve()): file_stat(path) for path in files}
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+
+def load_cached_metrics(cache_path: Path, fingerprint: str) -> Optional[dict]:
+    """Return the cached per-cell and per-gene metrics if they belong to this matrix."""
+    if not cache_path.exists():
+        return None
+    cached = pd.read_pickle(cache_path)
+    if cached.get("fingerprint") != fingerprint:
+        return None
+    return cached
+
+
+def compute_qc_metrics(adata, cache_path: Path, fingerprint: str, low_memory: bool = False) -> None:
+    """Add QC metrics to adata, reusing the cache written by an earlier run on the same matrix."""
+    method = "chunked" if low_memory else "scanpy"
+    add_qc_gene_flags(adata)
+    cached = load_cached_metrics(cache_path, fingerprint)
+    if (
+        cached is not None
+        and cached.get("method", "scanpy") == method
+        and cached["obs"].index.equals(adata.obs_names)
+    ):
+        adata.obs = cached["obs"]
+        adata.var = cached["var"]
+        return
+
+    if low_memory:
+        chunked_qc_metrics(adata)
+    else:
+        sc.pp.calculate_qc_metrics(adata, qc_vars=list(QC_VARS), inplace=True)
+    pd.to_pickle({"fingerprint": fingerprint, "method": method, "obs": adata.obs, "var": adata.var}, cache_path)
+
+
+def chunked_qc_metrics(adata, chunk_rows: int = QC_CHUNK_ROWS) -> None:
+    """
+    The per-cell and per-gene columns of sc.pp.calculate_qc_metrics, except the
+    top-N gene percentages, accumulated over row chunks of the CSR matrix so
+    no dense or full-size temporary is allocated.
+    """
+    if not sparse.isspmatrix_csr(adata.X):
+        adata.X = sparse.csr_matrix(adata.X)
+    matrix = adata.X
+    n_obs, n_vars = matrix.shape
+    weights = {qc_var: adata.var[qc_var].to_numpy(dtype=matrix.dtype) for qc_var in QC_VARS}
+
+    n_genes = np.zeros(n_obs, dtype=np.int32)
+    totals = np.zeros(n_obs, dtype=matrix.dtype)
+    var_totals = {qc_var: np.zeros(n_obs, dtype=matrix.dtype) for qc_var in QC_VARS}
+    cells_by_gene = np.zeros(n_vars, dtype=np.int64)
+    counts_by_gene = np.zeros(n_vars, dtype=np.float64)
+    for start in range(0, n_obs, chunk_rows):
+        chunk = matrix[start:start + chunk_rows]
+        chunk.eliminate_zeros()
+        stop = start + chunk.shape[0]
+        n_genes[start:stop] = np.diff(chunk.indptr)
+        totals[start:stop] = np.asarray(chunk.sum(axis=1)).ravel()
+        for qc_var, weight in weights.items():
+            var_totals[qc_var][start:stop] = chunk @ weight
+        cells_by_gene += np.bincount(chunk.indices, minlength=n_vars)
+        counts_by_gene += np.bincount(chunk.indices, weights=chunk.data, minlength=n_vars)
+
+    obs = adata.obs
+    obs["n_genes_by_counts"] = n_genes
+    obs["log1p_n_genes_by_counts"] = np.log1p(n_genes)
+    obs["total_counts"] = totals
+    obs["log1p_total_counts"] = np.log1p(totals)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for qc_var in QC_VARS:
+            obs[f"total_counts_{qc_var}"] = var_totals[qc_var]
+            obs[f"log1p_total_counts_{qc_var}"] = np.log1p(var_totals[qc_var])
+            obs[f"pct_counts_{qc_var}"] = var_totals[qc_var] / totals * 100
+
+    var = adata.var
+    var["n_cells_by_counts"] = cells_by_gene
+    var["mean_counts"] = (counts_by_gene / n_obs).astype(matrix.dtype)
+    var["log1p_mean_counts"] = np.log1p(var["mean_counts"])
+    var["pct_dropout_by_counts"] = (1 - cells_by_gene / n_obs) * 100
+    var["total_counts"] = counts_by_gene.astype(matrix.dtype)
+    var["log1p_total_counts"] = np.log1p(var["total_counts"])
+
+
+def subset_cells_inplace(adata, keep):
+    """
+    Keep the rows of a CSR-backed AnnData where `keep` is true by compacting the
+    matrix arrays in place, so the full and the filtered matrix never coexist.
+    `adata` must not be used afterwards.
+    """
+    keep = np.asarray(keep, dtype=bool)
+    matrix = adata.X
+    if not sparse.isspmatrix_csr(matrix):
+        matrix = sparse.csr_matrix(matrix)
+    indptr, indices, data = matrix.indptr, matrix.indices, matrix.data
+    lengths = np.diff(indptr)[keep]
+
+    written = 0
+    for start in range(0, len(keep), QC_CHUNK_ROWS):
+        stop = min(start + QC_CHUNK_ROWS, len(keep))
+        entries = np.repeat(keep[start:stop], np.diff(indptr[start:stop + 1]))
+        kept_data = data[indptr[start]:indptr[stop]][entries]
+        kept_indices = indices[indptr[start]:indptr[stop]][entries]
+        # Kept entries only move towards the front, behind the chunk being read.
+        data[written:written + len(kept_data)] = kept_data
+        indices[written:written + len(kept_indices)] = kept_indices
+        written += len(kept_data)
+
+    for array in (data, indices):
+        try:
+            array.resize(written, refcheck=False)
+        except ValueError:
+            pass  # Not owned by this array; the slices below still avoid a copy.
+    new_indptr = np.zeros(len(lengths) + 1, dtype=indptr.dtype)
+    np.cumsum(lengths, out=new_indptr[1:])
+    filtered = sparse.csr_matrix(
+        (data[:written], indices[:written], new_indptr),
+        shape=(int(keep.sum()), matrix.shape[1]),
+        copy=False,
+    )
+    return sc.AnnData(X=filtered, obs=adata.obs.loc[keep].copy(), var=adata.var.copy())
+
+
+def qc_keep_mask(obs, min_genes: int, max_genes: int, min_counts: int, max_mt_pct: float):
+    return (
+        (obs["n_genes_by_counts"] >= min_genes)
+        & (obs["n_genes_by_counts"] <= max_genes)
+        & (obs["total_counts"] >= min_counts)
+        & (obs["pct_counts_mt"] <= max_mt_pct)
+    )
+
+
 def add_qc_gene_flags(adata) -> None:
     genes = adata.var_names
     adata.var["mt"] = genes.str.startswith(("MT-", "mt-"))
@@ -109,33 +331,93 @@ def add_qc_gene_flags(adata) -> None:
     adata.var["hb"] = genes.str.match(r"^HB[ABDEGMQZ]")
 
 
-def plot_qc_violin(adata, outdir: Path, sample: str) -> None:
+class FigureRenderer:
+    """
+    Figures queued while QC runs and rendered together at the end, in worker
+    processes when workers > 1. Only the small table behind each figure is
+    sent to a worker, never the matrix.
+    """
+
+    def __init__(self, dpi: int = 150, include=FIGURES, workers: int = 1):
+        self.dpi = dpi
+        self.include = set(include)
+        self.workers = workers
+        self.jobs = []
+
+    def add(self, name: str, render, data, path: Path) -> None:
+        if name in self.include:
+            self.jobs.append((render, data, path))
+
+    def render(self) -> None:
+        if self.workers <= 1 or len(self.jobs) <= 1:
+            for render, data, path in self.jobs:
+                render(data, path, self.dpi)
+        else:
+            with spawn_pool(min(self.workers, len(self.jobs))) as pool:
+                futures = [pool.submit(render, data, path, self.dpi) for render, data, path in self.jobs]
+            for future in futures:
+                future.result()
+        self.jobs = []
+
+
+def spawn_pool(workers: int) -> ProcessPoolExecutor:
+    """
+    Worker pool that starts fresh interpreters. Forked workers inherit the
+    threads scanpy and numba have started, and can hang at interpreter exit.
+    """
+    return ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=load_dependencies,
+    )
+
+
+def render_qc_violin(metrics, path: Path, dpi: int) -> None:
     sc.pl.violin(
-        adata,
-        ["n_genes_by_counts", "total_counts", "pct_counts_mt"],
+        sc.AnnData(obs=metrics),
+        list(metrics.columns),
         multi_panel=True,
         show=False,
     )
     plt.tight_layout()
-    plt.savefig(outdir / f"{sample}.qc_violin.png", dpi=150)
+    plt.savefig(path, dpi=dpi)
     plt.close()
 
 
-def plot_clonetracker_types(adata, outdir: Path, sample: str, mode: str = "clonetracker") -> None:
-    counts = adata.obs["clonetracker_barcode_type"].value_counts()
+def render_type_counts(counts, path: Path, dpi: int) -> None:
     plt.figure(figsize=(10, 6))
     counts.plot(kind="bar", color=CELLECTA_GREEN, edgecolor="black")
     plt.ylabel("Cells")
     plt.xticks(rotation=30, ha="right")
     plt.grid(axis="y", color=CELLECTA_GRID)
     plt.tight_layout()
-    
-    suffix = "sgrna_type_barplot.png" if mode == "sgrna" else "clonetracker_barcode_type_barplot.png"
-    plt.savefig(outdir / f"{sample}.{suffix}", dpi=150)
+    plt.savefig(path, dpi=dpi)
     plt.close()
 
 
-def plot_clone_size_distribution(adata, outdir: Path, sample: str, mode: str = "clonetracker"):
+def render_clone_sizes(top50, path: Path, dpi: int) -> None:
+    plt.figure(figsize=(12, 5))
+    top50.plot(kind="bar", color=CELLECTA_GREEN)
+    plt.ylabel("Cells")
+    plt.grid(axis="y", color=CELLECTA_GRID)
+    plt.tight_layout()
+    plt.savefig(path, dpi=dpi)
+    plt.close()
+
+
+def plot_qc_violin(adata, outdir: Path, sample: str, figures: FigureRenderer) -> None:
+    metrics = adata.obs[["n_genes_by_counts", "total_counts", "pct_counts_mt"]].copy()
+    figures.add("violin", render_qc_violin, metrics, outdir / f"{sample}.qc_violin.png")
+
+
+def plot_clonetracker_types(adata, outdir: Path, sample: str, figures: FigureRenderer, mode: str = "clonetracker") -> None:
+    # Counted as plain strings so unused categories are not drawn as empty bars.
+    counts = adata.obs["clonetracker_barcode_type"].astype(object).value_counts()
+    suffix = "sgrna_type_barplot.png" if mode == "sgrna" else "clonetracker_barcode_type_barplot.png"
+    figures.add("types", render_type_counts, counts, outdir / f"{sample}.{suffix}")
+
+
+def plot_clone_size_distribution(adata, outdir: Path, sample: str, figures: FigureRenderer, mode: str = "clonetracker"):
     total_cells = adata.n_obs
     if mode == "sgrna":
         mask = adata.obs["clonetracker_barcode_type"].isin(
@@ -145,7 +427,7 @@ def plot_clone_size_distribution(adata, outdir: Path, sample: str, mode: str = "
         mask = adata.obs["clonetracker_barcode_type"].isin(
             ["One Barcode", "One Barcode with mutant"]
         )
-    assigned = adata.obs.loc[mask, "clonetracker_final_barcode"].dropna()
+    assigned = adata.obs.loc[mask, "clonetracker_final_barcode"].dropna().astype(object)
     clone_sizes = assigned.value_counts()
     top50 = clone_sizes.head(50)
 
@@ -158,56 +440,66 @@ def plot_clone_size_distribution(adata, outdir: Path, sample: str, mode: str = "
     plot_suffix = "sgrna_size_top50.png" if mode == "sgrna" else "clone_size_top50.png"
     
     table.to_csv(outdir / f"{sample}.{table_suffix}", sep="\t", index=False)
-
-    plt.figure(figsize=(12, 5))
-    top50.plot(kind="bar", color=CELLECTA_GREEN)
-    plt.ylabel("Cells")
-    plt.grid(axis="y", color=CELLECTA_GRID)
-    plt.tight_layout()
-    plt.savefig(outdir / f"{sample}.{plot_suffix}", dpi=150)
-    plt.close()
+    figures.add("clone_sizes", render_clone_sizes, top50, outdir / f"{sample}.{plot_suffix}")
 
     return table
 
 
 def add_clonetracker(adata, summary_file: Path, mode: str = "clonetracker"):
-    adata.obs["cell_nosuffix"] = adata.obs_names.str.replace(r"-\d+$", "", regex=True)
+    add_clonetracker_obs(adata.obs, summary_file, mode=mode)
+    return adata
+
+
+def add_clonetracker_obs(obs, summary_file: Path, mode: str = "clonetracker"):
+    """
+    Add the clonetracker_* assignment columns to a per-cell table indexed by
+    cell barcode. The summary is looked up once by integer position, and the
+    barcode and type columns stay categorical, which keeps obs and the h5ad
+    small for large samples.
+    """
+    names = obs.index.to_numpy(dtype=str)
+    # Strip the CellRanger GEM-group suffix ("-1") where there is one.
+    head, sep, tail = np.char.rpartition(names, "-").reshape(-1, 3).T
+    has_suffix = (sep == "-") & np.char.isdigit(tail)
+    obs["cell_nosuffix"] = np.where(has_suffix, head, names).astype(object)
 
     if mode == "sgrna":
-        rename_map = {
-            "final_assigned_sgrna": "clonetracker_final_barcode",
-            "umi_count": "clonetracker_umi_count",
-            "sgrna_type": "clonetracker_barcode_type",
-        }
+        barcode_col, type_col = "final_assigned_sgrna", "sgrna_type"
     else:
-        rename_map = {
-            "final_assigned_barcode": "clonetracker_final_barcode",
-            "umi_count": "clonetracker_umi_count",
-            "barcode_type": "clonetracker_barcode_type",
-        }
-
-    summary = pd.read_csv(summary_file, sep="\t").rename(columns=rename_map)
-    summary = summary.set_index("cell")
+        barcode_col, type_col = "final_assigned_barcode", "barcode_type"
 
-    adata.obs["clonetracker_final_barcode"] = adata.obs["cell_nosuffix"].map(
-        summary["clonetracker_final_barcode"]
-    )
-    adata.obs["clonetracker_umi_count"] = adata.obs["cell_nosuffix"].map(
-        summary["clonetracker_umi_count"]
-    )
-    adata.obs["clonetracker_barcode_type"] = adata.obs["cell_nosuffix"].map(
-        summary["clonetracker_barcode_type"]
+    summary = pd.read_csv(
+        summary_file,
+        sep="\t",
+        usecols=["cell", barcode_col, "umi_count", type_col],
+        dtype={"cell": str, barcode_col: "category", "umi_count": "float64", type_col: "category"},
     )
 
-    missing = adata.obs["clonetracker_barcode_type"].isna()
-    adata.obs.loc[missing, "clonetracker_barcode_type"] = (
-        "Undetermined due to low UMI"
+    # Cells missing from the summary get -1, which picks the trailing "missing" entry below.
+    rows = pd.Index(summary["cell"]).get_indexer(obs["cell_nosuffix"])
+
+    barcodes = summary[barcode_col].cat
+    obs["clonetracker_final_barcode"] = pd.Categorical.from_codes(
+        np.append(barcodes.codes.to_numpy(), -1)[rows],
+        categories=barcodes.categories,
     )
-    return adata
 
+    umi_counts = np.append(summary["umi_count"].to_numpy(), np.nan)[rows]
+    if not np.isnan(umi_counts).any():
+        umi_counts = umi_counts.astype("int64")
+    obs["clonetracker_umi_count"] = umi_counts
 
-def compute_clone_stats(adata, mode: str = "clonetracker") -> dict:
-    obs = adata.obs
+    types = summary[type_col].cat
+    categories = types.categories
+    if UNDETERMINED_TYPE not in categories:
+        categories = categories.append(pd.Index([UNDETERMINED_TYPE]))
+    type_codes = np.append(types.codes.to_numpy(), -1)[rows]
+    type_codes[type_codes < 0] = categories.get_loc(UNDETERMINED_TYPE)
+    obs["clonetracker_barcode_type"] = pd.Categorical.from_codes(type_codes, categories=categories)
+    return obs
+
+
+def compute_clone_stats(obs, mode: str = "clonetracker") -> dict:
     total_cells = len(obs)
     type_counts = obs["clonetracker_barcode_type"].value_counts()
 
@@ -254,15 +546,24 @@ def embed_png(path: Path) -> str:
     return f'<img src="data:image/png;base64,{data}" width="700">'
 
 
+def figure_html(name: str, path: Path, args) -> str:
+    """The report's <img> for a figure: embedded, linked by relative path, or empty if not rendered."""
+    if name not in args.figures or not path.exists():
+        return ""
+    if args.link_images:
+        return f'<img src="{path.name}" width="700">'
+    return embed_png(path)
+
+
 def write_html(sample: str, outdir: Path, summary: dict, clone_table, args) -> None:
     mode = args.mode
-    violin = embed_png(outdir / f"{sample}.qc_violin.png")
+    violin = figure_html("violin", outdir / f"{sample}.qc_violin.png", args)
     
     typebar_suffix = "sgrna_type_barplot.png" if mode == "sgrna" else "clonetracker_barcode_type_barplot.png"
     clones_suffix = "sgrna_size_top50.png" if mode == "sgrna" else "clone_size_top50.png"
     
-    typebar = embed_png(outdir / f"{sample}.{typebar_suffix}")
-    clones = embed_png(outdir / f"{sample}.{clones_suffix}")
+    typebar = figure_html("types", outdir / f"{sample}.{typebar_suffix}", args)
+    clones = figure_html("clone_sizes", outdir / f"{sample}.{clones_suffix}", args)
 
     feature_name = "sgRNA" if mode == "sgrna" else "CloneTracker Barcode"
     report_title = f"Cellecta {feature_name} Assignment and QC Report"
@@ -506,6 +807,7 @@ qc_summary.tsv
 QC metrics
 ----------
 {sample}.cell_qc_metrics.tsv
+{sample}.qc_metrics_cache.pkl: cached metrics reused by reruns and --sweep-* threshold sweeps
 
 Filtered dataset
 ----------------
@@ -529,40 +831,140 @@ QC figures
     (outdir / "README.txt").write_text(text)
 
 
-def main() -> None:
-    args = build_parser().parse_args()
+def threshold_sweep(obs, args):
+    """cells_final and clone statistics for every combination of the sweep thresholds."""
+    grid = itertools.product(
+        args.sweep_min_genes or [args.min_genes],
+        args.sweep_max_genes or [args.max_genes],
+        args.sweep_min_counts or [args.min_counts],
+        args.sweep_max_mt_pct or [args.max_mt_pct],
+    )
+    rows = []
+    for min_genes, max_genes, min_counts, max_mt_pct in grid:
+        kept = obs[qc_keep_mask(obs, min_genes, max_genes, min_counts, max_mt_pct)]
+        row = {
+            "min_genes": min_genes,
+            "max_genes": max_genes,
+            "min_counts": min_counts,
+            "max_mt_pct": max_mt_pct,
+            "cells_total": len(obs),
+            "cells_final": len(kept),
+        }
+        if "clonetracker_barcode_type" in kept:
+            row.update(compute_clone_stats(kept, mode=args.mode))
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+def read_qc_samples_csv(path: Path) -> List[dict]:
+    if not path.exists():
+        raise FileNotFoundError(f"QC samples CSV not found: {path}")
+    with path.open("r", newline="") as handle:
+        rows = list(csv.DictReader(handle))
+    if not rows:
+        raise ValueError(f"{path} does not contain any sample rows")
+    for index, row in enumerate(rows, start=1):
+        for column in ("sample", "input"):
+            if not (row.get(column) or "").strip():
+                raise ValueError(f"{path} row {index} has empty value for '{column}'")
+    return rows
+
+
+def sample_args(args: argparse.Namespace, row: dict) -> argparse.Namespace:
+    """Per-sample arguments for one sample-sheet row; thresholds are shared."""
+    sample = row["sample"].strip()
+    return argparse.Namespace(**dict(
+        vars(args),
+        input=row["input"].strip(),
+        output=str(Path(args.output) / sample),
+        sample_name=sample,
+        clonetracker_summary=(row.get("clonetracker_summary") or "").strip() or None,
+        clonetracker_umi=(row.get("clonetracker_umi") or "").strip() or None,
+        samples_csv=None,
+    ))
+
+
+def run_samples(args: argparse.Namespace) -> None:
+    """QC every sample in --samples-csv, with the heavy imports paid once per worker."""
+    jobs = [sample_args(args, row) for row in read_qc_samples_csv(Path(args.samples_csv))]
+    summaries = {}
+    failed = []
+    with spawn_pool(max(1, args.workers)) as pool:
+        futures = {pool.submit(run_qc, job): job.sample_name for job in jobs}
+        for future, sample in futures.items():
+            try:
+                summaries[sample] = future.result()
+            except Exception as exc:
+                failed.append(sample)
+                print(f"[FAIL] {sample}: {exc!r}", flush=True)
+
+    combined = [summaries[job.sample_name] for job in jobs if summaries.get(job.sample_name)]
+    if combined:
+        pd.DataFrame(combined).to_csv(Path(args.output) / "qc_summary.tsv", sep="\t", index=False)
+    if failed:
+        raise SystemExit(f"QC failed for {len(failed)} sample(s): {', '.join(failed)}")
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if bool(args.input) == bool(args.samples_csv):
+        parser.error("Provide exactly one of --input or --samples-csv.")
+
+    load_dependencies()
+    if args.samples_csv:
+        Path(args.output).mkdir(parents=True, exist_ok=True)
+        run_samples(args)
+    else:
+        run_qc(args)
 
-    if IMPORT_ERROR is not None:
-        raise ModuleNotFoundError(
-            "Required dependencies for run_scrnaseq_qc.py are not installed. "
-            "Install matplotlib, numpy, pandas, and scanpy to run QC."
-        ) from IMPORT_ERROR
 
+def run_qc(args: argparse.Namespace) -> Optional[dict]:
+    """QC one sample and return its summary row (None for a threshold sweep)."""
     input_dir = Path(args.input)
     output_dir = Path(args.output)
     output_dir.mkdir(parents=True, exist_ok=True)
 
-    matrix_dir = find_filtered_matrix_dir(input_dir)
-    sample = args.sample_name if args.sample_name else matrix_dir.parent.name
+    matrix_path = find_filtered_matrix(input_dir)
+    sample = args.sample_name if args.sample_name else matrix_path.parent.name
 
     print("Processing:", sample)
 
-    adata = sc.read_10x_mtx(matrix_dir, var_names="gene_symbols", make_unique=True)
+    # Per-cell metrics depend only on the matrix, so they are cached for reruns
+    # and sweeps with other thresholds.
+    cache_path = output_dir / f"{sample}.qc_metrics_cache.pkl"
+    fingerprint = matrix_fingerprint(matrix_path)
+
+    if any([args.sweep_min_genes, args.sweep_max_genes, args.sweep_min_counts, args.sweep_max_mt_pct]):
+        cached = load_cached_metrics(cache_path, fingerprint)
+        if cached is None:
+            adata = read_filtered_matrix(matrix_path)
+            compute_qc_metrics(adata, cache_path, fingerprint)
+            obs = adata.obs
+        else:
+            obs = cached["obs"].copy()
+        if args.clonetracker_summary:
+            summary_file = require_existing_file(args.clonetracker_summary, "CloneTracker summary")
+            add_clonetracker_obs(obs, summary_file, mode=args.mode)
+        table = threshold_sweep(obs, args)
+        table.to_csv(output_dir / f"{sample}.qc_sweep.tsv", sep="\t", index=False)
+        print(table.to_string(index=False))
+        return None
+
+    adata = read_filtered_matrix(matrix_path)
     cells_total_raw = adata.n_obs
 
-    add_qc_gene_flags(adata)
-    sc.pp.calculate_qc_metrics(adata, qc_vars=["mt", "ribo", "hb"], inplace=True)
+    compute_qc_metrics(adata, cache_path, fingerprint, low_memory=args.low_memory)
 
+    figures = FigureRenderer(args.figure_dpi, args.figures, args.figure_workers)
     adata.obs.to_csv(output_dir / f"{sample}.cell_qc_metrics.tsv", sep="\t")
-    plot_qc_violin(adata, output_dir, sample)
+    plot_qc_violin(adata, output_dir, sample, figures)
 
-    keep = (
-        (adata.obs["n_genes_by_counts"] >= args.min_genes)
-        & (adata.obs["n_genes_by_counts"] <= args.max_genes)
-        & (adata.obs["total_counts"] >= args.min_counts)
-        & (adata.obs["pct_counts_mt"] <= args.max_mt_pct)
-    )
-    adata = adata[keep].copy()
+    keep = qc_keep_mask(adata.obs, args.min_genes, args.max_genes, args.min_counts, args.max_mt_pct)
+    if args.low_memory:
+        adata = subset_cells_inplace(adata, keep.to_numpy())
+    else:
+        adata = adata[keep].copy()
 
     clone_table = None
     if bool(args.clonetracker_summary) != bool(args.clonetracker_umi):
@@ -591,8 +993,8 @@ def main() -> None:
             [column for column in adata.obs.columns if column.startswith("clonetracker_")]
         ].to_csv(output_dir / f"{sample}.{obs_suffix}", sep="\t")
         
-        plot_clonetracker_types(adata, output_dir, sample, mode=args.mode)
-        clone_table = plot_clone_size_distribution(adata, output_dir, sample, mode=args.mode)
+        plot_clonetracker_types(adata, output_dir, sample, figures, mode=args.mode)
+        clone_table = plot_clone_size_distribution(adata, output_dir, sample, figures, mode=args.mode)
 
     adata.write(output_dir / f"{sample}.filtered.h5ad")
 
@@ -605,15 +1007,17 @@ def main() -> None:
         "median_pct_mt": float(np.median(adata.obs["pct_counts_mt"])),
     }
     if "clonetracker_barcode_type" in adata.obs:
-        summary.update(compute_clone_stats(adata, mode=args.mode))
+        summary.update(compute_clone_stats(adata.obs, mode=args.mode))
 
     pd.DataFrame([summary]).to_csv(output_dir / "qc_summary.tsv", sep="\t", index=False)
 
+    figures.render()
     if clone_table is not None:
         write_html(sample, output_dir, summary, clone_table, args)
 
     write_readme(output_dir, sample, mode=args.mode)
     print("QC finished")
+    return summary
 
 
 if __name__ == "__main__":
@@ -0,0 +1,187 @@
+"""Per-sample stage manifest that decides which pipeline stages must rerun."""
+
+import hashlib
+import json
+import os
+from datetime import datetime
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, Iterable, List, Mapping, Optional, Sequence, Union
+
+
+MANIFEST_VERSION = 1
+HASH_CHUNK_SIZE = 1 << 20
+
+PathLike = Union[str, Path]
+
+
+def sha256_file(path: PathLike) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as handle:
+        for chunk in iter(lambda: handle.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+@lru_cache(maxsize=None)
+def tool_version(path: str) -> str:
+    """Identify a helper script by the hash of its source."""
+    return sha256_file(path)[:16]
+
+
+def file_stat(path: PathLike) -> Dict[str, int]:
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+class StagePlan:
+    """Outcome of checking one stage against the manifest."""
+
+    def __init__(
+        self,
+        manifest: "StageManifest",
+        name: str,
+        fingerprint: str,
+        outputs: List[Path],
+        reason: Optional[str],
+        ephemeral: bool = False,
+    ):
+        self.manifest = manifest
+        self.name = name
+        self.fingerprint = fingerprint
+        self.outputs = outputs
+        self.reason = reason
+        self.ephemeral = ephemeral
+
+    @property
+    def up_to_date(self) -> bool:
+        return self.reason is None
+
+    @property
+    def released(self) -> bool:
+        """True when the stage is current apart from ephemeral outputs deleted after use."""
+        return self.reason is not None and self.manifest.released(self.name, self.fingerprint, self.outputs)
+
+    def commit(self) -> None:
+        """Record the stage as complete once all of its outputs are written."""
+        self.manifest.record(self.name, self.fingerprint, self.outputs, ephemeral=self.ephemeral)
+
+
+class StageManifest:
+    """
+    JSON record of each stage's fingerprint and output signatures.
+
+    A fingerprint covers the size and mtime (or content hash) of every input,
+    the version of the helper scripts and the stage parameters. A stage reruns
+    when its fingerprint changes or when an output is missing or differs from
+    what was recorded, so a crash mid-write or a parameter tweak only reruns
+    the affected stage and the stages downstream of it.
+
+    Outputs of ephemeral stages (scratch intermediates) may be deleted after a
+    run. Their recorded signature stands in for them as inputs, so downstream
+    stages stay current without regenerating the intermediates.
+    """
+
+    def __init__(self, path: PathLike, hash_inputs: bool = False):
+        self.path = Path(path)
+        self.hash_inputs = hash_inputs
+        self.data = {"version": MANIFEST_VERSION, "stages": {}, "hashes": {}, "ephemeral": {}}
+        if self.path.exists():
+            try:
+                loaded = json.loads(self.path.read_text())
+            except ValueError:
+                loaded = {}
+            if loaded.get("version") == MANIFEST_VERSION:
+                self.data = loaded
+                self.data.setdefault("hashes", {})
+                self.data.setdefault("ephemeral", {})
+
+    def input_signature(self, path: PathLike) -> Dict[str, Union[int, str, bool]]:
+        if not os.path.exists(path):
+            # A deleted intermediate keeps the signature it had when it was written.
+            return self.data["ephemeral"].get(str(path), {"missing": True})
+        stat = file_stat(path)
+        if not self.hash_inputs:
+            return stat
+
+        # Hashes are cached by size and mtime so unchanged inputs are read once.
+        cached = self.data["hashes"].get(str(path))
+        if cached and cached["size"] == stat["size"] and cached["mtime_ns"] == stat["mtime_ns"]:
+            content = cached["sha256"]
+        else:
+            content = sha256_file(path)
+            self.data["hashes"][str(path)] = dict(stat, sha256=content)
+        return {"size": stat["size"], "sha256": content}
+
+    def fingerprint(
+        self,
+        inputs: Iterable[PathLike],
+        params: Optional[Mapping[str, object]] = None,
+        tools: Iterable[PathLike] = (),
+    ) -> str:
+        payload = {
+            "inputs": {str(path): self.input_signature(path) for path in inputs},
+            "params": dict(params or {}),
+            "tools": {str(path): tool_version(str(path)) for path in tools},
+        }
+        encoded = json.dumps(payload, sort_keys=True, default=str).encode()
+        return hashlib.sha256(encoded).hexdigest()
+
+    def stage(
+        self,
+        name: str,
+        *,
+        inputs: Iterable[PathLike],
+        outputs: Sequence[PathLike],
+        params: Optional[Mapping[str, object]] = None,
+        tools: Iterable[PathLike] = (),
+        force: bool = False,
+        ephemeral: bool = False,
+    ) -> StagePlan:
+        """Fingerprint a stage and report whether it has to run."""
+        fingerprint = self.fingerprint(inputs, params, tools)
+        outputs = [Path(path) for path in outputs]
+        reason = "forced" if force else self.stale_reason(name, fingerprint, outputs)
+        return StagePlan(self, name, fingerprint, outputs, reason, ephemeral)
+
+    def stale_reason(self, name: str, fingerprint: str, outputs: Sequence[Path]) -> Optional[str]:
+        record = self.data["stages"].get(name)
+        if record is None:
+            return "no completed run recorded"
+        if record["fingerprint"] != fingerprint:
+            return "inputs, parameters or helper version changed"
+        for path in outputs:
+            if not path.exists():
+                return f"output missing: {path}"
+            if record["outputs"].get(str(path)) != file_stat(path):
+                return f"output changed since it was recorded: {path}"
+        return None
+
+    def released(self, name: str, fingerprint: str, outputs: Sequence[Path]) -> bool:
+        record = self.data["stages"].get(name)
+        if record is None or record["fingerprint"] != fingerprint:
+            return False
+        for path in outputs:
+            if path.exists():
+                if record["outputs"].get(str(path)) != file_stat(path):
+                    return False
+            elif str(path) not in self.data["ephemeral"]:
+                return False
+        return True
+
+    def record(self, name: str, fingerprint: str, outputs: Sequence[Path], ephemeral: bool = False) -> None:
+        if ephemeral:
+            for path in outputs:
+                self.data["ephemeral"][str(path)] = self.input_signature(path)
+        self.data["stages"][name] = {
+            "fingerprint": fingerprint,
+            "outputs": {str(path): file_stat(path) for path in outputs},
+            "completed": datetime.now().isoformat(timespec="seconds"),
+        }
+        self.save()
+
+    def save(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        tmp_path.write_text(json.dumps(self.data, indent=2, sort_keys=True))
+        os.replace(tmp_path, self.path)
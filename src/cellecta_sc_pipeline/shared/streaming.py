@@ -0,0 +1,62 @@
+"""Run a producer and consumer stage connected through a named pipe."""
+
+import os
+import subprocess
+import time
+from pathlib import Path
+from typing import List, Optional
+
+
+POLL_INTERVAL = 0.2
+
+
+def run_through_fifo(
+    producer: List[str],
+    consumer: List[str],
+    fifo: Path,
+    *,
+    cwd: Optional[Path] = None,
+) -> None:
+    """
+    Run `consumer` reading from `fifo` while `producer` writes to it.
+
+    Both commands must refer to the FIFO path themselves. The consumer is
+    started first so the producer's open() does not block, and the FIFO is
+    removed afterwards whether or not either side failed.
+    """
+    fifo.unlink(missing_ok=True)
+    os.mkfifo(fifo)
+    cwd_arg = str(cwd) if cwd else None
+    try:
+        print("\n[CMD] " + " ".join(consumer) + f" < {fifo}", flush=True)
+        reader = subprocess.Popen(consumer, cwd=cwd_arg)
+        print("[CMD] " + " ".join(producer) + f" > {fifo}", flush=True)
+        writer = subprocess.Popen(producer, cwd=cwd_arg)
+        consumer_failed_first = False
+        try:
+            # Either side dying before it opens the FIFO leaves the other one
+            # blocked in open() forever, so a failure on one side kills both.
+            while writer.poll() is None:
+                if reader.poll() not in (None, 0):
+                    consumer_failed_first = True
+                    writer.kill()
+                    break
+                time.sleep(POLL_INTERVAL)
+            writer_code = writer.wait()
+            if writer_code != 0 and reader.poll() is None:
+                reader.kill()
+            reader_code = reader.wait()
+        except BaseException:
+            for process in (writer, reader):
+                process.kill()
+                process.wait()
+            raise
+
+        if consumer_failed_first:
+            raise subprocess.CalledProcessError(reader_code, consumer)
+        if writer_code != 0:
+            raise subprocess.CalledProcessError(writer_code, producer)
+        if reader_code != 0:
+            raise subprocess.CalledProcessError(reader_code, consumer)
+    finally:
+        fifo.unlink(missing_ok=True)
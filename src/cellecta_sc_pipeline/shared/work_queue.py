@@ -0,0 +1,202 @@
+"""Shared-filesystem sample queue for batch runners on several nodes."""
+
+import contextlib
+import os
+import socket
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Iterator, List, Optional, Sequence, Tuple
+
+from cellecta_sc_pipeline.shared.checkpoints import write_text_atomic
+from cellecta_sc_pipeline.shared.scheduler import stage_slot
+
+
+class LeaseLost(RuntimeError):
+    """Another worker reclaimed the sample this worker was processing."""
+
+
+class LeasedBudget:
+    """
+    Stage budget that stops a worker at its next stage once its lease is lost.
+
+    Batch runners reserve every stage through stage_slot(), so wrapping the
+    budget checks the lease without threading it through each stage.
+    """
+
+    def __init__(self, budget, sample: str, lost: threading.Event):
+        self.budget = budget
+        self.sample = sample
+        self.lost = lost
+
+    @contextlib.contextmanager
+    def reserve(self, stage: str) -> Iterator[None]:
+        if self.lost.is_set():
+            raise LeaseLost(f"{self.sample}: lease lost before stage {stage}")
+        with stage_slot(self.budget, stage):
+            yield
+
+
+class SampleQueue:
+    """
+    Samples claimed through `<sample>.lock` files in one shared directory.
+
+    A lock is created with O_EXCL, so exactly one worker wins each sample, and
+    its mtime is the lease: the owner touches it while it works. A lock that
+    has not been touched for `lease_seconds` belongs to a dead worker and is
+    reclaimed. Finished samples leave `<sample>.done` or `<sample>.failed`.
+    """
+
+    def __init__(self, directory: Path, lease_seconds: float = 600):
+        self.directory = Path(directory)
+        self.lease_seconds = lease_seconds
+        self.heartbeat_seconds = max(1.0, lease_seconds / 4)
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    @property
+    def worker_id(self) -> str:
+        # Read per call: pool workers claim samples from their own processes.
+        return f"{socket.gethostname()}:{os.getpid()}"
+
+    def path(self, sample: str, suffix: str) -> Path:
+        return self.directory / f"{sample}.{suffix}"
+
+    def finished(self, sample: str) -> bool:
+        return self.path(sample, "done").exists() or self.path(sample, "failed").exists()
+
+    def lock_age(self, lock: Path) -> Optional[float]:
+        try:
+            return time.time() - lock.stat().st_mtime
+        except FileNotFoundError:
+            return None
+
+    def claim(self, sample: str) -> bool:
+        """Take the sample unless it is finished or held by a live worker."""
+        if self.finished(sample):
+            return False
+        lock = self.path(sample, "lock")
+        for _ in range(2):
+            try:
+                fd = os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+            except FileExistsError:
+                age = self.lock_age(lock)
+                if age is not None and age > self.lease_seconds:
+                    print(f"[RECLAIM] {sample}: lease expired {age:.0f}s ago", flush=True)
+                    self.reclaim(lock)
+                    continue
+                return False
+            with os.fdopen(fd, "w") as handle:
+                handle.write(self.worker_id + "\n")
+            # The sample may have finished between the check above and the claim.
+            if self.finished(sample):
+                lock.unlink(missing_ok=True)
+                return False
+            return True
+        return False
+
+    def reclaim(self, lock: Path) -> None:
+        """Move an expired lock aside; only one of several reclaiming workers wins the rename."""
+        stale = lock.with_name(f"{lock.name}.stale-{self.worker_id.replace(':', '-')}")
+        try:
+            os.rename(lock, stale)
+        except FileNotFoundError:
+            return
+        if time.time() - stale.stat().st_mtime < self.lease_seconds:
+            # Another worker reclaimed and re-locked it before our rename; put it back.
+            with contextlib.suppress(FileExistsError):
+                os.link(stale, lock)
+        stale.unlink()
+
+    def owns(self, sample: str) -> bool:
+        try:
+            return self.path(sample, "lock").read_text().strip() == self.worker_id
+        except FileNotFoundError:
+            return False
+
+    @contextlib.contextmanager
+    def heartbeat(self, sample: str) -> Iterator[threading.Event]:
+        """
+        Keep the lease on a claimed sample fresh while the block runs, and
+        yield an event that is set if another worker takes the sample over.
+        """
+        lock = self.path(sample, "lock")
+        stop = threading.Event()
+        lost = threading.Event()
+
+        def beat() -> None:
+            while not stop.wait(self.heartbeat_seconds):
+                if not self.owns(sample):
+                    print(f"[WARN] {sample}: lease lost to another worker; stopping", flush=True)
+                    lost.set()
+                    return
+                os.utime(lock)
+
+        thread = threading.Thread(target=beat, name=f"heartbeat-{sample}", daemon=True)
+        thread.start()
+        try:
+            yield lost
+        finally:
+            stop.set()
+            thread.join()
+
+    def release(self, sample: str) -> None:
+        """Give a claimed sample back so another worker can take it straight away."""
+        if self.owns(sample):
+            self.path(sample, "lock").unlink(missing_ok=True)
+
+    def finish(self, sample: str, status: str, detail: str = "") -> None:
+        write_text_atomic(self.path(sample, status), f"{self.worker_id}\n{detail}")
+        self.release(sample)
+
+
+def run_claimed(queue: SampleQueue, worker: Callable, *params, budget=None) -> None:
+    """
+    Run `worker(*params)` for a sample (params[0]) only if this process claims
+    it. A worker whose lease is lost stops at its next stage and leaves the
+    sample, its markers and its lock to the worker that reclaimed it.
+    """
+    sample = params[0]
+    if not queue.claim(sample):
+        print(f"[QUEUE] {sample}: done or claimed by another worker", flush=True)
+        return
+    lost = threading.Event()
+    try:
+        with queue.heartbeat(sample) as lost:
+            worker(*params, budget=LeasedBudget(budget, sample, lost))
+    except Exception as exc:
+        if lost.is_set():
+            print(f"[QUEUE] {sample}: stopped after losing the lease ({exc})", flush=True)
+            return
+        queue.finish(sample, "failed", repr(exc))
+        raise
+    except BaseException:
+        # Interrupted rather than failed: leave the sample for the other workers.
+        queue.release(sample)
+        raise
+    if lost.is_set():
+        print(f"[QUEUE] {sample}: finished after losing the lease; leaving it to the new owner", flush=True)
+        return
+    queue.finish(sample, "done")
+
+
+def drain_queue(
+    queue: SampleQueue,
+    samples: Sequence[Tuple[str, tuple]],
+    run_pass: Callable[[List[Tuple[str, tuple]]], List[str]],
+    keep_going: bool,
+) -> List[str]:
+    """
+    Call run_pass() on the unfinished samples until every sample is done or
+    failed, and return the samples that failed on any worker. Between passes it
+    waits on samples other workers hold, reclaiming them if their lease expires.
+    """
+    failed: List[str] = []
+    while True:
+        todo = [item for item in samples if not queue.finished(item[0])]
+        if not todo:
+            return [sample for sample, _ in samples if queue.path(sample, "failed").exists()]
+        failed.extend(run_pass(todo))
+        if failed and not keep_going:
+            return failed
+        if any(not queue.finished(sample) for sample, _ in todo):
+            time.sleep(queue.heartbeat_seconds)
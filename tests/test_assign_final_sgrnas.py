@@ -0,0 +1,35 @@
+import numpy as np
+from scipy import sparse
+
+
+def guide_matrix(values):
+    """One-guide cells x guides matrix holding the given UMI counts."""
+    values = np.asarray(values, dtype=np.int64)
+    rows = np.arange(len(values))
+    return sparse.csr_matrix((values, (rows, np.zeros_like(rows))), shape=(len(values), 1))
+
+
+def test_bimodal_guide_uses_otsu_split(load_script):
+    script = load_script("assign_final_sgrnas")
+    script.load_sparse_modules()
+    rng = np.random.default_rng(0)
+    background = rng.integers(1, 4, size=200)
+    expressing = rng.integers(40, 61, size=50)
+    thresholds = script.per_guide_thresholds(guide_matrix(np.concatenate([background, expressing])), 3)
+    assert 3 < thresholds[0] <= 40
+
+
+def test_unimodal_guide_keeps_min_umi(load_script):
+    script = load_script("assign_final_sgrnas")
+    script.load_sparse_modules()
+    rng = np.random.default_rng(0)
+    values = np.round(np.exp(rng.normal(np.log(20), 0.5, size=300))).astype(np.int64)
+    thresholds = script.per_guide_thresholds(guide_matrix(np.maximum(values, 5)), 3)
+    assert thresholds[0] == 3
+
+
+def test_sparse_guide_keeps_min_umi(load_script):
+    script = load_script("assign_final_sgrnas")
+    script.load_sparse_modules()
+    thresholds = script.per_guide_thresholds(guide_matrix([1, 2, 50, 60]), 3)
+    assert thresholds[0] == 3
@@ -0,0 +1,27 @@
+import pytest
+
+REQUIRED_ARGS = {
+    "process_barcode_umis": ["--bc14_file", "b14", "--bc30_file", "b30"],
+    "process_sgrna_umis": ["--sgrna_file", "s"],
+}
+
+
+def parse(load_script, script_name, checkpoint_cells):
+    parser = load_script(script_name).build_parser()
+    return parser.parse_args(
+        ["--cell_umi", "c", "--whitelist", "w", "--output", "o", "--checkpoint_cells", checkpoint_cells]
+        + REQUIRED_ARGS[script_name]
+    )
+
+
+@pytest.mark.parametrize("script_name", sorted(REQUIRED_ARGS))
+@pytest.mark.parametrize("value", ["0", "-5"])
+def test_checkpoint_cells_below_one_is_rejected(load_script, script_name, value, capsys):
+    with pytest.raises(SystemExit):
+        parse(load_script, script_name, value)
+    assert "argument --checkpoint_cells: must be at least 1" in capsys.readouterr().err
+
+
+@pytest.mark.parametrize("script_name", sorted(REQUIRED_ARGS))
+def test_checkpoint_cells_accepts_positive(load_script, script_name):
+    assert parse(load_script, script_name, "1").checkpoint_cells == 1
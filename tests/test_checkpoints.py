@@ -0,0 +1,57 @@
+from cellecta_sc_pipeline.shared.checkpoints import write_hits_checkpointed
+
+HEADER = "cell\tumi\n"
+CELLS = ["c{0}".format(index) for index in range(5)]
+
+
+class HitSource:
+    """hits_for_cells callback that records which chunks it was asked for."""
+
+    def __init__(self, fail_on=None):
+        self.chunks = []
+        self.fail_on = fail_on
+
+    def __call__(self, cells):
+        self.chunks.append(list(cells))
+        if self.fail_on in cells:
+            raise RuntimeError("interrupted")
+        return [(cell, 1) for cell in cells]
+
+
+def expected_table():
+    return HEADER + "".join("{0}\t1\n".format(cell) for cell in CELLS)
+
+
+def test_rerun_resumes_completed_chunks(tmp_path):
+    output, checkpoint_dir = tmp_path / "hits.tsv", tmp_path / "checkpoints"
+    interrupted = HitSource(fail_on="c4")
+    try:
+        write_hits_checkpointed(str(output), HEADER, CELLS, interrupted, str(checkpoint_dir), 2, "fp1")
+    except RuntimeError:
+        pass
+    assert not output.exists()
+    assert (checkpoint_dir / "FINGERPRINT").read_text() == "fp1"
+    assert sorted(path.name for path in checkpoint_dir.iterdir()) == [
+        "FINGERPRINT", "part00000.tsv", "part00000.tsv.done", "part00001.tsv", "part00001.tsv.done",
+    ]
+
+    resumed = HitSource()
+    write_hits_checkpointed(str(output), HEADER, CELLS, resumed, str(checkpoint_dir), 2, "fp1")
+
+    assert resumed.chunks == [["c4"]]
+    assert output.read_text() == expected_table()
+    assert not checkpoint_dir.exists()
+
+
+def test_changed_fingerprint_starts_over(tmp_path):
+    output, checkpoint_dir = tmp_path / "hits.tsv", tmp_path / "checkpoints"
+    try:
+        write_hits_checkpointed(output, HEADER, CELLS, HitSource(fail_on="c4"), checkpoint_dir, 2, "fp1")
+    except RuntimeError:
+        pass
+
+    rerun = HitSource()
+    write_hits_checkpointed(output, HEADER, CELLS, rerun, checkpoint_dir, 2, "fp2")
+
+    assert rerun.chunks == [["c0", "c1"], ["c2", "c3"], ["c4"]]
+    assert output.read_text() == expected_table()
@@ -0,0 +1,104 @@
+import random
+
+import pytest
+
+
+def levenshtein(first, second):
+    """Full dynamic-programming edit distance, the reference for the banded version."""
+    previous = list(range(len(second) + 1))
+    for row, char in enumerate(first, 1):
+        current = [row]
+        for column, other in enumerate(second, 1):
+            current.append(min(previous[column] + 1, current[column - 1] + 1, previous[column - 1] + (char != other)))
+        previous = current
+    return previous[-1]
+
+
+def brute_force_nearest(reference, query, max_distance):
+    distances = {barcode_id: levenshtein(query, sequence) for barcode_id, sequence in reference.items()}
+    best = min(distances.values())
+    if best > max_distance:
+        return "", max_distance + 1
+    best_ids = [barcode_id for barcode_id, distance in distances.items() if distance == best]
+    return (best_ids[0], best) if len(best_ids) == 1 else ("", best)
+
+
+def mutate(rng, sequence, edits):
+    for _ in range(edits):
+        index = rng.randrange(len(sequence) + 1)
+        kind = rng.choice("sid") if sequence else "i"
+        if kind == "s" and index < len(sequence):
+            sequence = sequence[:index] + rng.choice("ACGT") + sequence[index + 1:]
+        elif kind == "d" and index < len(sequence):
+            sequence = sequence[:index] + sequence[index + 1:]
+        else:
+            sequence = sequence[:index] + rng.choice("ACGT") + sequence[index:]
+    return sequence
+
+
+def random_sequence(rng, length):
+    return "".join(rng.choice("ACGT") for _ in range(length))
+
+
+@pytest.mark.parametrize("max_distance", [0, 1, 2, 3])
+def test_bounded_edit_distance_matches_full_levenshtein(load_script, max_distance):
+    script = load_script("consolidate_clone_barcodes")
+    rng = random.Random(max_distance)
+    for _ in range(500):
+        first = random_sequence(rng, rng.randint(0, 12))
+        second = mutate(rng, first, rng.randint(0, 4)) if rng.random() < 0.7 else random_sequence(rng, rng.randint(0, 12))
+        expected = min(levenshtein(first, second), max_distance + 1)
+        assert script.bounded_edit_distance(first, second, max_distance) == expected, (first, second)
+
+
+@pytest.mark.parametrize("max_distance", [1, 2])
+def test_nearest_matches_brute_force(load_script, max_distance):
+    script = load_script("consolidate_clone_barcodes")
+    rng = random.Random(10 + max_distance)
+    reference = {"BC14-{0}".format(index): random_sequence(rng, 14) for index in range(40)}
+    index = script.DeletionNeighborhoodIndex(reference, max_distance)
+    sequences = list(reference.values())
+    for _ in range(150):
+        query = mutate(rng, rng.choice(sequences), rng.randint(0, max_distance + 1))
+        assert index.nearest(query) == brute_force_nearest(reference, query, max_distance), query
+
+
+def test_nearest_reports_ties_and_misses(load_script):
+    script = load_script("consolidate_clone_barcodes")
+    index = script.DeletionNeighborhoodIndex({"BC14-1": "AAAACCCC", "BC14-2": "AAAAGGGG", "BC14-3": "TTTTCCCC"}, 1)
+    assert index.nearest("AAAACCCC") == ("BC14-1", 0)
+    assert index.nearest("AAAACCCG") == ("BC14-1", 1)
+    # One substitution from BC14-1 and one from BC14-3.
+    assert index.nearest("ATAACCCC") == ("BC14-1", 1)
+    assert index.nearest("AAAATCCC") == ("BC14-1", 1)
+    tied = script.DeletionNeighborhoodIndex({"BC14-1": "AAAACCCC", "BC14-2": "AAAACCCG"}, 1)
+    assert tied.nearest("AAAACCCT") == ("", 1)
+    assert index.nearest("GGGGTTTT") == ("", 2)
+
+
+def test_consolidate_names(load_script):
+    script = load_script("consolidate_clone_barcodes")
+    bc14 = script.DeletionNeighborhoodIndex({"BC14-1": "AAAACCCCGGGGTT", "BC14-2": "AAAACCCCGGGGTA"}, 2)
+    bc30 = script.DeletionNeighborhoodIndex({"BC30-7": "ACGTACGTACGTACGTACGTACGTACGTAC"}, 2)
+    mutant = "One Barcode with mutant"
+    rows = [
+        # BC14 one substitution from BC14-1 only; BC30 one deletion from BC30-7.
+        {"final_assigned_barcode": "TTAACCCCGGGGTT_BC30-7", "barcode_type": mutant},
+        {"final_assigned_barcode": "BC14-1_ACGTACGTACGTACGTACGTACGTACGTA", "barcode_type": mutant},
+        # Equally close to BC14-1 and BC14-2.
+        {"final_assigned_barcode": "AAAACCCCGGGGTC_BC30-7", "barcode_type": mutant},
+        # Nothing within two edits.
+        {"final_assigned_barcode": "GGGGGGGGGGGGGG_BC30-7", "barcode_type": mutant},
+        {"final_assigned_barcode": "nounderscore", "barcode_type": mutant},
+        {"final_assigned_barcode": "BC14-2_BC30-7", "barcode_type": "One Barcode"},
+    ]
+
+    mapping = script.consolidate_names(rows, bc14, bc30)
+
+    assert mapping == {
+        "TTAACCCCGGGGTT_BC30-7": ("BC14-1_BC30-7", 2, 0),
+        "BC14-1_ACGTACGTACGTACGTACGTACGTACGTA": ("BC14-1_BC30-7", 0, 1),
+        "AAAACCCCGGGGTC_BC30-7": ("AAAACCCCGGGGTC_BC30-7", -1, 0),
+        "GGGGGGGGGGGGGG_BC30-7": ("GGGGGGGGGGGGGG_BC30-7", -1, 0),
+        "nounderscore": ("nounderscore", -1, -1),
+    }
@@ -0,0 +1,81 @@
+import subprocess
+import sys
+import time
+
+import pytest
+
+from cellecta_sc_pipeline.shared.executors import BatchScriptExecutor
+
+# Submits the job script in the background and prints its PID as the job id, like sbatch.
+SUBMIT_STUB = """#!/bin/bash
+bash "$1" > /dev/null 2>&1 &
+echo "Submitted batch job $!"
+"""
+# The job is gone once its process has exited (or is an unreaped zombie).
+STATUS_STUB = """#!/bin/bash
+[ -e /proc/$1 ] && ! grep -q '^State:.*Z' /proc/$1/status && echo "$1 R"
+"""
+
+
+@pytest.fixture
+def background_executor(tmp_path):
+    submit = tmp_path / "submit.sh"
+    submit.write_text(SUBMIT_STUB)
+    status = tmp_path / "status.sh"
+    status.write_text(STATUS_STUB)
+    return BatchScriptExecutor(
+        tmp_path / "jobs",
+        "slurm",
+        submit_cmd=f"bash {submit}",
+        poll_interval=0.1,
+        max_wait=60,
+        status_cmd=f"bash {status} {{job_id}}",
+    )
+
+
+def python_cmd(code):
+    return [sys.executable, "-c", code]
+
+
+def test_bash_submit_runs_job_and_reads_exit_code(tmp_path):
+    executor = BatchScriptExecutor(tmp_path, "slurm", submit_cmd="bash", poll_interval=0.1)
+    executor.run(python_cmd("pass"), name="ok")
+    assert executor.sentinel_path("ok").read_text().strip() == "0"
+    with pytest.raises(subprocess.CalledProcessError) as error:
+        executor.run(python_cmd("raise SystemExit(3)"), name="fails")
+    assert error.value.returncode == 3
+
+
+def test_background_job_success(background_executor):
+    background_executor.run(python_cmd("import time; time.sleep(0.5)"), name="ok")
+    assert background_executor.sentinel_path("ok").read_text().strip() == "0"
+
+
+def test_background_job_nonzero_exit(background_executor):
+    with pytest.raises(subprocess.CalledProcessError) as error:
+        background_executor.run(python_cmd("import time; time.sleep(0.5); raise SystemExit(2)"), name="fails")
+    assert error.value.returncode == 2
+
+
+def test_killed_job_fails_instead_of_hanging(background_executor):
+    # SIGKILL the job script itself, as the OOM killer would; its trap cannot write the sentinel.
+    kill = "import os, signal, time; time.sleep(0.3); os.kill(os.getppid(), signal.SIGKILL); time.sleep(5)"
+    started = time.monotonic()
+    with pytest.raises(RuntimeError, match="wrote no exit code"):
+        background_executor.run(python_cmd(kill), name="killed")
+    assert time.monotonic() - started < 30
+    assert not background_executor.sentinel_path("killed").exists()
+
+
+def test_max_wait_fails_job_without_status_command(tmp_path):
+    submit = tmp_path / "submit.sh"
+    submit.write_text(SUBMIT_STUB)
+    executor = BatchScriptExecutor(tmp_path / "jobs", "slurm", f"bash {submit}", poll_interval=0.1, max_wait=0.5)
+    with pytest.raises(TimeoutError):
+        executor.run(python_cmd("import time; time.sleep(3)"), name="slow")
+
+
+def test_status_command_defaults_only_with_scheduler_submit(tmp_path):
+    assert BatchScriptExecutor(tmp_path, "slurm").status_cmd == ["squeue", "-h", "-j", "{job_id}"]
+    assert BatchScriptExecutor(tmp_path, "pbs").status_cmd == ["qstat", "{job_id}"]
+    assert BatchScriptExecutor(tmp_path, "slurm", submit_cmd="bash").status_cmd == []
@@ -0,0 +1,29 @@
+from pathlib import Path
+
+import pytest
+
+from cellecta_sc_pipeline.shared.fastq_chunks import lane_chunks
+
+
+def lanes(sample, read, count=2):
+    return [Path(f"{sample}_S1_L00{lane}_{read}_001.fastq.gz") for lane in range(1, count + 1)]
+
+
+@pytest.mark.parametrize("sample", ["S1", "R1xR1", "pool_R1_rep"])
+def test_lane_chunks_pairs_on_the_read_token(sample):
+    r1_files, r2_files = lanes(sample, "R1"), lanes(sample, "R2")
+
+    assert lane_chunks(r1_files, r2_files) == list(zip(r1_files, r2_files))
+
+
+def test_lane_chunks_rejects_mismatched_lanes():
+    r1_files = lanes("S1", "R1")
+    r2_files = list(reversed(lanes("S1", "R2")))
+
+    with pytest.raises(ValueError, match="do not pair up"):
+        lane_chunks(r1_files, r2_files)
+
+
+def test_lane_chunks_rejects_uneven_counts():
+    with pytest.raises(ValueError, match="cannot pair lanes"):
+        lane_chunks(lanes("S1", "R1", 2), lanes("S1", "R2", 1))
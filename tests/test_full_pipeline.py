@@ -0,0 +1,27 @@
+from types import SimpleNamespace
+
+from cellecta_sc_pipeline.pipelines.full_pipeline import assignment_allocation
+from cellecta_sc_pipeline.shared.executors import BatchScriptExecutor, LocalExecutor
+
+
+def pipeline_args(**overrides):
+    values = {"jobs": 4, "max_cpus": 32, "max_mem_gb": 64.0, "executor": LocalExecutor()}
+    values.update(overrides)
+    return SimpleNamespace(**values)
+
+
+def test_local_assignment_budget_is_split_between_concurrent_samples():
+    assert assignment_allocation(pipeline_args(), 10) == (4, 8, 16.0)
+
+
+def test_assignment_concurrency_is_capped_by_sample_count():
+    assert assignment_allocation(pipeline_args(), 2) == (2, 16, 32.0)
+
+
+def test_single_job_keeps_the_whole_budget():
+    assert assignment_allocation(pipeline_args(jobs=1, max_cpus=None, max_mem_gb=None), 3) == (1, None, None)
+
+
+def test_cluster_jobs_each_get_the_whole_budget(tmp_path):
+    executor = BatchScriptExecutor(tmp_path, "slurm", "bash")
+    assert assignment_allocation(pipeline_args(executor=executor), 10) == (4, 32, 64.0)
@@ -0,0 +1,42 @@
+import argparse
+import os
+import sys
+from pathlib import Path
+
+from cellecta_sc_pipeline.shared.in_process import absolute_path_args, run_in_process
+
+HELPER = """
+import argparse
+import os
+
+
+def build_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--output", required=True)
+    return parser
+
+
+def main(args):
+    with open(args.output, "w") as handle:
+        handle.write(os.getcwd())
+"""
+
+
+def test_absolute_path_args_resolves_set_options_only(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    args = argparse.Namespace(out_root="out", reference=Path("ref.txt"), scratch_dir=None)
+    absolute_path_args(args, ["out_root", "reference", "scratch_dir"])
+    assert args.out_root == str(tmp_path / "out")
+    assert args.reference == tmp_path / "ref.txt"
+    assert args.scratch_dir is None
+
+
+def test_in_process_helper_keeps_working_directory(tmp_path):
+    helper = tmp_path / "helper.py"
+    helper.write_text(HELPER)
+    output = tmp_path / "out" / "cwd.txt"
+    output.parent.mkdir()
+    before = os.getcwd()
+    run_in_process([sys.executable, str(helper), "--output", str(output)])
+    assert os.getcwd() == before
+    assert output.read_text() == before
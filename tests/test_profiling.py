@@ -0,0 +1,65 @@
+import sys
+import threading
+
+from cellecta_sc_pipeline.shared.profiling import RunProfiler, load_profile, summarize_profile
+
+
+def records_by_stage(path):
+    return {record["stage"]: record for record in load_profile(path)}
+
+
+def test_serial_and_nested_measurements_are_exact(tmp_path):
+    profiler = RunProfiler(tmp_path / "run_profile.jsonl", "run")
+
+    with profiler.measure("outer"):
+        with profiler.measure("inner"):
+            pass
+    profiler.run([sys.executable, "-c", "pass"], stage="child")
+
+    records = records_by_stage(profiler.path)
+    assert records["outer"]["approximate"] is False
+    assert records["inner"]["approximate"] is False
+    assert "approximate" not in records["child"]
+
+
+def test_measurement_overlapped_by_another_thread_is_approximate(tmp_path):
+    profiler = RunProfiler(tmp_path / "run_profile.jsonl", "run")
+    started, release = threading.Event(), threading.Event()
+
+    def other_stage():
+        with profiler.measure("other"):
+            started.set()
+            release.wait(10)
+
+    thread = threading.Thread(target=other_stage)
+    with profiler.measure("first"):
+        thread.start()
+        started.wait(10)
+    with profiler.measure("second"):
+        pass
+    release.set()
+    thread.join()
+    with profiler.measure("after"):
+        pass
+
+    records = records_by_stage(profiler.path)
+    assert records["first"]["approximate"] is True
+    assert records["second"]["approximate"] is True
+    assert records["other"]["approximate"] is True
+    assert records["after"]["approximate"] is False
+    rows = {row["stage"]: row for row in summarize_profile(load_profile(profiler.path))}
+    assert rows["first"]["approximate_runs"] == 1
+    assert rows["after"]["approximate_runs"] == 0
+
+
+def test_subprocess_stage_in_another_thread_overlaps(tmp_path):
+    profiler = RunProfiler(tmp_path / "run_profile.jsonl", "run")
+
+    with profiler.measure("in_process"):
+        thread = threading.Thread(
+            target=profiler.run, args=([sys.executable, "-c", "pass"],), kwargs={"stage": "child"}
+        )
+        thread.start()
+        thread.join()
+
+    assert records_by_stage(profiler.path)["in_process"]["approximate"] is True
@@ -0,0 +1,54 @@
+import threading
+import time
+
+from cellecta_sc_pipeline.shared.fastq_chunks import run_parallel
+from cellecta_sc_pipeline.shared.scheduler import run_sample_jobs, stage_slot
+
+
+class ConcurrencyProbe:
+    """Worker that runs parallel extract chunks, like --extract_jobs, and records the peak overlap."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.running = 0
+        self.peak = 0
+        self.budgets = []
+
+    def chunk(self, budget):
+        with stage_slot(budget, "extract"):
+            with self.lock:
+                self.running += 1
+                self.peak = max(self.peak, self.running)
+            time.sleep(0.1)
+            with self.lock:
+                self.running -= 1
+
+    def __call__(self, chunks, *, budget):
+        self.budgets.append(budget)
+        run_parallel(range(chunks), lambda _: self.chunk(budget), chunks)
+
+
+def test_single_job_batch_respects_cpu_limit(tmp_path):
+    probe = ConcurrencyProbe()
+    failed = run_sample_jobs(
+        [("S1", (6,))], probe, jobs=1, log_dir=tmp_path, keep_going=False, max_cpus=2,
+    )
+    assert failed == []
+    assert probe.budgets[0] is not None
+    assert probe.peak == 2
+
+
+def test_single_job_batch_respects_memory_limit(tmp_path):
+    probe = ConcurrencyProbe()
+    run_sample_jobs(
+        [("S1", (4,))], probe, jobs=1, log_dir=tmp_path, keep_going=False,
+        max_cpus=8, max_mem_gb=4, stage_resources={"extract": (1, 2.0)},
+    )
+    assert probe.peak == 2
+
+
+def test_single_job_without_limits_runs_unbudgeted(tmp_path):
+    probe = ConcurrencyProbe()
+    run_sample_jobs([("S1", (3,))], probe, jobs=1, log_dir=tmp_path, keep_going=False)
+    assert probe.budgets == [None]
+    assert probe.peak == 3
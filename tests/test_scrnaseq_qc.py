@@ -0,0 +1,95 @@
+import gzip
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+from scipy import io, sparse
+
+from conftest import REPO_ROOT
+
+pytest.importorskip("scanpy")
+
+N_CELLS = 2000
+N_GENES = 600  # calculate_qc_metrics reports the top 500 genes
+
+
+def write_sample(root):
+    """Small cellranger-style matrix plus CloneTracker tables for N_CELLS cells."""
+    rng = np.random.default_rng(0)
+    matrix_dir = root / "outs" / "filtered_feature_bc_matrix"
+    matrix_dir.mkdir(parents=True)
+    counts = sparse.random(N_GENES, N_CELLS, density=0.05, format="coo", random_state=1)
+    counts.data = rng.integers(1, 20, size=counts.nnz).astype(float)
+    with gzip.open(matrix_dir / "matrix.mtx.gz", "wb") as handle:
+        io.mmwrite(handle, counts.astype(np.int64), field="integer")
+
+    cells = ["".join(rng.choice(list("ACGT"), 16)) for _ in range(N_CELLS)]
+    with gzip.open(matrix_dir / "barcodes.tsv.gz", "wt") as handle:
+        handle.writelines(f"{cell}-1\n" for cell in cells)
+    genes = [f"MT-{index}" if index < 10 else f"GENE{index}" for index in range(N_GENES)]
+    with gzip.open(matrix_dir / "features.tsv.gz", "wt") as handle:
+        handle.writelines(f"ENS{gene}\t{gene}\tGene Expression\n" for gene in genes)
+
+    summary = root / "summary.tsv"
+    umi_table = root / "umi_table.tsv"
+    with open(summary, "w") as handle, open(umi_table, "w") as umis:
+        handle.write("cell\tfinal_assigned_barcode\tumi_count\tbarcode_type\n")
+        umis.write("cell_barcode\tclonetracker_barcodes\tclonetracker_barcode_umis\n")
+        for index, cell in enumerate(cells[: N_CELLS // 2]):
+            barcode = f"bc14-{index % 40}_bc30-{index % 7}"
+            handle.write(f"{cell}\t{barcode}\t{10 + index % 50}\tOne Barcode\n")
+            umis.write(f"{cell}-1\t{barcode}\t{10 + index % 50}\n")
+    return root / "outs", summary, umi_table
+
+
+def qc_argv(tmp_path):
+    outs, summary, umi_table = write_sample(tmp_path / "S1")
+    return [
+        "--input", str(outs),
+        "--output", str(tmp_path / "qc"),
+        "--sample-name", "S1",
+        "--clonetracker-summary", str(summary),
+        "--clonetracker-umi", str(umi_table),
+        "--min-genes", "1",
+        "--min-counts", "1",
+        "--max-mt-pct", "100",
+    ]
+
+
+def run_python(args):
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [str(REPO_ROOT / "src"), env.get("PYTHONPATH")]))
+    env.pop("NUMBA_THREADING_LAYER", None)
+    result = subprocess.run(
+        [sys.executable] + args,
+        env=env,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        text=True,
+        timeout=120,
+    )
+    assert result.returncode == 0, result.stdout
+
+
+def test_parallel_figure_rendering_exits(tmp_path):
+    output = tmp_path / "qc"
+    # A pool forked after scanpy/numba had started hung here at interpreter exit.
+    run_python(["-m", "cellecta_sc_pipeline.shared.scrnaseq_qc"] + qc_argv(tmp_path) + ["--figure-workers", "2"])
+    for figure in ("qc_violin", "clonetracker_barcode_type_barplot", "clone_size_top50"):
+        assert (output / f"S1.{figure}.png").stat().st_size > 0
+
+
+def test_qc_in_a_worker_thread_exits(tmp_path):
+    # The full pipeline runs in-process QC on a task thread; numba's TBB layer
+    # started there used to hang the interpreter at exit.
+    code = (
+        "import sys, threading\n"
+        "from cellecta_sc_pipeline.shared.scrnaseq_qc import main\n"
+        "thread = threading.Thread(target=main, args=(sys.argv[1:],))\n"
+        "thread.start()\n"
+        "thread.join()\n"
+    )
+    run_python(["-c", code] + qc_argv(tmp_path))
+    assert (tmp_path / "qc" / "qc_summary.tsv").exists()
@@ -0,0 +1,143 @@
+import random
+
+import pytest
+
+
+def brute_force_match(sequence, sgrna_set):
+    """Longest guide found anywhere in the read, leftmost among equal lengths."""
+    for length in sorted({len(guide) for guide in sgrna_set}, reverse=True):
+        for index in range(len(sequence) - length + 1):
+            if sequence[index:index + length] in sgrna_set:
+                return sequence[index:index + length]
+    return ""
+
+
+def random_sequence(rng, length):
+    return "".join(rng.choice("ACGT") for _ in range(length))
+
+
+def test_prefix_index_matches_brute_force_scan(load_script):
+    script = load_script("process_sgrna_umis")
+    rng = random.Random(0)
+    guides = {random_sequence(rng, rng.randint(17, 23)) for _ in range(40)}
+    # Guides that are prefixes or extensions of other guides.
+    for guide in list(guides)[:10]:
+        guides.add(guide[:-2])
+        guides.add(guide + random_sequence(rng, 3))
+    # Several guides sharing a prefix of the shortest guide length.
+    shared = random_sequence(rng, 17)
+    guides.update(shared + random_sequence(rng, extra) for extra in (0, 2, 4))
+    lengths = sorted({len(guide) for guide in guides}, reverse=True)
+    prefix_index = script.build_prefix_index(guides, lengths)
+    guide_list = sorted(guides)
+
+    for _ in range(2000):
+        read = random_sequence(rng, rng.randint(0, 20))
+        for _ in range(rng.randint(0, 2)):
+            read += rng.choice(guide_list)[: rng.randint(10, 25)] + random_sequence(rng, rng.randint(0, 6))
+        assert script.find_sgrna_match(read, guides, prefix_index) == brute_force_match(read, guides), read
+
+
+def test_longer_guide_wins_over_its_prefix(load_script):
+    script = load_script("process_sgrna_umis")
+    short, longer = "ACGTACGTACGTACGTAC", "ACGTACGTACGTACGTACGG"
+    guides = {short, longer, "TTTTGGGGCCCCAAAATT"}
+    prefix_index = script.build_prefix_index(guides, [20, 18])
+
+    assert script.find_sgrna_match("NN" + longer + "NN", guides, prefix_index) == longer
+    assert script.find_sgrna_match("NN" + short + "TT", guides, prefix_index) == short
+    # The shorter guide is to the left, but the longer one still wins.
+    read = "TTTTGGGGCCCCAAAATT" + "A" + longer
+    assert script.find_sgrna_match(read, guides, prefix_index) == longer
+    assert script.find_sgrna_match("ACGTACGTACGTACG", guides, prefix_index) == ""
+    assert script.find_sgrna_match("", guides, prefix_index) == ""
+
+
+LEFT_CONSTANT = "TTGGAAAGGACGAAACACCG"
+RIGHT_CONSTANT = "GTTTAAGAGC"
+FEATURE_HEADER = "id,name,read,pattern,sequence,feature_type\n"
+
+
+def write_feature_reference(path, rows):
+    path.write_text(FEATURE_HEADER + "".join(",".join(row) + ",CRISPR Guide Capture\n" for row in rows))
+    return path
+
+
+def test_compile_feature_pattern(load_script):
+    script = load_script("process_sgrna_umis")
+    Anchor = script.FeatureAnchor
+
+    assert script.compile_feature_pattern("(BC)") is None
+    assert script.compile_feature_pattern("ACG(BC)") is None
+    assert script.compile_feature_pattern(LEFT_CONSTANT + "(BC)" + RIGHT_CONSTANT) == Anchor("left", LEFT_CONSTANT, 0)
+    assert script.compile_feature_pattern("acgtacNN(BC)") == Anchor("left", "ACGTAC", 2)
+    assert script.compile_feature_pattern("(BC)NN" + RIGHT_CONSTANT) == Anchor("right", RIGHT_CONSTANT, 2)
+    assert script.compile_feature_pattern("5PNNNN(BC)") == Anchor("start", "", 4)
+    assert script.compile_feature_pattern("^NN(BC)") == Anchor("start", "", 2)
+    assert script.compile_feature_pattern("(BC)NNN3P") == Anchor("end", "", 3)
+    # On the opposite strand a 5' flank becomes a 3' flank.
+    assert script.compile_feature_pattern(LEFT_CONSTANT + "(BC)", reverse_complement=True) == Anchor(
+        "right", script.reverse_complement_seq(LEFT_CONSTANT), 0
+    )
+    assert script.compile_feature_pattern("5PNN(BC)", reverse_complement=True) == Anchor("end", "", 2)
+    for unsupported in ("", "BC", "ACGT(BC)(BC)", "NNXX(BC)"):
+        with pytest.raises(ValueError):
+            script.compile_feature_pattern(unsupported)
+
+
+def test_load_feature_anchors_groups_guides(load_script, tmp_path):
+    script = load_script("process_sgrna_umis")
+    reference = write_feature_reference(tmp_path / "features.csv", [
+        ("g1", "g1", "R2", LEFT_CONSTANT + "(BC)", "ACGTACGTACGTACGTACGT"),
+        ("g2", "g2", "R2", LEFT_CONSTANT + "(BC)", "TTTTACGTACGTACGTACGTAA"),
+        ("g3", "g3", "R2", "(BC)" + RIGHT_CONSTANT, "GGGGCCCCGGGGCCCCGGGG"),
+    ])
+
+    anchors, has_unanchored = script.load_feature_anchors(reference)
+
+    assert has_unanchored is False
+    assert anchors == [
+        (script.FeatureAnchor("left", LEFT_CONSTANT, 0), {"ACGTACGTACGTACGTACGT", "TTTTACGTACGTACGTACGTAA"}, [22, 20]),
+        (script.FeatureAnchor("right", RIGHT_CONSTANT, 0), {"GGGGCCCCGGGGCCCCGGGG"}, [20]),
+    ]
+
+
+def test_anchored_match_on_either_side(load_script, tmp_path):
+    script = load_script("process_sgrna_umis")
+    reference = write_feature_reference(tmp_path / "features.csv", [
+        ("g1", "g1", "R2", LEFT_CONSTANT + "(BC)", "ACGTACGTACGTACGTACGT"),
+        ("g3", "g3", "R2", "(BC)" + RIGHT_CONSTANT, "GGGGCCCCGGGGCCCCGGGG"),
+    ])
+    anchors, _ = script.load_feature_anchors(reference)
+
+    assert script.find_anchored_sgrna_match("NNN" + LEFT_CONSTANT + "ACGTACGTACGTACGTACGT" + "AAAA", anchors) == (
+        "ACGTACGTACGTACGTACGT"
+    )
+    assert script.find_anchored_sgrna_match("NNN" + "GGGGCCCCGGGGCCCCGGGG" + RIGHT_CONSTANT, anchors) == (
+        "GGGGCCCCGGGGCCCCGGGG"
+    )
+    # Anchor present but an unknown guide next to it.
+    assert script.find_anchored_sgrna_match(LEFT_CONSTANT + "T" * 20, anchors) == ""
+    # A guide without its flank is not found by the anchored path.
+    assert script.find_anchored_sgrna_match("NNN" + "ACGTACGTACGTACGTACGT", anchors) is None
+
+
+def test_blank_and_unsupported_patterns_fall_back_to_the_scan(load_script, tmp_path):
+    script = load_script("process_sgrna_umis")
+    reference = write_feature_reference(tmp_path / "features.csv", [
+        ("g1", "g1", "R2", LEFT_CONSTANT + "(BC)", "ACGTACGTACGTACGTACGT"),
+        ("g4", "g4", "R2", "", "CCCCAAAACCCCAAAACCCC"),
+        ("g5", "g5", "R2", "not-a-pattern", "GATCGATCGATCGATCGATC"),
+    ])
+    feature_anchors = script.load_feature_anchors(reference)
+    sgrna_set, lengths, prefix_index = script.load_sgrna_reference(reference)
+
+    assert feature_anchors[1] is True
+    assert [guides for _, guides, _ in feature_anchors[0]] == [{"ACGTACGTACGTACGTACGT"}]
+    for guide in ("CCCCAAAACCCCAAAACCCC", "GATCGATCGATCGATCGATC"):
+        read = "NNNN" + guide + "NNNN"
+        assert script.find_anchored_sgrna_match(read, feature_anchors[0]) is None
+        assert script.match_sgrna(read, sgrna_set, prefix_index, feature_anchors) == guide
+    # Next to the anchor of another guide, the scan still finds an unanchored guide.
+    read = LEFT_CONSTANT + "CCCCAAAACCCCAAAACCCC"
+    assert script.match_sgrna(read, sgrna_set, prefix_index, feature_anchors) == "CCCCAAAACCCCAAAACCCC"
@@ -0,0 +1,78 @@
+"""`--help` must stay fast: no entry point may import the analysis stack at startup."""
+
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+
+import pytest
+
+from conftest import REPO_ROOT, SCRIPTS_DIR
+
+HEAVY_MODULES = ("scanpy", "matplotlib", "numba")
+# --help takes about 0.1s; importing scanpy alone takes several seconds.
+MAX_STARTUP_SECONDS = 1.0
+
+
+def project_scripts():
+    """(name, "module:function") pairs of [project.scripts]; tomllib needs Python 3.11."""
+    text = (REPO_ROOT / "pyproject.toml").read_text()
+    section = re.search(r"^\[project\.scripts\]\n(.*?)(?=^\[|\Z)", text, re.M | re.S)
+    return sorted(re.findall(r'^([\w.-]+)\s*=\s*"([\w.]+:\w+)"', section.group(1), re.M))
+
+
+ENTRY_POINTS = project_scripts()
+ASSIGN_SCRIPTS = ["assign_final_barcodes.py", "assign_final_sgrnas.py"]
+
+REPORT = (
+    "import json, sys\n"
+    "print(json.dumps(sorted(name for name in {heavy} if name in sys.modules)))\n"
+)
+
+
+def run_help(code):
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [str(REPO_ROOT / "src"), env.get("PYTHONPATH")]))
+    started = time.monotonic()
+    result = subprocess.run(
+        [sys.executable, "-c", code],
+        env=env,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True,
+        timeout=60,
+    )
+    elapsed = time.monotonic() - started
+    assert result.returncode == 0, result.stderr
+    assert "usage:" in result.stdout
+    return json.loads(result.stdout.strip().splitlines()[-1]), elapsed
+
+
+def wrap(call):
+    return (
+        "import sys\n"
+        "try:\n"
+        f"    {call}\n"
+        "except SystemExit as exc:\n"
+        "    assert exc.code in (0, None), exc.code\n"
+        + REPORT.format(heavy=HEAVY_MODULES)
+    )
+
+
+@pytest.mark.parametrize("name,target", ENTRY_POINTS, ids=[name for name, _ in ENTRY_POINTS])
+def test_entry_point_help_is_light(name, target):
+    module, func = target.split(":")
+    imported, elapsed = run_help(wrap(f"import {module} as entry; entry.{func}(['--help'])"))
+    assert imported == []
+    assert elapsed < MAX_STARTUP_SECONDS
+
+
+@pytest.mark.parametrize("script", ASSIGN_SCRIPTS)
+def test_assign_script_help_is_light(script):
+    path = SCRIPTS_DIR / script
+    call = f"import runpy; sys.argv = [{str(path)!r}, '--help']; runpy.run_path({str(path)!r}, run_name='__main__')"
+    imported, elapsed = run_help(wrap(call))
+    assert imported == []
+    assert elapsed < MAX_STARTUP_SECONDS
@@ -0,0 +1,54 @@
+import time
+
+import pytest
+
+from cellecta_sc_pipeline.shared.scheduler import stage_slot
+from cellecta_sc_pipeline.shared.work_queue import SampleQueue, drain_queue, run_claimed
+
+
+def test_worker_stops_at_next_stage_after_losing_lease(tmp_path):
+    queue = SampleQueue(tmp_path / "queue", lease_seconds=4)
+    stages = []
+
+    def worker(sample, *, budget):
+        with stage_slot(budget, "first"):
+            stages.append("first")
+            # Another worker reclaims the sample while this stage runs.
+            queue.path(sample, "lock").write_text("other-host:1\n")
+            time.sleep(queue.heartbeat_seconds * 1.5)
+        with stage_slot(budget, "second"):
+            stages.append("second")
+
+    run_claimed(queue, worker, "S1")
+
+    assert stages == ["first"]
+    assert not queue.finished("S1")
+    assert queue.path("S1", "lock").read_text() == "other-host:1\n"
+
+
+def test_worker_failure_leaves_failed_marker(tmp_path):
+    queue = SampleQueue(tmp_path / "queue")
+
+    def worker(sample, *, budget):
+        with stage_slot(budget, "first"):
+            raise ValueError("bad input")
+
+    with pytest.raises(ValueError):
+        run_claimed(queue, worker, "S1")
+
+    assert queue.path("S1", "failed").exists()
+    assert not queue.path("S1", "lock").exists()
+
+
+def test_drain_queue_reports_failures_of_other_workers(tmp_path):
+    queue = SampleQueue(tmp_path / "queue")
+    samples = [("S1", ("S1",)), ("S2", ("S2",)), ("S3", ("S3",))]
+    # S2 was failed by a runner on another node.
+    queue.finish("S2", "failed", "ValueError()")
+
+    def run_pass(todo):
+        for sample, _ in todo:
+            queue.finish(sample, "done")
+        return []
+
+    assert drain_queue(queue, samples, run_pass, keep_going=True) == ["S2"]